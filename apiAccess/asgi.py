@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
+
+Run with uvicorn, e.g.
+    uvicorn apiAccess.asgi:application --host 0.0.0.0 --port 8000 --workers 4
 """
 
 import os
@@ -12,5 +15,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "apiAccess.settings")
+# Serve the Siri endpoints with their native async views under ASGI
+os.environ.setdefault("SIRI_ASYNC_VIEWS", "True")
 
 application = get_asgi_application()
@@ -4,11 +4,17 @@ Custom middleware to ensure user data is always fresh from the database.
 This middleware addresses an issue where Django's session authentication
 could cache stale user objects in memory, causing user data (like expenses)
 to not appear after a logout/login cycle.
+
+UserTimezoneMiddleware then activates the user's own time zone, so "today",
+report periods and displayed times follow their wall clock.
 """
 
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.utils.deprecation import MiddlewareMixin
 
+from userprofile.models import user_timezone
+
 
 class RefreshUserMiddleware(MiddlewareMixin):
     """
@@ -26,10 +32,22 @@ class RefreshUserMiddleware(MiddlewareMixin):
         if request.user.is_authenticated:
             try:
                 # Refresh the user object from the database to ensure it's not stale
-                request.user = User.objects.get(pk=request.user.pk)
+                # The profile comes along for UserTimezoneMiddleware
+                request.user = User.objects.select_related('profile').get(pk=request.user.pk)
             except User.DoesNotExist:
                 # If the user doesn't exist anymore, they will be logged out
                 from django.contrib.auth import logout
                 logout(request)
         
         return None
+
+
+class UserTimezoneMiddleware(MiddlewareMixin):
+    """Activate the authenticated user's time zone for the request"""
+
+    def process_request(self, request):
+        if request.user.is_authenticated:
+            timezone.activate(user_timezone(request.user))
+        else:
+            timezone.deactivate()
+        return None
@@ -57,6 +57,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     # Custom middleware to refresh user data from database on each request
     "apiAccess.middleware.RefreshUserMiddleware",
+    "apiAccess.middleware.UserTimezoneMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -67,13 +68,24 @@ TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
         "DIRS": [BASE_DIR / 'templates'],
-        "APP_DIRS": True,
         "OPTIONS": {
             "context_processors": [
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
             ],
+            # Compiled templates are kept for the life of the process, also with
+            # DEBUG on. runserver's autoreloader resets them when a template
+            # changes; production processes need a restart to pick up edits
+            "loaders": [
+                (
+                    "django.template.loaders.cached.Loader",
+                    [
+                        "django.template.loaders.filesystem.Loader",
+                        "django.template.loaders.app_directories.Loader",
+                    ],
+                ),
+            ],
         },
     },
 ]
@@ -176,3 +188,70 @@ BASE_URL = os.environ.get('BASE_URL', 'http://localhost:8000')
 # Email configuration
 DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'noreply@talk2ledger.com')
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'  # Change to SMTP in production
+
+# Siri API: how long a resolved per-user API token is trusted from the
+# in-process cache before it is looked up again (bounds revocation delay)
+API_TOKEN_CACHE_SECONDS = int(os.environ.get('API_TOKEN_CACHE_SECONDS', 60))
+
+# Maximum number of expenses accepted by /api/siri/add-expenses/ in one request
+SIRI_MAX_BATCH_SIZE = int(os.environ.get('SIRI_MAX_BATCH_SIZE', 500))
+
+# Idempotency keys older than this are pruned by `manage.py housekeeping`;
+# a Shortcut retrying after this long is treated as a new request
+SIRI_REQUEST_TTL_DAYS = int(os.environ.get('SIRI_REQUEST_TTL_DAYS', 30))
+
+# Route the Siri endpoints to their native async views. apiAccess/asgi.py
+# turns this on, so it only needs setting explicitly to override that.
+SIRI_ASYNC_VIEWS = os.environ.get('SIRI_ASYNC_VIEWS', 'False') == 'True'
+
+# add-expense ingestion: 'direct' writes to the database in the request;
+# 'journal' appends to a local write-ahead journal and answers 202, and
+# `manage.py drain_journal` commits entries in batches
+SIRI_INGEST_MODE = os.environ.get('SIRI_INGEST_MODE', 'direct')
+SIRI_JOURNAL_PATH = os.environ.get('SIRI_JOURNAL_PATH', str(BASE_DIR / 'var' / 'siri-journal.jsonl'))
+
+# "shared" must be visible to every worker process (rate limit buckets, shed
+# counters). The file cache works for one host; point SHARED_CACHE_BACKEND /
+# SHARED_CACHE_LOCATION at Redis or Memcached when running several hosts.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': os.environ.get('SHARED_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('SHARED_CACHE_LOCATION', str(BASE_DIR / 'var' / 'cache')),
+    },
+    # {% cache %} fragments of the report pages; keyed by the user's data
+    # version, so a per-process cache never serves stale fragments
+    'template_fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'template-fragments',
+    },
+}
+
+# Siri write endpoints: per-user and per-API-token token buckets (429 when
+# exceeded; a rate of 0 disables them), and a cap on concurrent writes across
+# all worker processes on this host (503 when exceeded; 0 or less means no cap)
+SIRI_THROTTLE_CACHE = 'shared'
+SIRI_RATE_LIMIT_PER_MINUTE = int(os.environ.get('SIRI_RATE_LIMIT_PER_MINUTE', 60))
+SIRI_RATE_LIMIT_BURST = int(os.environ.get('SIRI_RATE_LIMIT_BURST', 20))
+SIRI_MAX_CONCURRENT_WRITES = int(os.environ.get('SIRI_MAX_CONCURRENT_WRITES', 16))
+SIRI_ADMISSION_DIR = os.environ.get('SIRI_ADMISSION_DIR', str(BASE_DIR / 'var' / 'admission'))
+
+# Expense report pages log a warning when building the report takes longer
+REPORT_LATENCY_TARGET_MS = int(os.environ.get('REPORT_LATENCY_TARGET_MS', 200))
+
+# Transactions shown per page on report pages ("load more" fetches the next page)
+EXPENSE_PAGE_SIZE = int(os.environ.get('EXPENSE_PAGE_SIZE', 50))
+
+# Month-to-date spend counters for budget status. Any cache alias works
+# (locmem only for a single process; file or database cache, e.g.
+# SHARED_CACHE_BACKEND=django.core.cache.backends.db.DatabaseCache, across
+# processes). Counters are rebuilt from the database once they expire.
+SPEND_COUNTER_CACHE = os.environ.get('SPEND_COUNTER_CACHE', 'shared')
+SPEND_COUNTER_TTL = int(os.environ.get('SPEND_COUNTER_TTL', 3600))
+
+# Spend-over-time series (/api/reports/series/): the part of a range before
+# the current month is cached here, per user, until a write touches it.
+SERIES_CACHE = os.environ.get('SERIES_CACHE', 'shared')
+SERIES_CACHE_TTL = int(os.environ.get('SERIES_CACHE_TTL', 86400))
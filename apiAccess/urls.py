@@ -23,5 +23,6 @@ urlpatterns = [
     path('accounts/', include('django.contrib.auth.urls')),
     path('profile/', include('userprofile.urls')),
     path('api/siri/', include('siriapi.urls')),
+    path('api/reports/', include('expenses.api_urls')),
     path('', include('expenses.urls')),
 ]
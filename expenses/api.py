@@ -0,0 +1,229 @@
+"""
+JSON versions of the expense reports for the iOS app.
+
+Each endpoint mirrors a report page and is built from the same
+get_expenses_report() computation. The client authenticates with a per-user
+API token and picks the sections it wants with fields=, e.g.
+fields=totals for a widget or fields=rows&cursor=... to page through
+transactions, so only those are queried and serialized.
+"""
+
+import logging
+from datetime import date
+from functools import wraps
+
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import require_http_methods
+
+from siriapi.models import Budget
+from siriapi.series import BUCKETS, bucket_count, spend_series
+from siriapi.tokens import user_for_token
+from siriapi.views import get_bearer_token
+from userprofile.models import user_timezone
+
+from .dates import month_range, week_range
+from .etags import report_condition
+from .views import REPORT_FIELDS, compare_budgets, export_response, get_expenses_report, money
+
+logger = logging.getLogger(__name__)
+
+# Ten years of days
+MAX_SERIES_BUCKETS = 3660
+
+
+def error_response(message, status=400):
+    return JsonResponse({'ok': False, 'error': message}, status=status)
+
+
+def token_required(view):
+    """Authenticate with a per-user API token and run the view in the user's time zone"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = get_bearer_token(request)
+        user = user_for_token(token) if token else None
+        if not user:
+            logger.warning("Report API authentication failed")
+            return error_response('Unauthorized - invalid or missing API token', status=401)
+        request.user = user
+        with timezone.override(user_timezone(user)):
+            response = view(request, *args, **kwargs)
+        patch_vary_headers(response, ['Authorization'])
+        return response
+    return wrapper
+
+
+def parse_fields(value):
+    """The report fields named in a comma-separated fields= value; all of them if empty"""
+    if not value:
+        return REPORT_FIELDS
+    fields = tuple(field.strip() for field in value.split(',') if field.strip())
+    unknown = [field for field in fields if field not in REPORT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}; choose from {', '.join(REPORT_FIELDS)}")
+    return fields
+
+
+def report_json(context, fields):
+    """The requested sections of a get_expenses_report() context"""
+    data = {
+        'ok': True,
+        'start': context['period_start'],
+        'end': context['period_end'],
+    }
+    if 'totals' in fields:
+        data['totals'] = {'total': money(context['total_amount']), 'count': context['expense_count']}
+    if 'categories' in fields:
+        data['categories'] = [
+            {
+                'category': cat['category'], 'total': money(cat['total']),
+                'count': cat['count'], 'budget': money(cat['budget']),
+            }
+            for cat in context['totals_by_category']
+        ]
+    if 'budget' in fields:
+        budget_info = context['budget_info']
+        data['budget'] = {
+            'overall': money(budget_info['overall_budget']),
+            'spent': money(budget_info['spent']),
+            'remaining': money(budget_info['remaining']),
+            'categories': {name: money(amount) for name, amount in budget_info['category_budgets'].items()},
+        }
+    if 'rows' in fields:
+        data['rows'] = [dict(row, amount=money(row['amount'])) for row in context['expenses']]
+        data['next_cursor'] = context['next_cursor']
+    return data
+
+
+def report_response(request, start, end):
+    try:
+        fields = parse_fields(request.GET.get('fields'))
+        context = get_expenses_report(
+            request.user, start, end, None, request.GET.get('search'), fields, request.GET.get('cursor')
+        )
+    except ValueError as e:
+        return error_response(str(e))
+    return JsonResponse(report_json(context, fields))
+
+
+@require_http_methods(["GET"])
+@token_required
+@report_condition
+def report_today(request):
+    today = timezone.localdate()
+    return report_response(request, today, today)
+
+
+@require_http_methods(["GET"])
+@token_required
+@report_condition
+def report_week(request):
+    return report_response(request, *week_range(timezone.localdate()))
+
+
+@require_http_methods(["GET"])
+@token_required
+@report_condition
+def report_month(request, year_month=None):
+    try:
+        start, end = month_range(year_month or timezone.localdate().strftime('%Y-%m'))
+    except ValueError:
+        return error_response('Invalid month format. Use YYYY-MM')
+    return report_response(request, start, end)
+
+
+def parse_range(request):
+    """(start, end) from the query string, or raise ValueError"""
+    try:
+        start = date.fromisoformat(request.GET['start'])
+        end = date.fromisoformat(request.GET['end'])
+    except (KeyError, ValueError):
+        raise ValueError('start and end are required, as YYYY-MM-DD') from None
+    if start > end:
+        raise ValueError('start must be before or equal to end')
+    return start, end
+
+
+@require_http_methods(["GET"])
+@token_required
+@report_condition
+def report_range(request):
+    try:
+        start, end = parse_range(request)
+    except ValueError as e:
+        return error_response(str(e))
+    return report_response(request, start, end)
+
+
+@require_http_methods(["GET"])
+@token_required
+@report_condition
+def report_series(request):
+    """Spend per day, week or month bucket of a range; split=category adds one series per category"""
+    try:
+        start, end = parse_range(request)
+    except ValueError as e:
+        return error_response(str(e))
+    bucket = request.GET.get('bucket', 'day')
+    if bucket not in BUCKETS:
+        return error_response(f"bucket must be one of {', '.join(BUCKETS)}")
+    split = request.GET.get('split', '')
+    if split not in ('', 'category'):
+        return error_response('split must be category or left out')
+    if bucket_count(start, end, bucket) > MAX_SERIES_BUCKETS:
+        return error_response(f"At most {MAX_SERIES_BUCKETS} buckets; choose a shorter range or a larger bucket")
+
+    starts, series = spend_series(request.user, start, end, bucket, by_category=bool(split))
+    data = {
+        'ok': True,
+        'start': start,
+        'end': end,
+        'bucket': bucket,
+        'buckets': starts,
+        'total': [money(total) for total in series.pop(None)],
+    }
+    if split:
+        data['categories'] = {name: [money(total) for total in totals] for name, totals in series.items()}
+    return JsonResponse(data)
+
+
+@require_http_methods(["GET"])
+@token_required
+@report_condition
+def report_budgets(request):
+    """Every budget (or one period's, with period=YYYY-MM) with its month-to-date spend"""
+    budgets = Budget.objects.filter(user=request.user).select_related('category').order_by('-period', '-created_at')
+    period = request.GET.get('period')
+    if period:
+        try:
+            month_range(period)
+        except ValueError:
+            return error_response('Invalid period format. Use YYYY-MM')
+        budgets = budgets.filter(period=period)
+    return JsonResponse({
+        'ok': True,
+        'budgets': [
+            {
+                'id': row['budget'].id,
+                'period': row['budget'].period,
+                'category': row['budget'].category.name if row['budget'].category_id else None,
+                'amount': money(row['budget'].amount),
+                'spent': money(row['spent']),
+                'remaining': money(row['remaining']),
+                'percent_used': f"{row['percent_used']:.1f}",
+                'is_over': row['is_over'],
+            }
+            for row in compare_budgets(request.user, list(budgets))
+        ],
+    })
+
+
+@require_http_methods(["GET"])
+@token_required
+def report_export(request):
+    """The expenses matching start, end, category and search, streamed as CSV or JSON Lines (format)"""
+    try:
+        return export_response(request.user, request.GET)
+    except ValueError as e:
+        return error_response(str(e))
@@ -0,0 +1,15 @@
+from django.urls import path
+from . import api
+
+app_name = 'reports_api'
+
+urlpatterns = [
+    path('today/', api.report_today, name='today'),
+    path('week/', api.report_week, name='week'),
+    path('month/', api.report_month, name='month'),
+    path('month/<str:year_month>/', api.report_month, name='month_specific'),
+    path('range/', api.report_range, name='range'),
+    path('series/', api.report_series, name='series'),
+    path('budgets/', api.report_budgets, name='budgets'),
+    path('export/', api.report_export, name='export'),
+]
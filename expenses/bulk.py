@@ -0,0 +1,75 @@
+"""
+Bulk actions on many expenses at once: delete, recategorize, or replace or
+append to their notes.
+
+The selected ids are read (and locked) once, then every change is a
+set-based update() or delete() over them, a chunk of ids at a time, all in
+one transaction. The rollups are adjusted once at the end, from grouped
+totals of the affected rows read before the change rather than from the
+expenses themselves.
+"""
+
+from django.db import transaction
+from django.db.models import Case, Count, Sum, TextField, Value, When
+from django.db.models.functions import Concat
+
+from siriapi.models import Category, Expense
+from siriapi.rollups import update_rollups_grouped
+
+BULK_ACTIONS = ('delete', 'recategorize', 'set_note', 'append_note')
+
+# Ids per statement, well below SQLite's limit on query parameters
+CHUNK_SIZE = 500
+
+
+def _groups(expenses):
+    """(local_date, category_id, total, count) for an Expense queryset"""
+    return list(
+        expenses.values_list('local_date', 'category')
+        .annotate(total=Sum('amount'), count=Count('id'))
+        .order_by()
+    )
+
+
+def bulk_change(user, expenses, action, category=None, note=''):
+    """Apply one of BULK_ACTIONS to the user's expenses in a queryset; returns how many changed.
+
+    category is the new category name for recategorize, note the text for
+    set_note and append_note (appended on a new line). Raises ValueError for
+    an unknown action, a missing category or nothing to append.
+    """
+    if action not in BULK_ACTIONS:
+        raise ValueError(f"action must be one of {', '.join(BULK_ACTIONS)}")
+    if action == 'recategorize' and not (category and category.strip()):
+        raise ValueError('Category is required')
+    if action == 'append_note' and not (note and note.strip()):
+        raise ValueError('Note is required')
+
+    with transaction.atomic():
+        ids = list(expenses.filter(user=user).select_for_update().order_by().values_list('id', flat=True))
+        if not ids:
+            return 0
+        new_category = Category.objects.for_name(user, category) if action == 'recategorize' else None
+        removed, added = [], []
+        for offset in range(0, len(ids), CHUNK_SIZE):
+            chunk = Expense.objects.filter(user=user, id__in=ids[offset:offset + CHUNK_SIZE])
+            groups = _groups(chunk)
+            removed += groups
+            if action == 'delete':
+                chunk.delete()
+            elif action == 'recategorize':
+                chunk.update(category=new_category)
+                added += [(day, new_category.id, total, count) for day, _, total, count in groups]
+            elif action == 'set_note':
+                chunk.update(note=note)
+                added += groups
+            else:
+                chunk.update(note=Case(
+                    When(note='', then=Value(note)),
+                    default=Concat('note', Value('\n' + note)),
+                    output_field=TextField(),
+                ))
+                added += groups
+        # Notes change no totals, but the reports show them
+        update_rollups_grouped(user.pk, added=added, removed=removed)
+    return len(ids)
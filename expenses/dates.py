@@ -0,0 +1,15 @@
+from datetime import date, timedelta
+
+
+def month_range(period):
+    """First and last day of a 'YYYY-MM' period"""
+    year, month = map(int, period.split('-'))
+    start = date(year, month, 1)
+    end = (date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)) - timedelta(days=1)
+    return start, end
+
+
+def week_range(day):
+    """Monday and Sunday of the week containing day"""
+    start = day - timedelta(days=day.weekday())
+    return start, start + timedelta(days=6)
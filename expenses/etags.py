@@ -0,0 +1,45 @@
+"""
+Conditional GETs for the report pages and the JSON report API.
+
+A report's ETag is derived from the user's data version (siriapi.versions),
+the URL and its query, the time zone and local date (so "today" and "this
+week" roll over at the user's midnight) and, for pages, the CSRF secret
+embedded in their forms. A client that sends the ETag back in If-None-Match
+gets 304 Not Modified after one version lookup, before any report queries.
+The same version keys the report pages' cached template fragments.
+"""
+
+import hashlib
+
+from django.utils import timezone
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from siriapi import versions
+
+
+def data_version(request):
+    """The user's data version, read at most once per request (also keys template fragments)"""
+    if not hasattr(request, 'data_version'):
+        request.data_version = versions.current(request.user)
+    return request.data_version
+
+
+def report_etag(request, *args, **kwargs):
+    if request.method not in ('GET', 'HEAD') or not request.user.is_authenticated:
+        return None
+    parts = (
+        request.user.pk,
+        data_version(request),
+        str(timezone.get_current_timezone()),
+        timezone.localdate().isoformat(),
+        request.path,
+        sorted(request.GET.lists()),
+        request.META.get('CSRF_COOKIE', ''),
+    )
+    return hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+
+
+def report_condition(view):
+    """Answer If-None-Match for an authenticated report view; browsers revalidate every time"""
+    return cache_control(private=True, no_cache=True)(condition(etag_func=report_etag)(view))
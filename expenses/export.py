@@ -0,0 +1,62 @@
+"""
+Streaming export of expenses as CSV or JSON Lines.
+
+Rows are read with a server-side cursor (QuerySet.iterator) and written out in
+chunks as they arrive, so memory use is the same for a hundred rows or
+millions. Both the export view and the export_expenses command use this.
+"""
+
+import csv
+import json
+
+from django.utils import timezone
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson'}
+COLUMNS = ('id', 'date', 'created_at', 'amount', 'category', 'note')
+
+# Rows fetched from the database, and written out, at a time
+CHUNK_SIZE = 2000
+
+
+class Echo:
+    """File-like object for csv.writer that hands each line back instead of storing it"""
+    def write(self, value):
+        return value
+
+
+def export_rows(expenses, tzinfo):
+    """Tuples of COLUMNS for an Expense queryset, oldest first, with created_at in tzinfo"""
+    rows = expenses.order_by('created_at', 'id').values_list(
+        'id', 'local_date', 'created_at', 'amount', 'category__name', 'note'
+    )
+    for expense_id, day, created_at, amount, category, note in rows.iterator(chunk_size=CHUNK_SIZE):
+        yield (
+            expense_id, day.isoformat(), timezone.localtime(created_at, tzinfo).isoformat(),
+            f"{amount:.2f}", category, note,
+        )
+
+
+def _csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(COLUMNS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(COLUMNS, row))) + '\n'
+
+
+def export_chunks(expenses, export_format, tzinfo):
+    """The export of an Expense queryset as strings of up to CHUNK_SIZE lines each"""
+    lines = _csv_lines if export_format == 'csv' else _jsonl_lines
+    chunk = []
+    for line in lines(export_rows(expenses, tzinfo)):
+        chunk.append(line)
+        if len(chunk) >= CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
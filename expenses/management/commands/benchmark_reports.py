@@ -0,0 +1,97 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.middleware.csrf import get_token
+from django.template import RequestContext, engines
+from django.template.engine import Engine
+from django.test import RequestFactory
+from django.urls import reverse
+from django.utils import timezone
+
+from expenses import views
+from expenses.dates import month_range, week_range
+from siriapi.versions import current
+from userprofile.models import user_timezone
+
+PAGES = ('today', 'week', 'month', 'budgets')
+
+
+def page_context(user, page):
+    """(template name, context) of a report page, as its view builds them"""
+    if page == 'budgets':
+        return 'expenses/budgets.html', views.budgets_context(user)
+    today = timezone.localdate()
+    start, end = {
+        'today': (today, today),
+        'week': week_range(today),
+        'month': month_range(today.strftime('%Y-%m')),
+    }[page]
+    context = views.get_expenses_report(user, start, end, page.title())
+    context['data_version'] = current(user)
+    return 'expenses/report.html', context
+
+
+def median_ms(function, repeat, before=None):
+    timings = []
+    for _ in range(repeat):
+        if before:
+            before()
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time a user's report pages: the whole view, and the template alone compiled on every "
+        "render (no cached loader), with cold fragment caches and with warm ones"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per measurement; the median is shown')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"Unknown user: {options['username']}")
+        repeat = max(options['repeat'], 1)
+        fragments = caches['template_fragments']
+        cached_engine = engines['django'].engine
+        uncached_engine = Engine(
+            dirs=cached_engine.dirs,
+            loaders=['django.template.loaders.filesystem.Loader', 'django.template.loaders.app_directories.Loader'],
+            context_processors=cached_engine.context_processors,
+            libraries=cached_engine.libraries,
+        )
+        factory = RequestFactory()
+
+        def request_for(path):
+            request = factory.get(path)
+            request.user = user
+            get_token(request)  # as CsrfViewMiddleware would; the rows fragment is cached per CSRF secret
+            return request
+
+        self.stdout.write(f"{'page':<10}{'view':>10}{'uncached':>10}{'cold':>10}{'warm':>10}   (median ms)")
+        with timezone.override(user_timezone(user)):
+            for page in PAGES:
+                path = reverse(f'expenses:expenses_{page}')
+                view = getattr(views, f'expenses_{page}')
+                view_ms = median_ms(lambda: view(request_for(path)), repeat)
+
+                template_name, context = page_context(user, page)
+                request = request_for(path)
+
+                def render(engine):
+                    template = engine.get_template(template_name)
+                    return template.render(RequestContext(request, context))
+
+                uncached_ms = median_ms(lambda: render(uncached_engine), repeat, before=fragments.clear)
+                cold_ms = median_ms(lambda: render(cached_engine), repeat, before=fragments.clear)
+                warm_ms = median_ms(lambda: render(cached_engine), repeat)
+                self.stdout.write(f"{page:<10}{view_ms:>10.2f}{uncached_ms:>10.2f}{cold_ms:>10.2f}{warm_ms:>10.2f}")
@@ -0,0 +1,40 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.export import EXPORT_FORMATS, export_chunks
+from expenses.views import export_query
+from userprofile.models import user_timezone
+
+
+class Command(BaseCommand):
+    help = "Export a user's expenses as CSV or JSON Lines, streamed so any number of rows fits in memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--start', help='First day (YYYY-MM-DD); needs --end. Default is every expense')
+        parser.add_argument('--end', help='Last day (YYYY-MM-DD)')
+        parser.add_argument('--category', help='Only this category')
+        parser.add_argument('--search', help='Only expenses matching this search, as on the reports')
+        parser.add_argument('--output', help='File to write; default is standard output')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"Unknown user: {options['username']}")
+        params = {key: options[key] for key in ('format', 'start', 'end', 'category', 'search') if options[key]}
+        try:
+            expenses, export_format, _, _ = export_query(user, params)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        chunks = export_chunks(expenses, export_format, user_timezone(user))
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stderr.write(self.style.SUCCESS(f"Exported to {options['output']}"))
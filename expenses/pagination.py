@@ -0,0 +1,59 @@
+"""
+Keyset (cursor) pagination for expense lists.
+
+Pages are ordered newest first on (created_at, id) and each page continues
+strictly after the last row of the previous one, so fetching page 200 costs
+the same as page 1 and rows added meanwhile never shift or repeat items.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+
+
+def encode_cursor(created_at, expense_id):
+    raw = json.dumps([created_at.isoformat(), expense_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (created_at, id) from a cursor, or raise ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, expense_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(expense_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def expense_page(expenses, cursor=None, page_size=None):
+    """Return (rows, next_cursor) for one page of an Expense queryset.
+
+    rows are dicts with id, amount, category (name), note and created_at;
+    next_cursor is None on the last page.
+    """
+    page_size = page_size or settings.EXPENSE_PAGE_SIZE
+    if cursor:
+        created_at, expense_id = decode_cursor(cursor)
+        expenses = expenses.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=expense_id)
+        )
+    rows = [
+        {
+            'id': expense_id,
+            'amount': amount,
+            'category': category,
+            'note': note,
+            'created_at': created_at
+        }
+        for expense_id, amount, category, note, created_at in expenses.order_by('-created_at', '-id').values_list(
+            'id', 'amount', 'category__name', 'note', 'created_at'
+        )[:page_size + 1]
+    ]
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
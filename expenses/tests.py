@@ -1,3 +1,653 @@
-from django.test import TestCase
+import copy
+import csv
+import io
+import json
+import re
+import unittest
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from expenses.views import budget_usage, get_expenses_report
+from siriapi.ingest import insert_expense
+from siriapi.models import Budget, Category, DataVersion, Expense
+from siriapi.rollups import update_rollups, verify
+from siriapi.tests import TEST_CACHES, reset_caches
+from siriapi.tokens import clear_cache, issue_token
+from userprofile.models import UserProfile
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ReportTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create_user(username='reporter', password='testpass123')
+        self.client.force_login(self.user)
+
+    def add_expense(self, amount, category, created_at=None):
+        cleaned = {'amount': Decimal(amount), 'category': category, 'note': ''}
+        if created_at:
+            cleaned['created_at'] = created_at
+        return insert_expense(self.user, cleaned)
+
+    def test_category_totals_ignore_case_and_spacing(self):
+        self.add_expense('10', 'Food')
+        self.add_expense('5', 'food ')
+        self.add_expense('7', 'Rent')
+        Budget.objects.create(
+            user=self.user, period=timezone.now().strftime('%Y-%m'),
+            category=Category.objects.for_name(self.user, 'FOOD'), amount=Decimal('50'),
+        )
+
+        response = self.client.get('/month/')
+        self.assertEqual(response.status_code, 200)
+        totals = {row['category']: (row['total'], row['budget']) for row in response.context['totals_by_category']}
+        self.assertEqual(totals, {'Food': (Decimal('15'), Decimal('50')), 'Rent': (Decimal('7'), None)})
+
+    def test_report_query_count_does_not_grow_with_data(self):
+        for i in range(30):
+            self.add_expense(str(i + 1), f'Category {i % 6}')
+        period = timezone.now().strftime('%Y-%m')
+        Budget.objects.create(user=self.user, period=period, category=None, amount=Decimal('1000'))
+        Budget.objects.create(
+            user=self.user, period=period, category=Category.objects.for_name(self.user, 'Category 1'), amount=Decimal('9'),
+        )
+        today = timezone.localdate()
+
+        # rollup totals, budgets, rows
+        with self.assertNumQueries(3):
+            report = get_expenses_report(self.user, today, today, 'Today')
+        self.assertEqual(report['total_amount'], sum(e['amount'] for e in report['expenses']))
+        self.assertEqual(report['expense_count'], 30)
+        self.assertEqual(report['budget_info']['remaining'], Decimal('1000') - report['total_amount'])
+
+    def test_reports_follow_the_users_time_zone(self):
+        UserProfile.objects.create(user=self.user, timezone='Asia/Tokyo')
+        # Evening of March 10th in New York, early on March 11th in Tokyo
+        expense = self.add_expense('8', 'Sushi', datetime(2026, 3, 10, 16, 0, tzinfo=dt_timezone.utc))
+        self.assertEqual((expense.local_date, expense.local_period), (date(2026, 3, 11), '2026-03'))
+
+        response = self.client.get('/range/?start=2026-03-11&end=2026-03-11')
+        self.assertEqual(response.context['expense_count'], 1)
+        self.assertEqual(response.context['total_amount'], Decimal('8'))
+        self.assertEqual(self.client.get('/range/?start=2026-03-10&end=2026-03-10').context['expense_count'], 0)
+
+    def test_report_page_answers_if_none_match(self):
+        self.add_expense('10', 'Food')
+        self.client.get('/week/')  # sets the CSRF cookie the page's forms use
+        etag = self.client.get('/week/')['ETag']
+        # session and user lookups, data version
+        with self.assertNumQueries(4):
+            self.assertEqual(self.client.get('/week/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.client.post('/week/', {'action': 'delete_expense', 'expense_id': Expense.objects.get().id})
+        self.assertEqual(self.client.get('/week/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_edit_returns_the_change_in_totals(self):
+        food = self.add_expense('10', 'Food')
+        self.add_expense('5', 'Rent')
+        self.assertContains(self.client.get('/month/'), f'data-json-url="/expenses/{food.id}/edit/"')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                f'/expenses/{food.id}/edit/', {'category': 'rent', 'amount': '12.5', 'note': 'moved'}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q['sql'] for q in queries if 'SUM(' in q['sql'].upper()])
+        data = response.json()
+        self.assertEqual(data['expense'], {
+            'id': food.id, 'amount': '12.50', 'category': 'Rent', 'note': 'moved',
+            'created_at': data['expense']['created_at'],
+        })
+        self.assertEqual(data['deltas'], {
+            'total': '2.50', 'count': 0, 'remaining': '-2.50',
+            'categories': {'Food': {'total': '-10.00', 'count': -1}, 'Rent': {'total': '12.50', 'count': 1}},
+        })
+
+        # A note-only edit changes no totals
+        response = self.client.post(f'/expenses/{food.id}/edit/', {'note': 'again'})
+        self.assertEqual(response.json()['deltas'], {'total': '0.00', 'count': 0, 'remaining': '0.00', 'categories': {}})
+        response = self.client.post(f'/expenses/{food.id}/edit/', {'category': 'Food'})
+        self.assertEqual(response.json()['deltas']['remaining'], '0.00')
+        self.client.post(f'/expenses/{food.id}/edit/', {'category': 'Rent'})
+
+        totals = {row['category']: row['total'] for row in self.client.get('/month/').context['totals_by_category']}
+        self.assertEqual(totals, {'Rent': Decimal('17.50')})
+        self.assertEqual(verify(), [])
+
+    def test_delete_returns_the_change_in_totals(self):
+        self.add_expense('10', 'Food')
+        coffee = self.add_expense('4', 'Food')
+        response = self.client.post(f'/expenses/{coffee.id}/delete/')
+        self.assertEqual(response.json(), {
+            'ok': True, 'deleted': coffee.id,
+            'deltas': {
+                'total': '-4.00', 'count': -1, 'remaining': '4.00',
+                'categories': {'Food': {'total': '-4.00', 'count': -1}},
+            },
+        })
+        self.assertFalse(Expense.objects.filter(id=coffee.id).exists())
+        self.assertEqual(self.client.post(f'/expenses/{coffee.id}/delete/').status_code, 404)
+        self.assertEqual(verify(), [])
+
+    def test_edit_and_delete_errors(self):
+        expense = self.add_expense('10', 'Food')
+        for amount in ('abc', '-3', '0', 'NaN'):
+            response = self.client.post(f'/expenses/{expense.id}/edit/', {'amount': amount})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['error'], 'Invalid amount: must be a positive number')
+        self.assertEqual(Expense.objects.get().amount, Decimal('10'))
+        self.assertEqual(self.client.get(f'/expenses/{expense.id}/edit/').status_code, 405)
+
+        other = User.objects.create_user(username='other', password='testpass123')
+        theirs = insert_expense(other, {'amount': Decimal('3'), 'category': 'Food', 'note': ''})
+        self.assertEqual(self.client.post(f'/expenses/{theirs.id}/edit/', {'amount': '1'}).status_code, 404)
+        self.assertEqual(self.client.post(f'/expenses/{theirs.id}/delete/').status_code, 404)
+        self.assertEqual(Expense.objects.get(id=theirs.id).amount, Decimal('3'))
+
+    def test_budget_usage(self):
+        self.assertEqual(budget_usage(Decimal('30'), Decimal('40')), (75, 'success'))
+        self.assertEqual(budget_usage(Decimal('35'), Decimal('40')), (88, 'warning'))
+        self.assertEqual(budget_usage(Decimal('45'), Decimal('40')), (112, 'danger'))
+        self.assertEqual(budget_usage(Decimal('45'), None), (0, None))
+
+    def test_cached_fragments_follow_data_changes(self):
+        Budget.objects.create(
+            user=self.user, period=timezone.now().strftime('%Y-%m'),
+            category=Category.objects.for_name(self.user, 'Food'), amount=Decimal('40'),
+        )
+        self.add_expense('35', 'Food')
+        self.client.get('/month/')  # sets the CSRF cookie the rows fragment is keyed by
+        for _ in range(2):
+            response = self.client.get('/month/')
+            self.assertContains(response, '88% of budget')
+            self.assertContains(response, 'text-warning')
+            self.assertContains(response, '$35.00', count=3)  # total, category and row
+
+        self.add_expense('10', 'Food')
+        response = self.client.get('/month/')
+        self.assertContains(response, '112% of budget')
+        self.assertContains(response, 'text-danger')
+        self.assertContains(response, '$45.00', count=2)
+        self.assertContains(response, '$10.00')
+
+        chart = re.search(r'<script id="chart-data" type="application/json">(.*?)</script>', response.content.decode())
+        self.assertEqual(json.loads(chart.group(1)), [{'category': 'Food', 'total': '45.00'}])
+
+    def test_benchmark_reports_command(self):
+        self.add_expense('10', 'Food')
+        out = io.StringIO()
+        call_command('benchmark_reports', 'reporter', repeat=1, stdout=out)
+        self.assertEqual([line.split()[0] for line in out.getvalue().splitlines()[1:]], ['today', 'week', 'month', 'budgets'])
+        with self.assertRaises(CommandError):
+            call_command('benchmark_reports', 'nobody', stdout=out)
+
+    @override_settings(EXPENSE_PAGE_SIZE=5)
+    def test_load_more_walks_every_expense_once(self):
+        now = timezone.now()
+        for i in range(12):
+            # Pairs share a timestamp, so the id tie-breaker matters
+            self.add_expense(str(i + 1), 'Food', now - timezone.timedelta(seconds=i // 2))
+
+        response = self.client.get('/today/')
+        self.assertEqual(response.context['expense_count'], 12)
+        self.assertContains(response, 'data-more-url')
+        seen = [e['id'] for e in response.context['expenses']]
+        more_url = response.context['more_url']
+        while more_url:
+            with self.assertNumQueries(5):  # session and user lookups, data version, then one page query
+                page = self.client.get(more_url)
+            self.assertEqual(page.status_code, 200)
+            seen += [e['id'] for e in page.context['expenses']]
+            more_url = page.context['more_url']
+
+        expected = list(
+            Expense.objects.filter(user=self.user).order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(seen, expected)
+        self.assertEqual(self.client.get('/more/?start=2026-01-01&end=2026-01-31&cursor=junk').status_code, 400)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class BudgetsPageTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create_user(username='budgeter', password='testpass123')
+        self.client.force_login(self.user)
+
+    def add_expense(self, amount, category, created_at):
+        insert_expense(self.user, {'amount': Decimal(amount), 'category': category, 'note': '', 'created_at': created_at})
+
+    def add_budgets(self, months):
+        for year, month in months:
+            period = f'{year}-{month:02d}'
+            Budget.objects.create(user=self.user, period=period, category=None, amount=Decimal('100'))
+            for name in ('Food', 'Rent'):
+                Budget.objects.create(
+                    user=self.user, period=period, category=Category.objects.for_name(self.user, name), amount=Decimal('40'),
+                )
+
+    def test_spend_per_budget(self):
+        self.add_expense('30', 'Food', timezone.make_aware(timezone.datetime(2025, 3, 10, 12)))
+        self.add_expense('25', 'Food', timezone.make_aware(timezone.datetime(2025, 3, 31, 23)))
+        self.add_expense('70', 'Rent', timezone.make_aware(timezone.datetime(2025, 3, 1, 0, 30)))
+        self.add_expense('5', 'Food', timezone.make_aware(timezone.datetime(2025, 4, 1, 1)))
+        self.add_budgets([(2025, 3), (2025, 4)])
+
+        response = self.client.get('/budgets/')
+        spent = {
+            (item['budget'].period, str(item['budget'].category or 'Overall')): item['spent']
+            for item in response.context['budget_comparison']
+        }
+        self.assertEqual(spent, {
+            ('2025-03', 'Overall'): Decimal('125'), ('2025-03', 'Food'): Decimal('55'), ('2025-03', 'Rent'): Decimal('70'),
+            ('2025-04', 'Overall'): Decimal('5'), ('2025-04', 'Food'): Decimal('5'), ('2025-04', 'Rent'): 0,
+        })
+
+    def test_query_count_does_not_grow_with_budgets(self):
+        self.add_budgets([(2025, 1)])
+        # session and user lookups, data version, budgets, grouped spend
+        with self.assertNumQueries(6):
+            self.client.get('/budgets/')
+
+        self.add_budgets([(2023 + i // 12, i % 12 + 1) for i in range(23)])
+        with self.assertNumQueries(6):
+            response = self.client.get('/budgets/')
+        self.assertEqual(len(response.context['budget_comparison']), 72)
+
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ReportApiTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        clear_cache()
+        self.user = User.objects.create_user(username='mobile', password='testpass123')
+        self.token, self.raw_token = issue_token(self.user)
+
+    def add_expense(self, amount, category, created_at=None):
+        cleaned = {'amount': Decimal(amount), 'category': category, 'note': ''}
+        if created_at:
+            cleaned['created_at'] = created_at
+        return insert_expense(self.user, cleaned)
+
+    def get(self, url, token=None, **headers):
+        return self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token or self.raw_token}', **headers)
+
+    def test_requires_an_api_token(self):
+        self.assertEqual(self.client.get('/api/reports/today/').status_code, 401)
+        self.assertEqual(self.get('/api/reports/today/', token='t2l_wrong').status_code, 401)
+
+    def test_month_report_matches_the_page(self):
+        self.add_expense('10', 'Food')
+        self.add_expense('7.25', 'Rent')
+        Budget.objects.create(user=self.user, period=timezone.localdate().strftime('%Y-%m'), category=None, amount=Decimal('100'))
+
+        data = self.get('/api/reports/month/').json()
+        self.assertEqual(data['totals'], {'total': '17.25', 'count': 2})
+        self.assertEqual(
+            [(cat['category'], cat['total'], cat['count']) for cat in data['categories']],
+            [('Food', '10.00', 1), ('Rent', '7.25', 1)],
+        )
+        self.assertEqual((data['budget']['overall'], data['budget']['remaining']), ('100.00', '82.75'))
+        self.assertEqual([row['category'] for row in data['rows']], ['Rent', 'Food'])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_fields_limit_the_queries_and_the_payload(self):
+        for i in range(20):
+            self.add_expense(str(i + 1), f'Category {i % 4}')
+        self.get('/api/reports/today/?fields=totals')  # warm the token cache
+
+        # The token's user and time zone are cached; data version, rollup totals
+        with self.assertNumQueries(2):
+            data = self.get('/api/reports/today/?fields=totals').json()
+        self.assertEqual(set(data), {'ok', 'start', 'end', 'totals'})
+        self.assertEqual(data['totals'], {'total': '210.00', 'count': 20})
+
+        with self.assertNumQueries(2):
+            data = self.get('/api/reports/today/?fields=rows').json()
+        self.assertEqual(set(data), {'ok', 'start', 'end', 'rows', 'next_cursor'})
+
+        response = self.get('/api/reports/today/?fields=totals,balance')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('balance', response.json()['error'])
+
+    @override_settings(EXPENSE_PAGE_SIZE=3)
+    def test_rows_page_with_a_cursor(self):
+        for i in range(7):
+            self.add_expense(str(i + 1), 'Food', timezone.now() - timezone.timedelta(minutes=i))
+
+        seen, cursor = [], ''
+        while True:
+            data = self.get(f'/api/reports/week/?fields=rows&cursor={cursor}').json()
+            seen += [row['id'] for row in data['rows']]
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        expected = list(Expense.objects.filter(user=self.user).order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(self.get('/api/reports/week/?fields=rows&cursor=junk').status_code, 400)
+
+    def test_range_and_month_validation(self):
+        self.assertEqual(self.get('/api/reports/range/?start=2026-03-02').status_code, 400)
+        self.assertEqual(self.get('/api/reports/range/?start=2026-03-02&end=2026-03-01').status_code, 400)
+        self.assertEqual(self.get('/api/reports/month/2026-13/').status_code, 400)
+        data = self.get('/api/reports/range/?start=2026-03-01&end=2026-03-02&fields=totals').json()
+        self.assertEqual((data['start'], data['end']), ('2026-03-01', '2026-03-02'))
+
+    def test_today_is_in_the_users_time_zone(self):
+        UserProfile.objects.create(user=self.user, timezone='Pacific/Kiritimati')  # UTC+14
+        data = self.get('/api/reports/today/?fields=totals').json()
+        with timezone.override('Pacific/Kiritimati'):
+            self.assertEqual(data['start'], timezone.localdate().isoformat())
+
+    def test_unchanged_report_is_not_modified(self):
+        expense = self.add_expense('10', 'Food')
+        url = '/api/reports/month/?fields=totals,rows'
+        first = self.get(url)
+        etag = first['ETag']
+        self.assertIn('Authorization', first['Vary'])
+
+        # Only the data version is read
+        with self.assertNumQueries(1):
+            response = self.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertNotEqual(self.get('/api/reports/month/?fields=totals', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # A note edit leaves the totals alone but still changes the report
+        original = copy.copy(expense)
+        expense.note = 'lunch'
+        expense.save()
+        update_rollups(added=[expense], removed=[original])
+        response = self.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        Budget.objects.create(user=self.user, period=timezone.localdate().strftime('%Y-%m'), category=None, amount=Decimal('5'))
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_versions_are_per_user(self):
+        other = User.objects.create_user(username='other', password='testpass123')
+        _, other_token = issue_token(other)
+        etag = self.get('/api/reports/today/')['ETag']
+        Budget.objects.create(user=other, period='2025-01', category=None, amount=Decimal('5'))
+        self.assertEqual(self.get('/api/reports/today/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.get('/api/reports/today/', token=other_token, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        # Deleting the budget along with its user doesn't try to bump a version that's gone
+        other.delete()
+        self.assertFalse(DataVersion.objects.filter(user_id=other.pk).exists())
+
+    def test_series(self):
+        self.add_expense('4', 'Food', timezone.make_aware(timezone.datetime(2025, 3, 3, 12)))
+        self.add_expense('6', 'Rent', timezone.make_aware(timezone.datetime(2025, 3, 12, 12)))
+
+        data = self.get('/api/reports/series/?start=2025-03-01&end=2025-03-16&bucket=week&split=category').json()
+        self.assertEqual(data['buckets'], ['2025-02-24', '2025-03-03', '2025-03-10'])
+        self.assertEqual(data['total'], ['0.00', '4.00', '6.00'])
+        self.assertEqual(data['categories'], {'Rent': ['0.00', '0.00', '6.00'], 'Food': ['0.00', '4.00', '0.00']})
+
+        # Five years of days in one grouped query
+        with self.assertNumQueries(2):  # data version, rollups
+            data = self.get('/api/reports/series/?start=2021-01-01&end=2025-12-31').json()
+        self.assertEqual(len(data['buckets']), 1826)
+        self.assertNotIn('categories', data)
+
+        for query in ('start=2025-03-01', 'start=2025-03-01&end=2025-03-02&bucket=hour',
+                      'start=2025-03-01&end=2025-03-02&split=note', 'start=2000-01-01&end=2025-01-01'):
+            self.assertEqual(self.get(f'/api/reports/series/?{query}').status_code, 400, query)
+
+        for bucket, count in (('month', 1), ('week', 1), ('day', 2)):
+            data = self.get(f'/api/reports/series/?start=9999-12-30&end=9999-12-31&bucket={bucket}').json()
+            self.assertEqual(len(data['buckets']), count, bucket)
+        data = self.get('/api/reports/series/?start=9999-12-01&end=9999-12-31&bucket=month').json()
+        self.assertEqual(data['buckets'], ['9999-12-01'])
+        # Counted, not walked, before the limit applies
+        self.assertEqual(self.get('/api/reports/series/?start=0001-01-01&end=9999-12-31').status_code, 400)
+
+    def test_budgets(self):
+        self.add_expense('30', 'Food', timezone.make_aware(timezone.datetime(2025, 3, 10, 12)))
+        Budget.objects.create(user=self.user, period='2025-03', category=None, amount=Decimal('40'))
+        Budget.objects.create(
+            user=self.user, period='2025-03', category=Category.objects.for_name(self.user, 'Food'), amount=Decimal('20'),
+        )
+        Budget.objects.create(user=self.user, period='2025-04', category=None, amount=Decimal('40'))
+
+        data = self.get('/api/reports/budgets/?period=2025-03').json()
+        budgets = {budget['category']: budget for budget in data['budgets']}
+        self.assertEqual(set(budgets), {None, 'Food'})
+        self.assertEqual((budgets[None]['spent'], budgets[None]['remaining']), ('30.00', '10.00'))
+        self.assertEqual((budgets['Food']['percent_used'], budgets['Food']['is_over']), ('150.0', True))
+        self.assertEqual(len(self.get('/api/reports/budgets/').json()['budgets']), 3)
+        self.assertEqual(self.get('/api/reports/budgets/?period=March').status_code, 400)
+
+@override_settings(CACHES=TEST_CACHES)
+class ExportTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        clear_cache()
+        self.user = User.objects.create_user(username='exporter', password='testpass123')
+        self.client.force_login(self.user)
+        for amount, category, note, day in (
+            ('4.50', 'Coffee', 'Starbucks', 1), ('12', 'Lunch', 'team, "offsite"', 2), ('3', 'Coffee', '', 3),
+        ):
+            insert_expense(self.user, {
+                'amount': Decimal(amount), 'category': category, 'note': note,
+                'created_at': datetime(2026, 3, day, 12, tzinfo=dt_timezone.utc),
+            })
+
+    def export(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_export(self):
+        rows = list(csv.reader(io.StringIO(self.export('/export/'))))
+        self.assertEqual(rows[0], ['id', 'date', 'created_at', 'amount', 'category', 'note'])
+        self.assertEqual(
+            [row[3:] for row in rows[1:]],
+            [['4.50', 'Coffee', 'Starbucks'], ['12.00', 'Lunch', 'team, "offsite"'], ['3.00', 'Coffee', '']],
+        )
+        # created_at on the user's wall clock (TIME_ZONE without a profile)
+        self.assertEqual(rows[1][1:3], ['2026-03-01', '2026-03-01T07:00:00-05:00'])
+
+    def test_filters_match_the_reports(self):
+        self.assertEqual(self.export('/export/?category=coffee').count('Coffee'), 2)
+        self.assertEqual(len(self.export('/export/?start=2026-03-02&end=2026-03-03').splitlines()), 3)
+        self.assertIn('Starbucks', self.export('/export/?search=star&format=jsonl'))
+        self.assertEqual(self.export('/export/?search=star&format=jsonl').count('\n'), 1)
+        self.assertEqual(self.client.get('/export/?start=2026-03-02').status_code, 400)
+        self.assertEqual(self.client.get('/export/?format=xml').status_code, 400)
+
+    @mock.patch('expenses.export.CHUNK_SIZE', 2)
+    def test_rows_are_streamed_in_chunks(self):
+        response = self.client.get('/export/?format=jsonl')
+        chunks = list(response.streaming_content)
+        self.assertEqual([chunk.count(b'\n') for chunk in chunks], [2, 1])
+        self.assertEqual(json.loads(chunks[0].splitlines()[0])['amount'], '4.50')
+
+    def test_api_export(self):
+        _, raw_token = issue_token(self.user)
+        self.client.logout()
+        response = self.client.get('/api/reports/export/?format=jsonl', HTTP_AUTHORIZATION=f'Bearer {raw_token}')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['category'] for line in lines], ['Coffee', 'Lunch', 'Coffee'])
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('export_expenses', 'exporter', '--category', 'lunch', stdout=out)
+        self.assertEqual(out.getvalue().splitlines()[1].split(',')[3:5], ['12.00', 'Lunch'])
+        with self.assertRaises(CommandError):
+            call_command('export_expenses', 'nobody')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class BulkActionTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create_user(username='bulker', password='testpass123')
+        self.client.force_login(self.user)
+        now = timezone.now()
+        self.voice = [
+            insert_expense(self.user, {
+                'amount': Decimal(i + 1), 'category': 'Misc', 'note': 'voice entry' if i % 2 else '',
+                'created_at': now - timezone.timedelta(days=i % 3),
+            })
+            for i in range(40)
+        ]
+        self.food = insert_expense(self.user, {'amount': Decimal('9'), 'category': 'Food', 'note': 'lunch'})
+
+    def bulk(self, data, ids=None):
+        if ids is not None:
+            data = {**data, 'ids': [expense.id for expense in ids]}
+        return self.client.post('/expenses/bulk/', data)
+
+    def test_recategorize_runs_the_same_statements_for_any_selection(self):
+        for selection in (self.voice[:3], self.voice[3:]):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.bulk({'action': 'recategorize', 'category': 'Groceries'}, selection)
+            self.assertEqual(response.json(), {'ok': True, 'changed': len(selection)})
+            # Select the ids, group them for the rollups, one update()
+            self.assertEqual(len([q for q in queries if '"siriapi_expense"' in q['sql']]), 3)
+
+        self.assertEqual(Expense.objects.filter(category__name='Groceries').count(), 40)
+        self.assertEqual(verify(), [])
+        totals = {row['category']: row['total'] for row in self.client.get('/month/').context['totals_by_category']}
+        self.assertEqual(totals, {'Groceries': Decimal(sum(range(1, 41))), 'Food': Decimal('9')})
+
+    def test_delete_everything_a_report_shows(self):
+        start = timezone.localdate() - timezone.timedelta(days=2)
+        response = self.bulk({
+            'action': 'delete', 'start': start.isoformat(), 'end': timezone.localdate().isoformat(), 'search': 'voice',
+        })
+        self.assertEqual(response.json(), {'ok': True, 'changed': 20})
+        # category names the target of recategorize, so it doesn't narrow the selection
+        response = self.bulk({
+            'action': 'recategorize', 'category': 'Food',
+            'start': start.isoformat(), 'end': timezone.localdate().isoformat(),
+        })
+        self.assertEqual(response.json(), {'ok': True, 'changed': 21})
+        self.assertEqual(Expense.objects.filter(note='voice entry').count(), 0)
+        self.assertEqual(Expense.objects.filter(category__name='Food').count(), 21)
+        self.assertEqual(verify(), [])
+
+    @mock.patch('expenses.bulk.CHUNK_SIZE', 7)
+    def test_notes_in_chunks(self):
+        version = DataVersion.objects.get(user=self.user).version
+        self.assertEqual(self.bulk({'action': 'append_note', 'note': 'checked'}, self.voice).json()['changed'], 40)
+        self.assertEqual(
+            set(Expense.objects.filter(id__in=[e.id for e in self.voice]).values_list('note', flat=True)),
+            {'checked', 'voice entry\nchecked'},
+        )
+        # Notes change no totals, but the report pages must show them
+        self.assertEqual(DataVersion.objects.get(user=self.user).version, version + 1)
+        self.assertEqual(verify(), [])
+
+        self.bulk({'action': 'set_note', 'note': ''}, self.voice[:5])
+        self.assertEqual(Expense.objects.filter(note='').count(), 5)
+
+    def test_invalid_requests(self):
+        for data, error in (
+            ({'action': 'shred', 'ids': [self.food.id]}, 'action must be one of'),
+            ({'action': 'recategorize', 'ids': [self.food.id]}, 'Category is required'),
+            ({'action': 'append_note', 'ids': [self.food.id]}, 'Note is required'),
+            ({'action': 'append_note', 'note': '  ', 'ids': [self.food.id]}, 'Note is required'),
+            ({'action': 'delete'}, 'Select expenses by ids'),
+            ({'action': 'delete', 'ids': ['x']}, 'ids must be expense ids'),
+        ):
+            response = self.client.post('/expenses/bulk/', data)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(error, response.json()['error'])
+        self.assertEqual(Expense.objects.count(), 41)
+        self.assertEqual(Expense.objects.get(id=self.food.id).note, 'lunch')
+
+        other = User.objects.create_user(username='other', password='testpass123')
+        theirs = insert_expense(other, {'amount': Decimal('3'), 'category': 'Food', 'note': ''})
+        self.assertEqual(self.bulk({'action': 'delete'}, [theirs]).json(), {'ok': True, 'changed': 0})
+        self.assertTrue(Expense.objects.filter(id=theirs.id).exists())
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite specific')
+@override_settings(CACHES=TEST_CACHES)
+class QueryPlanTestCase(TestCase):
+    """Every expense and rollup query behind the report pages must use an index, not scan the table"""
+
+    TABLES = ('siriapi_expense', 'siriapi_dailyspend')
+    FULL_SCAN_RE = re.compile(r'^SCAN siriapi_(expense|dailyspend)\b')
+
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create_user(username='planner', password='testpass123')
+        self.client.force_login(self.user)
+        period = timezone.now().strftime('%Y-%m')
+        for i in range(20):
+            insert_expense(self.user, {'amount': Decimal(i + 1), 'category': f'Category {i % 4}', 'note': ''})
+        Budget.objects.create(user=self.user, period=period, category=None, amount=Decimal('500'))
+        Budget.objects.create(
+            user=self.user, period=period, category=Category.objects.for_name(self.user, 'Category 1'), amount=Decimal('50')
+        )
+
+    def expense_plans(self, url):
+        """(sql, plan lines) for each query on the expense or rollup table while fetching url"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT') or not any(table in sql for table in self.TABLES):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plans.append((sql, [row[-1] for row in cursor.fetchall()]))
+        self.assertTrue(plans, f'{url} ran no expense or rollup queries')
+        return plans
+
+    def assert_no_full_scans(self, url):
+        for sql, plan in self.expense_plans(url):
+            scans = [line for line in plan if self.FULL_SCAN_RE.match(line)]
+            self.assertFalse(scans, f'{url} scans a table:\n{sql}\n' + '\n'.join(plan))
+            # A date filter the index can't use (e.g. created_at__date) only narrows by user
+            where = re.split(r' (?:GROUP|ORDER) BY ', sql.partition(' WHERE ')[2])[0]
+            column = next(
+                (column for column in ('local_date', 'local_period', 'day', 'created_at') if f'."{column}"' in where),
+                None,
+            )
+            if column:
+                self.assertTrue(
+                    any(re.search(f'\\b{column}[<>=]', line) for line in plan),
+                    f'{url} does not use an index for its date range:\n{sql}\n' + '\n'.join(plan),
+                )
+
+    def test_report_pages(self):
+        today = timezone.localdate()
+        for url in ['/today/', '/week/', '/month/', f'/range/?start={today}&end={today}&search=category']:
+            with self.subTest(url=url):
+                self.assert_no_full_scans(url)
+
+    @override_settings(EXPENSE_PAGE_SIZE=5)
+    def test_load_more_pages(self):
+        more_url = self.client.get('/month/').context['more_url']
+        self.assertTrue(more_url)
+        self.assert_no_full_scans(more_url)
+
+    def test_budgets_page(self):
+        self.assert_no_full_scans('/budgets/')
+
+    def test_profile_page(self):
+        self.assert_no_full_scans('/profile/profile/')
+
+    def test_plans_use_the_composite_indexes(self):
+        plan = '\n'.join(line for _, lines in self.expense_plans('/month/?search=category') for line in lines)
+        self.assertIn('expense_user_period_idx', plan)
+        plan = '\n'.join(line for _, lines in self.expense_plans('/week/?search=category') for line in lines)
+        self.assertIn('expense_user_local_date_idx', plan)
+        plan = '\n'.join(line for _, lines in self.expense_plans('/month/') for line in lines)
+        self.assertIn('SEARCH siriapi_dailyspend', plan)
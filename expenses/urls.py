@@ -13,5 +13,10 @@ urlpatterns = [
     path('month/', views.expenses_month, name='expenses_month'),
     path('month/<str:year_month>/', views.expenses_month_specific, name='expenses_month_specific'),
     path('range/', views.expenses_range, name='expenses_range'),
+    path('more/', views.expenses_more, name='expenses_more'),
+    path('export/', views.expenses_export, name='expenses_export'),
+    path('expenses/<int:expense_id>/edit/', views.expense_edit, name='expense_edit'),
+    path('expenses/<int:expense_id>/delete/', views.expense_delete, name='expense_delete'),
+    path('expenses/bulk/', views.expenses_bulk, name='expenses_bulk'),
     path('budgets/', views.expenses_budgets, name='expenses_budgets'),
 ]
\ No newline at end of file
@@ -1,11 +1,30 @@
-from datetime import datetime, timedelta, timezone as tz
-from django.db.models import Sum, Q
+import copy
+import logging
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
 from django.shortcuts import render, redirect
 from django.utils import timezone
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
-from siriapi.models import Expense, Budget
+from django.http import HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import urlencode
+from expenses.bulk import bulk_change
+from expenses.dates import month_range, week_range
+from expenses.etags import data_version, report_condition
+from expenses.export import CONTENT_TYPES, EXPORT_FORMATS, export_chunks
+from expenses.pagination import expense_page
+from siriapi.models import Budget, Category, Expense, normalize_category_name
+from siriapi.counters import month_spend
+from siriapi.rollups import category_totals, update_rollups
+from siriapi.search import search_expenses
+from userprofile.models import user_timezone
+
+logger = logging.getLogger(__name__)
 
 
 def landing_page(request):
@@ -13,71 +32,269 @@ def landing_page(request):
     return render(request, 'expenses/landing.html')
 
 
+def money(amount):
+    """Amounts as strings with two decimals, so clients never see float rounding"""
+    return None if amount is None else f"{amount:.2f}"
+
+
+def delete_expense(user, expense_id):
+    """Delete one of the user's expenses and return it, or None if there is no such expense"""
+    with transaction.atomic():
+        expense = Expense.objects.select_for_update().select_related('category').filter(user=user, id=expense_id).first()
+        if expense:
+            Expense.objects.filter(id=expense.id).delete()
+            update_rollups(removed=[expense])
+    return expense
+
+
+def update_expense(user, expense_id, category=None, amount=None, note=None):
+    """Change one of the user's expenses; blank fields are left alone.
+
+    Returns (original, expense), the expense before and after. Raises
+    Expense.DoesNotExist, or ValueError for an invalid amount.
+    """
+    with transaction.atomic():
+        expense = Expense.objects.select_for_update().select_related('category').get(user=user, id=expense_id)
+        original = copy.copy(expense)
+        if category and category.strip():
+            expense.category = Category.objects.for_name(user, category)
+        if amount:
+            try:
+                expense.amount = Decimal(amount)
+                if not expense.amount.is_finite() or expense.amount <= 0:
+                    raise InvalidOperation
+                # Rounded as it will be stored, so the rollups get the same amount
+                expense.amount = expense.amount.quantize(Decimal('0.01'))
+            except InvalidOperation:
+                raise ValueError('Invalid amount: must be a positive number') from None
+        if note is not None:
+            expense.note = note
+        expense.save()
+        update_rollups(added=[expense], removed=[original])
+    return original, expense
+
+
 def handle_expense_action(user, request):
     """Handle delete and update expense actions"""
     action = request.POST.get('action')
+    expense_id = request.POST.get('expense_id')
+    if not expense_id:
+        return False
     if action == 'delete_expense':
-        expense_id = request.POST.get('expense_id')
-        if expense_id:
-            Expense.objects.filter(user=user, id=expense_id).delete()
-            return True
+        delete_expense(user, expense_id)
+        return True
     elif action == 'update_expense':
-        expense_id = request.POST.get('expense_id')
-        category = request.POST.get('category')
-        amount = request.POST.get('amount')
-        note = request.POST.get('note')
-        if expense_id:
-            try:
-                expense = Expense.objects.get(user=user, id=expense_id)
-                if category:
-                    expense.category = category
-                if amount:
-                    expense.amount = float(amount)
-                if note is not None:
-                    expense.note = note
-                expense.save()
-                return True
-            except (Expense.DoesNotExist, ValueError):
-                pass
+        try:
+            update_expense(
+                user, expense_id,
+                request.POST.get('category'), request.POST.get('amount'), request.POST.get('note'),
+            )
+            return True
+        except (Expense.DoesNotExist, ValueError):
+            pass
     return False
 
 
-def get_expenses_report(user, start_date, end_date, title, search_query=None):
-    # Convert dates to timezone-aware datetime boundaries to avoid timezone conversion issues
-    start_datetime = datetime.combine(start_date, datetime.min.time(), tzinfo=tz.utc)
-    end_datetime = datetime.combine(end_date, datetime.max.time(), tzinfo=tz.utc)
-    
-    expenses = Expense.objects.filter(user=user, created_at__range=(start_datetime, end_datetime)).order_by('-created_at')
-    
+def expense_json(expense):
+    return {
+        'id': expense.id,
+        'amount': money(expense.amount),
+        'category': expense.category.name,
+        'note': expense.note,
+        'created_at': expense.created_at,
+    }
+
+
+def report_deltas(original=None, expense=None):
+    """How the totals of a report containing an expense change when original becomes expense.
+
+    Either side may be None, for an added or deleted expense. The change is
+    worked out from the two versions alone, without querying: the report
+    total, count and overall budget remaining, and each category's total and
+    count.
+    """
+    categories = {}
+    for version, sign in ((original, -1), (expense, 1)):
+        if version is not None:
+            total, count = categories.get(version.category.name, (Decimal(0), 0))
+            categories[version.category.name] = (total + sign * Decimal(version.amount), count + sign)
+    categories = {name: change for name, change in categories.items() if any(change)}
+    total = sum((change[0] for change in categories.values()), Decimal(0))
+    return {
+        'total': money(total),
+        'count': sum(change[1] for change in categories.values()),
+        'remaining': money(-total if total else total),  # never "-0.00"
+        'categories': {name: {'total': money(total), 'count': count} for name, (total, count) in categories.items()},
+    }
+
+
+def filter_expenses(user, start_date, end_date, search_query=None, category=None):
+    """The user's expenses between two dates (inclusive), optionally in one category and matching a search.
+
+    With start_date None, expenses from every date are included.
+    """
+    # Dates on the user's wall clock, as the rollups are kept
+    expenses = Expense.objects.filter(user=user)
+    if start_date is not None:
+        period = start_date.strftime('%Y-%m')
+        if start_date == end_date:
+            expenses = expenses.filter(local_date=start_date)
+        elif (start_date, end_date) == month_range(period):
+            expenses = expenses.filter(local_period=period)
+        else:
+            expenses = expenses.filter(local_date__range=(start_date, end_date))
+
+    if category:
+        expenses = expenses.filter(category__normalized_name=normalize_category_name(category))
     # Apply search filter if provided
     if search_query:
-        expenses = expenses.filter(
-            Q(category__icontains=search_query) | 
-            Q(note__icontains=search_query)
-        )
-    
-    total = expenses.aggregate(total=Sum('amount'))['total'] or 0
-    totals_by_category = list(expenses.values('category').annotate(total=Sum('amount')).order_by('-total'))
-    expenses_list = [
-        {
-            'id': e.id,
-            'amount': e.amount,
-            'category': e.category,
-            'note': e.note,
-            'created_at': e.created_at
-        }
-        for e in expenses
-    ]
+        expenses = search_expenses(expenses, user, search_query)
+    return expenses
+
+
+def more_expenses_url(start_date, end_date, search_query, cursor):
+    """URL of the "load more" fragment continuing after cursor, or None on the last page"""
+    if not cursor:
+        return None
+    params = {'start': start_date.isoformat(), 'end': end_date.isoformat(), 'cursor': cursor}
+    if search_query:
+        params['search'] = search_query
+    return f"{reverse('expenses:expenses_more')}?{urlencode(params)}"
+
+
+def export_url(start_date, end_date, search_query):
+    """URL of the CSV export of a report's expenses"""
+    params = {'start': start_date.isoformat(), 'end': end_date.isoformat()}
+    if search_query:
+        params['search'] = search_query
+    return f"{reverse('expenses:expenses_export')}?{urlencode(params)}"
+
+
+def report_query(user, params):
+    """(expenses, start, end) selected like a report, or raise ValueError.
+
+    params may hold start and end (both or neither, for every date), category and search.
+    """
+    start_str, end_str = params.get('start'), params.get('end')
+    start = end = None
+    if start_str or end_str:
+        try:
+            start = datetime.fromisoformat(start_str).date()
+            end = datetime.fromisoformat(end_str).date()
+        except (TypeError, ValueError):
+            raise ValueError('start and end go together, as YYYY-MM-DD') from None
+        if start > end:
+            raise ValueError('start must be before or equal to end')
+
+    expenses = filter_expenses(user, start, end, params.get('search'), params.get('category'))
+    return expenses, start, end
+
+
+def export_query(user, params):
+    """(expenses, format, start, end) for an export, or raise ValueError.
+
+    params may hold format and anything report_query() takes.
+    """
+    export_format = params.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    expenses, start, end = report_query(user, params)
+    return expenses, export_format, start, end
+
+
+def bulk_selection(user, params):
+    """The expenses a bulk action applies to, or raise ValueError.
+
+    Either the ids given (repeated ids= values), or every expense of a
+    report: start and end, plus the report's search. (category is the new
+    category of a bulk action, not a filter.)
+    """
+    ids = params.getlist('ids')
+    if ids:
+        try:
+            return Expense.objects.filter(user=user, id__in=[int(expense_id) for expense_id in ids])
+        except ValueError:
+            raise ValueError('ids must be expense ids') from None
+    if not (params.get('start') and params.get('end')):
+        raise ValueError('Select expenses by ids, or by a report with start and end')
+    return report_query(user, {key: params.get(key) for key in ('start', 'end', 'search')})[0]
+
+
+def export_response(user, params):
+    """Streaming export of the expenses selected by params (see export_query), or raise ValueError"""
+    expenses, export_format, start, end = export_query(user, params)
+    response = StreamingHttpResponse(
+        export_chunks(expenses, export_format, user_timezone(user)), content_type=CONTENT_TYPES[export_format]
+    )
+    period = f"-{start}-to-{end}" if start else ''
+    response['Content-Disposition'] = f'attachment; filename="expenses{period}.{export_format}"'
+    return response
+
+
+def budget_usage(spent, budget):
+    """(percent of budget spent, rounded like widthratio, and its Bootstrap level); (0, None) without a budget"""
+    if not budget:
+        return 0, None
+    percent = int(round(Decimal(spent) / budget * 100))
+    return percent, 'danger' if percent > 100 else 'warning' if percent > 75 else 'success'
+
+
+# Sections of a report that can be asked for on their own
+REPORT_FIELDS = ('totals', 'categories', 'budget', 'rows')
+
+
+def get_expenses_report(user, start_date, end_date, title, search_query=None, fields=REPORT_FIELDS, cursor=None):
+    """Report context for the user's expenses between two dates.
+
+    Only the queries behind the requested fields are run: totals, categories
+    and budget share the per-category totals, categories and budget the
+    period's budgets, and rows is one page of expenses continuing after cursor.
+    """
+    started = time.perf_counter()
+    expenses = filter_expenses(user, start_date, end_date, search_query)
 
     # Budgets for the period (assuming monthly budgets)
     period_str = start_date.strftime('%Y-%m')
-    budgets = Budget.objects.filter(user=user, period=period_str)
-    overall_budget = budgets.filter(category='').first()
-    category_budgets = {b.category: b.amount for b in budgets.exclude(category='')}
+
+    # Totals, budgets and the first page of rows, all read in one transaction
+    # so the header always agrees with the list. Totals come from the daily
+    # rollups unless a search narrows them to matching expenses.
+    with transaction.atomic(savepoint=False):
+        if not {'totals', 'categories', 'budget'} & set(fields):
+            totals_by_category = []
+        elif search_query:
+            totals_by_category = [
+                {
+                    'category_id': row['category'], 'category': row['category__name'],
+                    'total': row['total'], 'count': row['count'],
+                }
+                for row in expenses.values('category', 'category__name')
+                .annotate(total=Sum('amount'), count=Count('id'))
+                .order_by('-total')
+            ]
+        else:
+            totals_by_category = category_totals(user, start_date, end_date)
+        budgets = []
+        if {'categories', 'budget'} & set(fields):
+            budgets = list(Budget.objects.filter(user=user, period=period_str).select_related('category'))
+        expenses_list, next_cursor = [], None
+        if 'rows' in fields:
+            expenses_list, next_cursor = expense_page(expenses, cursor)
+
+    total = sum(cat['total'] for cat in totals_by_category)
+    overall_budget = None
+    budget_by_category_id = {}
+    for budget in budgets:
+        if budget.category_id is None:
+            overall_budget = budget
+        else:
+            budget_by_category_id[budget.category_id] = budget.amount
+    category_budgets = {b.category.name: b.amount for b in budgets if b.category_id is not None}
 
     # Add budget to each category
     for cat in totals_by_category:
-        cat['budget'] = category_budgets.get(cat['category'])
+        cat['budget'] = budget_by_category_id.get(cat['category_id'])
+        cat['budget_percent'], cat['budget_level'] = budget_usage(cat['total'], cat['budget'])
 
     budget_info = {
         'overall_budget': overall_budget.amount if overall_budget else None,
@@ -85,23 +302,35 @@ def get_expenses_report(user, start_date, end_date, title, search_query=None):
         'spent': total,
         'remaining': (overall_budget.amount - total) if overall_budget else None,
     }
+    budget_info['percent'], budget_info['level'] = budget_usage(total, budget_info['overall_budget'])
+    budget_info['bar_width'] = min(budget_info['percent'], 100)
 
     context = {
         'title': title,
         'period_start': start_date,
         'period_end': end_date,
         'total_amount': total,
+        'expense_count': sum(cat['count'] for cat in totals_by_category),
         'totals_by_category': totals_by_category,
         'expenses': expenses_list,
+        'next_cursor': next_cursor,
+        'more_url': more_expenses_url(start_date, end_date, search_query, next_cursor),
+        'export_url': export_url(start_date, end_date, search_query),
         'budget_info': budget_info,
-        'chart_data': totals_by_category,  # for pie chart
+        # for the pie chart, through json_script
+        'chart_data': [{'category': cat['category'], 'total': f"{cat['total']:.2f}"} for cat in totals_by_category],
         'search_query': search_query,
     }
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if elapsed_ms > settings.REPORT_LATENCY_TARGET_MS:
+        logger.warning(f"Slow expense report for {user.username} ({start_date} to {end_date}): {elapsed_ms:.0f} ms")
     return context
 
 
 @require_http_methods(["GET", "POST"])
 @login_required
+@report_condition
 def expenses_week(request):
     if request.method == 'POST':
         # Handle expense actions (delete/update)
@@ -114,18 +343,17 @@ def expenses_week(request):
         end_str = request.POST.get('end')
         if start_str and end_str:
             return redirect(f'/expenses/range/?start={start_str}&end={end_str}')
-    now = timezone.now()
-    monday = now - timedelta(days=now.weekday())
-    start = monday.date()
-    end = (monday + timedelta(days=6)).date()
+    start, end = week_range(timezone.localdate())
     search_query = request.GET.get('search')
     context = get_expenses_report(request.user, start, end, "This Week's Expenses", search_query)
     context['show_form'] = True
+    context['data_version'] = data_version(request)
     return render(request, 'expenses/report.html', context)
 
 
 @require_http_methods(["GET", "POST"])
 @login_required
+@report_condition
 def expenses_month(request):
     if request.method == 'POST':
         # Handle expense actions (delete/update)
@@ -136,8 +364,8 @@ def expenses_month(request):
         month_str = request.POST.get('month')
         if month_str:
             return redirect(f'/expenses/month/{month_str}/')
-    now = timezone.now()
-    start = now.replace(day=1).date()
+    now = timezone.localdate()
+    start = now.replace(day=1)
     # Calculate last day of the month
     if now.month == 12:
         end = datetime(now.year + 1, 1, 1).date() - timedelta(days=1)
@@ -146,11 +374,13 @@ def expenses_month(request):
     search_query = request.GET.get('search')
     context = get_expenses_report(request.user, start, end, "Current Month Expenses", search_query)
     context['show_form'] = True
+    context['data_version'] = data_version(request)
     return render(request, 'expenses/report.html', context)
 
 
 @require_http_methods(["GET", "POST"])
 @login_required
+@report_condition
 def expenses_month_specific(request, year_month=None):
     if request.method == 'POST':
         # Handle expense actions (delete/update)
@@ -161,10 +391,10 @@ def expenses_month_specific(request, year_month=None):
         if not year_month:
             year_month = request.POST.get('month')
         if not year_month:
-            year_month = timezone.now().strftime('%Y-%m')
+            year_month = timezone.localdate().strftime('%Y-%m')
         return redirect(f'/expenses/month/{year_month}/')
     if not year_month:
-        year_month = timezone.now().strftime('%Y-%m')
+        year_month = timezone.localdate().strftime('%Y-%m')
     try:
         year, month = map(int, year_month.split('-'))
         start = datetime(year, month, 1).date()
@@ -178,11 +408,13 @@ def expenses_month_specific(request, year_month=None):
     search_query = request.GET.get('search')
     context = get_expenses_report(request.user, start, end, title, search_query)
     context['show_form'] = True
+    context['data_version'] = data_version(request)
     return render(request, 'expenses/report.html', context)
 
 
 @require_http_methods(["GET", "POST"])
 @login_required
+@report_condition
 def expenses_range(request):
     if request.method == 'POST':
         # Handle expense actions (delete/update)
@@ -213,6 +445,7 @@ def expenses_range(request):
     search_query = request.GET.get('search')
     context = get_expenses_report(request.user, start, end, title, search_query)
     context['show_form'] = True
+    context['data_version'] = data_version(request)
     context['current_start'] = start_str
     context['current_end'] = end_str
     return render(request, 'expenses/report.html', context)
@@ -220,6 +453,7 @@ def expenses_range(request):
 
 @require_http_methods(["GET", "POST"])
 @login_required
+@report_condition
 def expenses_today(request):
     if request.method == 'POST':
         # Handle expense actions (delete/update)
@@ -227,15 +461,119 @@ def expenses_today(request):
         if action in ['delete_expense', 'update_expense']:
             handle_expense_action(request.user, request)
             return redirect('/expenses/today/')
-    today = timezone.now().date()
+    today = timezone.localdate()
     search_query = request.GET.get('search')
     context = get_expenses_report(request.user, today, today, "Today's Expenses", search_query)
     context['show_form'] = True
+    context['data_version'] = data_version(request)
     return render(request, 'expenses/report.html', context)
 
 
+@require_http_methods(["GET"])
+@login_required
+@report_condition
+def expenses_more(request):
+    """Next page of a report's transaction list, as an HTML fragment for "load more" """
+    try:
+        start = datetime.fromisoformat(request.GET['start']).date()
+        end = datetime.fromisoformat(request.GET['end']).date()
+        search_query = request.GET.get('search')
+        expenses, next_cursor = expense_page(
+            filter_expenses(request.user, start, end, search_query), request.GET['cursor']
+        )
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest('Invalid start, end or cursor')
+    context = {
+        'expenses': expenses,
+        'more_url': more_expenses_url(start, end, search_query, next_cursor),
+    }
+    return render(request, 'expenses/_expense_page.html', context)
+
+
+@require_http_methods(["POST"])
+@login_required
+def expense_edit(request, expense_id):
+    """Change an expense from a report page; the page updates itself from the returned deltas"""
+    try:
+        original, expense = update_expense(
+            request.user, expense_id,
+            request.POST.get('category'), request.POST.get('amount'), request.POST.get('note'),
+        )
+    except Expense.DoesNotExist:
+        return JsonResponse({'ok': False, 'error': 'Expense not found'}, status=404)
+    except ValueError as e:
+        return JsonResponse({'ok': False, 'error': str(e)}, status=400)
+    return JsonResponse({'ok': True, 'expense': expense_json(expense), 'deltas': report_deltas(original, expense)})
+
+
+@require_http_methods(["POST"])
+@login_required
+def expense_delete(request, expense_id):
+    """Delete an expense from a report page; the page updates itself from the returned deltas"""
+    expense = delete_expense(request.user, expense_id)
+    if expense is None:
+        return JsonResponse({'ok': False, 'error': 'Expense not found'}, status=404)
+    return JsonResponse({'ok': True, 'deleted': expense_id, 'deltas': report_deltas(original=expense)})
+
+
+@require_http_methods(["POST"])
+@login_required
+def expenses_bulk(request):
+    """Delete, recategorize or change the notes of many expenses at once (see expenses.bulk)"""
+    try:
+        changed = bulk_change(
+            request.user, bulk_selection(request.user, request.POST), request.POST.get('action'),
+            category=request.POST.get('category'), note=request.POST.get('note', ''),
+        )
+    except ValueError as e:
+        return JsonResponse({'ok': False, 'error': str(e)}, status=400)
+    return JsonResponse({'ok': True, 'changed': changed})
+
+
+@require_http_methods(["GET"])
+@login_required
+def expenses_export(request):
+    """Download the expenses matching start, end, category and search as CSV or JSON Lines"""
+    try:
+        return export_response(request.user, request.GET)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+
+def compare_budgets(user, budgets):
+    """Spent, remaining and percent used for each of the user's budgets"""
+    # Month-to-date counters, with any the cache doesn't have from one grouped query
+    months = {budget.id: month_range(budget.period)[0] for budget in budgets}
+    spent = month_spend(user, {(months[budget.id], budget.category_id) for budget in budgets})
+
+    budget_comparison = []
+    for budget in budgets:
+        budget_spent = spent[(months[budget.id], budget.category_id)]
+        is_over = budget_spent > budget.amount
+        budget_comparison.append({
+            'budget': budget,
+            'spent': budget_spent,
+            'remaining': budget.amount - budget_spent,
+            'percent_used': (budget_spent / budget.amount * 100) if budget.amount > 0 else 0,
+            'is_over': is_over,
+            'level': 'danger' if is_over else 'success',  # Bootstrap text-/bg- suffix
+        })
+    return budget_comparison
+
+
+def budgets_context(user):
+    budgets = list(Budget.objects.filter(user=user).select_related('category').order_by('-period', '-created_at'))
+    return {
+        'title': 'Manage Budgets',
+        'budgets': budgets,
+        'budget_comparison': compare_budgets(user, budgets),
+        'show_budgets': True,
+    }
+
+
 @require_http_methods(["GET", "POST"])
 @login_required
+@report_condition
 def expenses_budgets(request):
     if request.method == 'POST':
         action = request.POST.get('action')
@@ -246,6 +584,7 @@ def expenses_budgets(request):
             if period and amount:
                 try:
                     amount = float(amount)
+                    category = Category.objects.for_name(request.user, category) if category else None
                     Budget.objects.update_or_create(user=request.user, period=period, category=category, defaults={'amount': amount})
                 except ValueError:
                     pass
@@ -257,39 +596,5 @@ def expenses_budgets(request):
             handle_expense_action(request.user, request)
         return redirect(request.META.get('HTTP_REFERER', '/budgets/'))
 
-    budgets = Budget.objects.filter(user=request.user).order_by('-period', '-created_at')
-    
-    # Get budget vs spending data
-    budget_comparison = []
-    for budget in budgets:
-        # Get expenses for this budget period
-        year, month = budget.period.split('-')
-        start = datetime(int(year), int(month), 1).date()
-        if int(month) == 12:
-            end = datetime(int(year) + 1, 1, 1).date() - timedelta(days=1)
-        else:
-            end = datetime(int(year), int(month) + 1, 1).date() - timedelta(days=1)
-        
-        if budget.category:
-            expenses = Expense.objects.filter(user=request.user, category=budget.category, 
-                                             created_at__date__range=(start, end))
-        else:
-            expenses = Expense.objects.filter(user=request.user, 
-                                             created_at__date__range=(start, end))
-        
-        spent = expenses.aggregate(total=Sum('amount'))['total'] or 0
-        budget_comparison.append({
-            'budget': budget,
-            'spent': spent,
-            'remaining': budget.amount - spent,
-            'percent_used': (spent / budget.amount * 100) if budget.amount > 0 else 0,
-            'is_over': spent > budget.amount,
-        })
-    
-    context = {
-        'title': 'Manage Budgets',
-        'budgets': budgets,
-        'budget_comparison': budget_comparison,
-        'show_budgets': True,
-    }
+    context = budgets_context(request.user)
     return render(request, 'expenses/budgets.html', context)
@@ -1,3 +1,24 @@
 from django.contrib import admin
+from .models import ApiToken, Category, CategoryAlias
 
-# Register your models here.
+
+@admin.register(ApiToken)
+class ApiTokenAdmin(admin.ModelAdmin):
+    list_display = ('user', 'name', 'prefix', 'created_at', 'last_used_at', 'revoked_at')
+    list_filter = ('revoked_at',)
+    search_fields = ('user__username', 'name', 'prefix')
+    readonly_fields = ('prefix', 'digest', 'created_at', 'last_used_at')
+
+
+@admin.register(Category)
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'name', 'created_at')
+    search_fields = ('user__username', 'name')
+    readonly_fields = ('normalized_name', 'created_at')
+
+
+@admin.register(CategoryAlias)
+class CategoryAliasAdmin(admin.ModelAdmin):
+    list_display = ('user', 'alias', 'category', 'created_at')
+    search_fields = ('user__username', 'alias', 'category__name')
+    raw_id_fields = ('category',)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class SiriapiConfig(AppConfig):
     name = "siriapi"
+
+    def ready(self):
+        from . import signals  # noqa: F401
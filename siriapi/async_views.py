@@ -0,0 +1,160 @@
+"""
+Native async versions of the Siri endpoints, used when serving through ASGI
+(see apiAccess/asgi.py). They use the async ORM so a worker isn't tied up
+while a request waits on the database, and run password hashing in a thread
+pool so it never blocks the event loop.
+"""
+
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import check_password, make_password
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from .idempotency import run_once, stored_responses
+from .ingest import ADD_EXPENSE_ENDPOINT, ainsert_expense, clean_expense_data, expense_response, insert_expense
+from .journal import Journal
+from .throttle import admission_control, check_rate
+from .tokens import auser_for_token
+from .views import (
+    authenticate_token,
+    get_auth_header,
+    get_bearer_token,
+    queued_response,
+    rate_limit_token,
+    replayable_response,
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def aauthenticate_password(request):
+    """Legacy SIRI_TOKEN + username/password auth without blocking the event loop.
+
+    Mirrors ModelBackend: the user is fetched with the async ORM and only the
+    CPU-bound hash check runs in a worker thread.
+    """
+    try:
+        if request.method == 'POST':
+            data = json.loads(request.body)
+        else:  # GET request
+            data = request.GET.dict()
+        username = data.get('username')
+        password = data.get('password')
+    except (json.JSONDecodeError, AttributeError) as e:
+        logger.error(f"Error parsing request data: {e}")
+        return None
+
+    if not username or not password:
+        logger.warning("Missing username or password")
+        return None
+
+    UserModel = get_user_model()
+    try:
+        user = await UserModel._default_manager.aget(**{UserModel.USERNAME_FIELD: username})
+    except UserModel.DoesNotExist:
+        # Hash anyway so unknown usernames take as long as wrong passwords
+        await sync_to_async(make_password, thread_sensitive=False)(password)
+        user = None
+    else:
+        valid = await sync_to_async(check_password, thread_sensitive=False)(password, user.password)
+        if not valid or not user.is_active:
+            user = None
+
+    if not user:
+        logger.warning(f"User authentication failed for username: {username}")
+    return user
+
+
+async def aauthenticate_user(request):
+    """Async counterpart of views.authenticate_user"""
+    token = get_bearer_token(request)
+    if not token:
+        logger.warning("Token authentication failed")
+        return None
+
+    if authenticate_token(request):
+        return await aauthenticate_password(request)
+
+    user = await auser_for_token(token)
+    if not user:
+        logger.warning("Token authentication failed")
+    return user
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+async def ping(request):
+    # allow proxies that rename the Authorization header
+    ping_auth = get_auth_header(request)
+
+    if not ping_auth:
+        logger.warning("Ping failed: missing Authorization header")
+        return JsonResponse({'ok': False, 'error': 'Unauthorized - missing Authorization header'}, status=401)
+    if not ping_auth.startswith('Bearer '):
+        logger.warning("Ping failed: Authorization header not using Bearer scheme")
+        return JsonResponse({'ok': False, 'error': 'Unauthorized - Authorization header must use Bearer token'}, status=401)
+    return JsonResponse({'ok': True, 'message': 'pong'})
+
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+@admission_control
+async def add_expense(request):
+    auth_header = get_auth_header(request)
+    if not auth_header:
+        logger.warning("Add expense failed: missing Authorization header")
+        return JsonResponse({'ok': False, 'error': 'Unauthorized - missing Authorization header'}, status=401)
+    if not auth_header.startswith('Bearer '):
+        logger.warning("Add expense failed: Authorization header not using Bearer scheme")
+        return JsonResponse({'ok': False, 'error': 'Unauthorized - Authorization header must use Bearer token'}, status=401)
+
+    user = await aauthenticate_user(request)
+    if not user:
+        return JsonResponse({'ok': False, 'error': 'Unauthorized - invalid credentials or token'}, status=401)
+    # The shared cache may be file or network backed
+    limited = await sync_to_async(check_rate, thread_sensitive=False)(user, rate_limit_token(request))
+    if limited:
+        return limited
+
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({'ok': False, 'error': 'Invalid JSON'}, status=400)
+    else:  # GET request (for debugging)
+        data = request.GET.dict()
+
+    cleaned, error = clean_expense_data(data)
+    if error:
+        return JsonResponse({'ok': False, 'error': error}, status=400)
+    request_id = str(data['request_id']) if data.get('request_id') else None
+
+    if settings.SIRI_INGEST_MODE == 'journal':
+        if request_id:
+            replay = await sync_to_async(stored_responses)(user, [request_id], ADD_EXPENSE_ENDPOINT)
+            if request_id in replay:
+                return replayable_response(replay[request_id], True)
+        # fsync runs outside Django's database thread
+        receipt_id = await sync_to_async(Journal().append, thread_sensitive=False)(user.id, cleaned, request_id)
+        return queued_response(receipt_id, cleaned)
+
+    if not request_id:
+        expense = await ainsert_expense(user, cleaned)
+        logger.info(f"Added expense: {expense}")
+        return JsonResponse(expense_response(expense))
+
+    def create_expense():
+        expense = insert_expense(user, cleaned)
+        logger.info(f"Added expense: {expense}")
+        return expense_response(expense)
+
+    # Transactions aren't available in async code yet, so the insert plus its
+    # idempotency key run together in Django's database thread.
+    response, replayed = await sync_to_async(run_once)(user, request_id, ADD_EXPENSE_ENDPOINT, create_expense)
+    return replayable_response(response, replayed)
@@ -0,0 +1,95 @@
+"""
+Month-to-date spend counters in the cache, for budget status.
+
+There is a counter per (user, month, category) plus one per (user, month)
+for overall spend, held as integer cents in the cache named by
+SPEND_COUNTER_CACHE so they can be adjusted with incr/decr. update_rollups()
+applies each write's delta once its transaction commits; deltas for
+counters that aren't cached are dropped.
+
+A missing counter is rebuilt from the daily rollups when it is read, and
+every counter expires after SPEND_COUNTER_TTL seconds. That expiry is the
+periodic reconciliation with the database: drift from a write that lands
+while a counter is being rebuilt, or from the file cache's non-atomic incr,
+lasts at most that long.
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .rollups import monthly_spend
+
+
+def _cache():
+    return caches[settings.SPEND_COUNTER_CACHE]
+
+
+def counter_key(user_id, month, category_id=None):
+    return f"spend:{user_id}:{month:%Y-%m}:{category_id or 'all'}"
+
+
+def _cents(amount):
+    return int((Decimal(amount) * 100).to_integral_value())
+
+
+def _month_end(month):
+    return (month + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+
+
+def apply_deltas(deltas):
+    """Adjust cached counters by {(user_id, first day of month, category_id): amount}"""
+    by_key = defaultdict(int)
+    for (user_id, month, category_id), amount in deltas.items():
+        by_key[counter_key(user_id, month, category_id)] += _cents(amount)
+        by_key[counter_key(user_id, month)] += _cents(amount)
+
+    cache = _cache()
+    for key, cents in by_key.items():
+        try:
+            if cents > 0:
+                cache.incr(key, cents)
+            elif cents < 0:
+                cache.decr(key, -cents)
+        except ValueError:
+            pass  # not cached; rebuilt from the database when next read
+
+
+def forget(rows):
+    """Drop the counters for (user_id, first day of month, category_id) rows"""
+    keys = set()
+    for user_id, month, category_id in rows:
+        keys.update((counter_key(user_id, month, category_id), counter_key(user_id, month)))
+    _cache().delete_many(list(keys))
+
+
+def month_spend(user, wanted):
+    """{(month, category_id): spent} for (first day of month, category_id or None for overall) pairs.
+
+    Cached counters are used where present; the rest come from one grouped
+    query over the daily rollups and are cached.
+    """
+    cache = _cache()
+    keys = {pair: counter_key(user.pk, *pair) for pair in wanted}
+    cached = cache.get_many(list(keys.values()))
+    spent = {pair: Decimal(cached[key]) / 100 for pair, key in keys.items() if key in cached}
+
+    missing = [pair for pair in keys if pair not in spent]
+    if missing:
+        months = [month for month, _ in missing]
+        by_category = monthly_spend(user, min(months), _month_end(max(months)))
+        by_month = defaultdict(Decimal)
+        for (month, _), total in by_category.items():
+            by_month[month] += total
+        for month, category_id in missing:
+            if category_id is None:
+                spent[(month, category_id)] = by_month[month]
+            else:
+                spent[(month, category_id)] = by_category.get((month, category_id), Decimal(0))
+        cache.set_many(
+            {keys[pair]: _cents(spent[pair]) for pair in missing}, timeout=settings.SPEND_COUNTER_TTL
+        )
+    return spent
@@ -0,0 +1,64 @@
+"""
+Idempotency keys for the Siri endpoints.
+
+A key is a client supplied request_id scoped to a user and an endpoint. The
+SiriRequest row is inserted in the same transaction as the work it guards,
+together with the JSON response that work produced, so a retry either
+conflicts on the (user, request_id, endpoint) unique index and replays the
+stored response, or runs for the first time. There is no separate "already
+seen?" query. Another user's key never matches, so responses are only ever
+replayed to the user they were made for.
+"""
+
+from django.db import IntegrityError, transaction
+
+from .models import SiriRequest
+
+# Returned for keys recorded before responses were stored
+LEGACY_REPLAY = {
+    'ok': True,
+    'message': 'Already processed',
+    'expense_id': None,
+    'created_at': None,
+}
+
+
+def run_once(user, request_id, endpoint, action):
+    """Run action() at most once for the user's (request_id, endpoint).
+
+    action must do its writes through the default database and return a
+    JSON-serializable response. Returns (response, replayed).
+    """
+    if not request_id:
+        return action(), False
+    try:
+        with transaction.atomic():
+            response = action()
+            SiriRequest.objects.create(user=user, request_id=request_id, endpoint=endpoint, response=response)
+        return response, False
+    except IntegrityError:
+        replay = stored_responses(user, [request_id], endpoint)
+        if request_id not in replay:
+            raise  # the conflict came from action() itself
+        return replay[request_id], True
+
+
+def stored_responses(user, request_ids, endpoint):
+    """Return {request_id: response} for the user's keys already recorded"""
+    if not request_ids:
+        return {}
+    rows = SiriRequest.objects.filter(
+        user=user, request_id__in=list(request_ids), endpoint=endpoint
+    ).values_list('request_id', 'response')
+    return {request_id: response or LEGACY_REPLAY for request_id, response in rows}
+
+
+def record_responses(user, responses, endpoint):
+    """Insert the user's keys for {request_id: response}; call inside the guarded transaction.
+
+    Raises IntegrityError if another request recorded one of the keys first.
+    """
+    SiriRequest.objects.bulk_create([
+        SiriRequest(user=user, request_id=request_id, endpoint=endpoint, response=response)
+        for request_id, response in responses.items()
+    ])
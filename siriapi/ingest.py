@@ -0,0 +1,158 @@
+"""
+Validation and bulk writing of expenses shared by the Siri API views, the
+journal drainer and other bulk paths.
+"""
+
+from decimal import Decimal, InvalidOperation
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+
+from .idempotency import record_responses, stored_responses
+from .models import MAX_AMOUNT, Category, Expense, SiriRequest
+from .rollups import update_rollups
+from userprofile.models import user_timezone
+
+ADD_EXPENSE_ENDPOINT = 'add-expense'
+
+
+def request_id_error(request_id):
+    """Error message for a payload's request_id, or None if it is absent or usable"""
+    max_length = SiriRequest._meta.get_field('request_id').max_length
+    if request_id is None or request_id == '':
+        return None
+    if not isinstance(request_id, str):
+        return 'request_id must be a string'
+    if len(request_id) > max_length:
+        return f'request_id too long (max {max_length} characters)'
+    return None
+
+
+def clean_expense_data(data):
+    """Validate one expense payload.
+
+    Returns (cleaned, None) with amount (rounded to cents)/category/note, or
+    (None, error message). A request_id, if present, is checked too.
+    """
+    if not isinstance(data, dict):
+        return None, 'Expense must be a JSON object'
+
+    # Validate amount
+    amount = data.get('amount')
+    try:
+        amount = Decimal(str(amount)) if isinstance(amount, float) else Decimal(amount)
+        if not amount.is_finite() or amount <= 0:
+            raise ValueError
+    except (TypeError, ValueError, InvalidOperation):
+        return None, 'Invalid amount: must be a positive number'
+    # Bounded before quantize(), which fails on more digits than the context holds
+    if amount > MAX_AMOUNT or not 0 < amount.quantize(Decimal('0.01')) <= MAX_AMOUNT:
+        return None, f'Invalid amount: must be between 0.01 and {MAX_AMOUNT}'
+    # Rounded as it will be stored, so the rollups get the same amount
+    amount = amount.quantize(Decimal('0.01'))
+
+    # Validate category
+    category = data.get('category') or ''
+    category = category.strip() if isinstance(category, str) else ''
+    if not category:
+        return None, 'Category is required'
+    if len(category) > 80:
+        return None, 'Category too long (max 80 characters)'
+
+    note = data.get('note') or ''
+    if not isinstance(note, str):
+        note = str(note)
+
+    error = request_id_error(data.get('request_id'))
+    if error:
+        return None, error
+
+    return {'amount': amount, 'category': category, 'note': note}, None
+
+
+def insert_expense(user, cleaned):
+    """Create an expense from clean_expense_data() output, creating its category if new"""
+    with transaction.atomic(savepoint=False):
+        category = Category.objects.for_name(user, cleaned['category'])
+        expense = Expense.objects.create(user=user, **{**cleaned, 'category': category})
+        update_rollups(added=[expense])
+    return expense
+
+
+async def ainsert_expense(user, cleaned):
+    # The expense and its rollup need one transaction, which async code can't open yet
+    return await sync_to_async(insert_expense)(user, cleaned)
+
+
+def expense_response(expense):
+    """The add-expense response body, also stored for idempotent replays"""
+    return {
+        'ok': True,
+        'message': f"Added expense ${expense.amount} to {expense.category}",
+        'expense_id': expense.id,
+        'created_at': expense.created_at.isoformat()
+    }
+
+
+def write_expense_batch(user, items):
+    """Create expenses for [(cleaned, request_id)] in one transaction.
+
+    Returns [(status, response)] in input order, where status is 'created' or
+    'duplicate' (request_id already processed for this user, response is the
+    stored one). Keys are looked up and recorded for user only, so another
+    user's request_ids never collide with theirs.
+    """
+    with transaction.atomic():
+        replays = stored_responses(
+            user, {request_id for _, request_id in items if request_id}, ADD_EXPENSE_ENDPOINT
+        )
+
+        outcomes = []
+        to_create = []  # (outcome index, cleaned, request_id)
+        claimed = set()
+        for cleaned, request_id in items:
+            if request_id in replays or request_id in claimed:
+                outcomes.append(('duplicate', replays.get(request_id)))
+                continue
+            if request_id:
+                claimed.add(request_id)  # repeated ids within the same batch
+            to_create.append((len(outcomes), cleaned, request_id))
+            outcomes.append(None)
+
+        categories = Category.objects.for_names(user, {cleaned['category'] for _, cleaned, _ in to_create})
+
+        expenses = [
+            Expense(user=user, **{**cleaned, 'category': categories[cleaned['category']]})
+            for _, cleaned, _ in to_create
+        ]
+        tzinfo = user_timezone(user)
+        for expense in expenses:
+            expense.set_local_date(tzinfo)  # bulk_create doesn't call save()
+        expenses = Expense.objects.bulk_create(expenses)
+        update_rollups(added=expenses)
+        new_responses = {}
+        for (index, _, request_id), expense in zip(to_create, expenses):
+            response = expense_response(expense)
+            outcomes[index] = ('created', response)
+            if request_id:
+                new_responses[request_id] = response
+        record_responses(user, new_responses, ADD_EXPENSE_ENDPOINT)
+
+    # a repeated id within the batch replays the response of its first occurrence
+    responses = dict(replays)
+    responses.update(new_responses)
+    return [
+        outcome if outcome[1] is not None else ('duplicate', responses[request_id])
+        for outcome, (_, request_id) in zip(outcomes, items)
+    ]
+
+
+def write_expense_batch_with_retry(user, items):
+    """write_expense_batch, retried once if a concurrent request claimed one of the keys"""
+    for attempt in range(2):
+        try:
+            return write_expense_batch(user, items)
+        except IntegrityError:
+            # The retry's lookup sees the keys the other request recorded
+            if attempt:
+                raise
@@ -0,0 +1,143 @@
+"""
+Write-ahead journal for add-expense ingestion.
+
+With SIRI_INGEST_MODE = 'journal', a validated add-expense request is
+appended to a local append-only JSON Lines file and fsynced, and the client
+gets a receipt immediately, so request latency no longer depends on the
+database write lock. `manage.py drain_journal` commits the entries in large
+batches and records how far it got in a checkpoint file next to the journal.
+
+Every entry is written with an idempotency key (the client's request_id, or
+one derived from the receipt), so re-draining entries after a crash never
+creates duplicates.
+"""
+
+import fcntl
+import json
+import os
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils import timezone
+
+
+class Journal:
+    def __init__(self, path=None):
+        self.path = str(path or settings.SIRI_JOURNAL_PATH)
+        self.checkpoint_path = self.path + '.checkpoint'
+        self.lock_path = self.path + '.lock'
+        self.drainer_lock_path = self.path + '.drainer.lock'
+        self.dead_letter_path = self.path + '.dead'
+
+    @contextmanager
+    def _flock(self, path, flags):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(path, 'a') as lock_file:
+            fcntl.flock(lock_file, flags)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def locked(self):
+        """Lock held by appenders and by compaction"""
+        return self._flock(self.lock_path, fcntl.LOCK_EX)
+
+    def drainer_lock(self):
+        """Ensure a single drainer; raises BlockingIOError if another one is running"""
+        return self._flock(self.drainer_lock_path, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def append(self, user_id, cleaned, request_id=None):
+        """Durably append one validated expense and return its receipt id"""
+        receipt_id = uuid.uuid4().hex
+        entry = {
+            'receipt_id': receipt_id,
+            'user_id': user_id,
+            'amount': str(cleaned['amount']),
+            'category': cleaned['category'],
+            'note': cleaned['note'],
+            'request_id': request_id,
+            'received_at': timezone.now().isoformat(),
+        }
+        if cleaned.get('created_at'):  # e.g. "yesterday" in an utterance
+            entry['created_at'] = cleaned['created_at'].isoformat()
+        line = (json.dumps(entry, separators=(',', ':')) + '\n').encode()
+        with self.locked():
+            fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                size = os.fstat(fd).st_size
+                # A crash mid-append can leave a torn last line; terminate it so
+                # it's rejected on its own instead of corrupting this entry.
+                if size and os.pread(fd, 1, size - 1) != b'\n':
+                    line = b'\n' + line
+                os.write(fd, line)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        return receipt_id
+
+    def read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as f:
+                return json.load(f)['offset']
+        except (FileNotFoundError, ValueError, KeyError):
+            return 0
+
+    def write_checkpoint(self, offset):
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'offset': offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def dead_letter(self, entries):
+        """Durably set aside entries the drainer can't commit, for a person to look at"""
+        lines = ''.join(json.dumps(entry, separators=(',', ':')) + '\n' for entry in entries)
+        with open(self.dead_letter_path, 'a') as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read_batch(self, offset, limit):
+        """Return (entries, rejected_lines, next_offset) for up to limit complete lines"""
+        entries, rejected = [], []
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return entries, rejected, 0
+        with f:
+            if offset > os.fstat(f.fileno()).st_size:
+                offset = 0  # journal was compacted after the checkpoint was written
+            f.seek(offset)
+            while len(entries) + len(rejected) < limit:
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    break  # end of file, or an append still in progress
+                offset += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    rejected.append(line)
+        return entries, rejected, offset
+
+    def compact(self, offset):
+        """Truncate the journal if everything up to offset is drained and nothing new arrived"""
+        with self.locked():
+            try:
+                if os.path.getsize(self.path) != offset:
+                    return False
+            except FileNotFoundError:
+                return False
+            # Checkpoint first: a crash in between only re-drains idempotent entries
+            self.write_checkpoint(0)
+            os.truncate(self.path, 0)
+        return True
+
+
+def journal_request_id(entry):
+    """Idempotency key used when committing a journal entry"""
+    return entry.get('request_id') or f"journal:{entry['receipt_id']}"
@@ -0,0 +1,49 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from siriapi.models import ApiToken
+from siriapi.tokens import issue_token, revoke_token
+
+
+class Command(BaseCommand):
+    help = "Issue, list or revoke per-user Siri API tokens"
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+
+        issue = subparsers.add_parser('issue', help='Issue a new token for a user')
+        issue.add_argument('username')
+        issue.add_argument('--name', default='', help='Label shown in token lists')
+
+        listing = subparsers.add_parser('list', help="List a user's tokens")
+        listing.add_argument('username')
+
+        revoke = subparsers.add_parser('revoke', help='Revoke a token by its prefix')
+        revoke.add_argument('prefix')
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action == 'revoke':
+            tokens = list(ApiToken.objects.filter(prefix=options['prefix'], revoked_at__isnull=True))
+            if not tokens:
+                raise CommandError(f"No active token with prefix {options['prefix']}")
+            for token in tokens:
+                revoke_token(token)
+            self.stdout.write(self.style.SUCCESS(f"Revoked {len(tokens)} token(s)"))
+            return
+
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist")
+
+        if action == 'issue':
+            token, raw_token = issue_token(user, name=options['name'])
+            self.stdout.write(f"Issued token {token.prefix} for {user.username}.")
+            self.stdout.write("Store it now, it cannot be shown again:")
+            self.stdout.write(raw_token)
+        else:
+            for token in user.api_tokens.order_by('-created_at'):
+                status = 'revoked' if token.revoked_at else 'active'
+                last_used = token.last_used_at.isoformat() if token.last_used_at else 'never'
+                self.stdout.write(f"{token.prefix}  {status:8}  last used: {last_used}  {token.name}")
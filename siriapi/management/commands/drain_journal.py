@@ -0,0 +1,112 @@
+import logging
+import time
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from django.utils.dateparse import parse_datetime
+
+from siriapi.ingest import clean_expense_data, write_expense_batch
+from siriapi.journal import Journal, journal_request_id
+
+logger = logging.getLogger(__name__)
+
+# Attempts at a batch that keeps conflicting before its entries are committed one by one
+MAX_ATTEMPTS = 3
+
+
+class Command(BaseCommand):
+    help = (
+        "Commit add-expense entries from the write-ahead journal (SIRI_INGEST_MODE=journal) "
+        "in batched transactions. Runs continuously unless --once is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Journal file (default: SIRI_JOURNAL_PATH)')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Journal entries committed per transaction (default: %(default)s)',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help='Seconds to wait when the journal is empty (default: %(default)s)',
+        )
+        parser.add_argument('--once', action='store_true', help='Drain what is there now, then exit')
+
+    def handle(self, *args, **options):
+        journal = Journal(options['path'])
+        try:
+            with journal.drainer_lock():
+                self.run(journal, options)
+        except BlockingIOError:
+            raise CommandError(f"Another drainer is already running for {journal.path}")
+
+    def run(self, journal, options):
+        total = 0
+        attempts = 0
+        while True:
+            offset = journal.read_checkpoint()
+            entries, rejected, next_offset = journal.read_batch(offset, options['batch_size'])
+            if next_offset == offset:
+                journal.compact(offset)
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+                continue
+
+            for line in rejected:
+                logger.error(f"Skipping unreadable journal line: {line[:200]!r}")
+            try:
+                committed = self.commit(entries)
+            except IntegrityError:
+                attempts += 1
+                if attempts < MAX_ATTEMPTS:
+                    # Usually a direct request claimed one of the keys meanwhile; the retry replays it
+                    logger.warning(f"Idempotency conflict while draining journal, retrying batch ({attempts})")
+                    time.sleep(options['interval'] * attempts)
+                    continue
+                committed = self.commit_each(journal, entries)
+            attempts = 0
+            # Only advance once the batch is committed; replays after a crash are deduplicated
+            journal.write_checkpoint(next_offset)
+            total += committed
+            self.stdout.write(f"Committed {committed} of {len(entries)} journal entries")
+
+        self.stdout.write(self.style.SUCCESS(f"Journal drained: {total} expenses committed"))
+
+    def commit_each(self, journal, entries):
+        """Commit entries one at a time, setting aside those that still conflict"""
+        created, dead = 0, []
+        for entry in entries:
+            try:
+                created += self.commit([entry])
+            except IntegrityError:
+                dead.append(entry)
+        if dead:
+            journal.dead_letter(dead)
+            logger.error(f"Moved {len(dead)} conflicting journal entries to {journal.dead_letter_path}")
+        return created
+
+    def commit(self, entries):
+        """Write entries in one transaction and return how many expenses were created"""
+        by_user = defaultdict(list)
+        for entry in entries:
+            cleaned, error = clean_expense_data(entry)
+            if error:
+                logger.error(f"Skipping invalid journal entry {entry.get('receipt_id')}: {error}")
+                continue
+            cleaned['created_at'] = parse_datetime(entry.get('created_at') or entry['received_at'])
+            by_user[entry['user_id']].append((cleaned, journal_request_id(entry)))
+
+        users = User.objects.in_bulk(list(by_user))
+        created = 0
+        with transaction.atomic():
+            for user_id, items in by_user.items():
+                user = users.get(user_id)
+                if user is None:
+                    logger.warning(f"Dropping {len(items)} journal entries for deleted user {user_id}")
+                    continue
+                outcomes = write_expense_batch(user, items)
+                created += sum(1 for status, _ in outcomes if status == 'created')
+        return created
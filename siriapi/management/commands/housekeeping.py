@@ -0,0 +1,113 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from siriapi.models import ApiToken, SiriRequest
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired idempotency keys, sessions and revoked API tokens in small "
+        "chunks, then refresh planner statistics and reclaim free pages. Safe to "
+        "run from cron while the server is taking traffic."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ttl-days', type=int, default=settings.SIRI_REQUEST_TTL_DAYS,
+            help='Keep idempotency keys and revoked tokens for this many days (default: %(default)s)',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Rows deleted per transaction (default: %(default)s)',
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0.05,
+            help='Seconds to sleep between chunks so requests can take the write lock (default: %(default)s)',
+        )
+        parser.add_argument(
+            '--skip-db-maintenance', action='store_true',
+            help='Only delete rows; skip ANALYZE / VACUUM',
+        )
+        parser.add_argument(
+            '--full-vacuum', action='store_true',
+            help='SQLite only: switch to incremental auto-vacuum and rebuild the file. '
+                 'Takes an exclusive lock; run during a maintenance window.',
+        )
+
+    def handle(self, *args, **options):
+        self.chunk_size = options['chunk_size']
+        self.pause = options['pause']
+        now = timezone.now()
+        cutoff = now - timedelta(days=options['ttl_days'])
+        started = time.monotonic()
+
+        self.run_task('Idempotency keys', lambda: self.delete_in_chunks(
+            SiriRequest.objects.filter(created_at__lt=cutoff)))
+        self.run_task('Expired sessions', lambda: self.delete_in_chunks(
+            Session.objects.filter(expire_date__lt=now)))
+        self.run_task('Revoked API tokens', lambda: self.delete_in_chunks(
+            ApiToken.objects.filter(revoked_at__lt=cutoff)))
+
+        if not options['skip_db_maintenance']:
+            tables = [model._meta.db_table for model in (SiriRequest, Session, ApiToken)]
+            self.run_task('Database maintenance', lambda: self.optimize_database(tables, options['full_vacuum']))
+
+        self.stdout.write(self.style.SUCCESS(f"Housekeeping finished in {time.monotonic() - started:.2f}s"))
+
+    def run_task(self, label, task):
+        started = time.monotonic()
+        result = task()
+        elapsed = time.monotonic() - started
+        if isinstance(result, int):
+            self.stdout.write(f"{label}: removed {result} rows in {elapsed:.2f}s")
+        else:
+            self.stdout.write(f"{label}: {result} in {elapsed:.2f}s")
+
+    def delete_in_chunks(self, queryset):
+        """Delete matching rows a chunk at a time, each chunk in its own short transaction.
+
+        Chunks are taken in primary key order so the oldest rows are found
+        first without needing an index on the filter column.
+        """
+        manager = queryset.model._base_manager
+        total = 0
+        while True:
+            pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:self.chunk_size])
+            if not pks:
+                return total
+            manager.filter(pk__in=pks).delete()
+            total += len(pks)
+            if len(pks) < self.chunk_size:
+                return total
+            time.sleep(self.pause)
+
+    def optimize_database(self, tables, full_vacuum):
+        vendor = connection.vendor
+        with connection.cursor() as cursor:
+            if vendor == 'sqlite':
+                if full_vacuum:
+                    cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                    cursor.execute('VACUUM')
+                cursor.execute('PRAGMA auto_vacuum')
+                incremental = cursor.fetchone()[0] == 2
+                if incremental:
+                    # Returns free pages to the OS without rewriting the whole file
+                    cursor.execute('PRAGMA incremental_vacuum')
+                    cursor.fetchall()
+                cursor.execute('PRAGMA optimize')
+                cursor.execute('ANALYZE')
+                if incremental:
+                    return 'ran ANALYZE and incremental VACUUM'
+                return 'ran ANALYZE (incremental VACUUM disabled; run once with --full-vacuum to enable it)'
+            if vendor == 'postgresql':
+                # VACUUM can't run inside a transaction; the connection is in autocommit here
+                for table in tables:
+                    cursor.execute(f'VACUUM (ANALYZE) {connection.ops.quote_name(table)}')
+                return f'ran VACUUM (ANALYZE) on {len(tables)} tables'
+        return f'skipped (no maintenance defined for {vendor})'
@@ -0,0 +1,76 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from siriapi.statements import (
+    BATCH_SIZE,
+    DEFAULT_CATEGORY,
+    STATEMENT_FORMATS,
+    StatementError,
+    StatementImport,
+    statement_rows,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a bank or card statement (CSV or OFX) as a user's expenses. Lines already imported "
+        "are skipped, so overlapping statements can be imported safely."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=STATEMENT_FORMATS,
+                            help='Statement format (default: from the file extension, else csv)')
+        parser.add_argument('--category', default=DEFAULT_CATEGORY,
+                            help='Category for lines whose description matches none (default: %(default)s)')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Lines written per transaction (default: %(default)s)')
+        csv_group = parser.add_argument_group('CSV statements')
+        csv_group.add_argument('--date-format', default='%Y-%m-%d',
+                               help='strptime format of the date column (default: %(default)s)')
+        csv_group.add_argument('--spends-positive', action='store_true',
+                               help='Spends are positive amounts, as in most card exports (default: negative)')
+        for field in ('date', 'amount', 'debit', 'description', 'category'):
+            csv_group.add_argument(f'--{field}-column', metavar='HEADER', help=f'Header of the {field} column')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"Unknown user: {options['username']}")
+        statement_format = options['format'] or ('ofx' if options['path'].lower().endswith(('.ofx', '.qfx')) else 'csv')
+        csv_options = {}
+        if statement_format == 'csv':
+            csv_options = {
+                'columns': {
+                    field: options[f'{field}_column']
+                    for field in ('date', 'amount', 'debit', 'description', 'category')
+                    if options[f'{field}_column']
+                },
+                'date_format': options['date_format'],
+                'spend_sign': 1 if options['spends_positive'] else -1,
+            }
+
+        importer = StatementImport(
+            user, options['category'], options['batch_size'],
+            progress=lambda counts: self.stderr.write(self.describe(counts)),
+        )
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig', errors='replace') as stream:
+                counts = importer.import_rows(statement_rows(stream, statement_format, **csv_options))
+        except (OSError, StatementError) as e:
+            raise CommandError(str(e))
+
+        for error in importer.errors[:20]:
+            self.stderr.write(error)
+        if len(importer.errors) > 20:
+            self.stderr.write(f"... and {len(importer.errors) - 20} more invalid lines")
+        self.stdout.write(self.style.SUCCESS(self.describe(counts)))
+
+    @staticmethod
+    def describe(counts):
+        return (
+            f"{counts['read']} lines read: {counts['created']} imported, {counts['duplicate']} already imported, "
+            f"{counts['skipped']} not spends, {counts['invalid']} invalid"
+        )
@@ -0,0 +1,50 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from siriapi.rollups import rebuild, verify
+
+
+class Command(BaseCommand):
+    help = "Verify the daily spending rollups against the expenses, or rebuild them from scratch"
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+        for action, help_text in (
+            ('verify', 'Report rollups that disagree with the expenses; exits non-zero if any do'),
+            ('rebuild', 'Recompute the rollups from the expenses'),
+        ):
+            subparser = subparsers.add_parser(action, help=help_text)
+            subparser.add_argument('--user', action='append', dest='usernames', metavar='USERNAME',
+                                   help='Only this user (repeatable); default is every user')
+
+    def handle(self, *args, **options):
+        users = None
+        if options['usernames']:
+            users = list(User.objects.filter(username__in=options['usernames']))
+            missing = set(options['usernames']) - {user.username for user in users}
+            if missing:
+                raise CommandError(f"Unknown user(s): {', '.join(sorted(missing))}")
+
+        if options['action'] == 'rebuild':
+            written = rebuild(users)
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt daily rollups: {written} rows"))
+            return
+
+        mismatches = verify(users)
+        for (user_id, day, category_id), expected, stored in mismatches:
+            self.stdout.write(
+                f"user {user_id} {day} category {category_id}: "
+                f"expected {self.describe(expected)}, stored {self.describe(stored)}"
+            )
+        if mismatches:
+            raise CommandError(
+                f"{len(mismatches)} rollup row(s) disagree with the expenses; run 'rollups rebuild' to fix"
+            )
+        self.stdout.write(self.style.SUCCESS("Daily rollups match the expenses"))
+
+    @staticmethod
+    def describe(value):
+        if value is None:
+            return 'nothing'
+        total, count = value
+        return f"${total} in {count} expense(s)"
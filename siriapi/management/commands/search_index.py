@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from siriapi.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the SQLite full-text search index over expense notes and categories, "
+        "recreating its triggers (needed after a migration rebuilds the expense table)"
+    )
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+        subparsers.add_parser('rebuild', help='Recreate the table and triggers and refill the index')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("Only SQLite keeps a separate search index; PostgreSQL indexes are maintained by the database")
+        with transaction.atomic():
+            rebuild_index()
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt"))
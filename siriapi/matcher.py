@@ -0,0 +1,183 @@
+"""
+Per-user category matcher for the utterance endpoint.
+
+Category names and learned aliases are compiled into an Aho-Corasick
+automaton over words, so finding every category mentioned in an utterance is
+a single pass over its words regardless of how many categories the user has.
+Matching on whole words gives word boundaries for free ("bus" never matches
+inside "business").
+
+Compiled matchers are kept in a small in-process cache and validated against
+a per-user version stamp in the "shared" cache; adding or changing a
+category or alias changes that stamp (see siriapi.signals), so every worker
+process rebuilds on its next utterance. Entries also expire after
+MAX_AGE_SECONDS in case a stamp is evicted from the shared cache.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import Category, CategoryAlias, normalize_category_name
+
+CACHE_MAX_ENTRIES = 256
+MAX_AGE_SECONDS = 600
+
+WORD_RE = re.compile(r"\$?\d[\d,]*(?:\.\d+)?|[^\W\d_]+")
+
+_cache = OrderedDict()  # user_id -> (version, CategoryMatcher, expires_at)
+_cache_lock = threading.Lock()
+
+
+def words(text):
+    """Split text into words; apostrophes are dropped so "McDonald's" is one word"""
+    text = text.replace("'", '').replace('’', '').replace('&', ' and ')
+    return WORD_RE.findall(text)
+
+
+def singular(word):
+    """Crude singular form so "groceries" matches "Grocery" and "tacos" matches "Taco" """
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def match_key(text):
+    """Words of text in the form the automaton matches on"""
+    return tuple(singular(word.casefold()) for word in words(text))
+
+
+class Automaton:
+    """Aho-Corasick automaton whose alphabet is words rather than characters"""
+
+    def __init__(self, patterns):
+        # patterns: {tuple of words: value}
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for key, value in patterns.items():
+            state = 0
+            for word in key:
+                if word not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                    self.goto[state][word] = len(self.goto) - 1
+                state = self.goto[state][word]
+            self.out[state].append((len(key), value))
+
+        # Breadth-first, so a state's failure link is final before its children's
+        queue = deque(self.goto[0].values())  # depth 1 states fail to the root
+        while queue:
+            state = queue.popleft()
+            for word, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(word, 0)
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def find(self, keys):
+        """Yield (start, end, value) for every pattern occurring in the word sequence keys"""
+        state = 0
+        for end, word in enumerate(keys, 1):
+            while state and word not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(word, 0)
+            for length, value in self.out[state]:
+                yield end - length, end, value
+
+
+class CategoryMatcher:
+    def __init__(self, names, aliases):
+        """names: category names; aliases: {alias text: category name}"""
+        patterns = {}
+        for alias, category in aliases.items():
+            key = match_key(alias)
+            if key:
+                patterns[key] = (category, 'alias')
+        for name in names:
+            key = match_key(name)
+            if key:
+                patterns[key] = (name, 'name')  # a real category beats an alias
+        self.categories = {name.casefold() for name in names}
+        self.automaton = Automaton(patterns)
+
+    def knows(self, category):
+        return category.casefold() in self.categories
+
+    def best_match(self, keys, exclude=()):
+        """Return (start, end, category, source) for the longest match, earliest first, or None.
+
+        Matches overlapping a (start, end) span in exclude are ignored.
+        """
+        best = None
+        for start, end, (category, source) in self.automaton.find(keys):
+            if any(start < ex_end and ex_start < end for ex_start, ex_end in exclude):
+                continue
+            if best is None or end - start > best[1] - best[0]:
+                best = (start, end, category, source)
+        return best
+
+
+def build_matcher(user_id):
+    """Compile a matcher from the user's categories and aliases"""
+    names = Category.objects.filter(user_id=user_id).values_list('name', flat=True)
+    aliases = CategoryAlias.objects.filter(user_id=user_id).values_list('alias', 'category__name')
+    return CategoryMatcher(list(names), dict(aliases))
+
+
+def _shared_cache():
+    return caches['shared']
+
+
+def _version_key(user_id):
+    return f'categories:version:{user_id}'
+
+
+def get_matcher(user_id):
+    """The compiled matcher for a user, rebuilt only after their categories change"""
+    version = _shared_cache().get(_version_key(user_id), 0)
+    with _cache_lock:
+        entry = _cache.get(user_id)
+        if entry and entry[0] == version and entry[2] > time.monotonic():
+            _cache.move_to_end(user_id)
+            return entry[1]
+
+    matcher = build_matcher(user_id)
+    with _cache_lock:
+        _cache[user_id] = (version, matcher, time.monotonic() + MAX_AGE_SECONDS)
+        _cache.move_to_end(user_id)
+        while len(_cache) > CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return matcher
+
+
+def invalidate(user_id):
+    """Make every process rebuild the user's matcher once the current transaction commits"""
+    def bump():
+        # A timestamp rather than a counter, so an evicted stamp never comes back with an old value
+        _shared_cache().set(_version_key(user_id), time.time_ns(), timeout=None)
+    transaction.on_commit(bump)
+
+
+def learn_alias(user, alias, category_name):
+    """Remember that alias (e.g. a merchant) means the named category for this user"""
+    alias = alias.casefold().strip()
+    if not alias or alias == normalize_category_name(category_name):
+        return
+    category = Category.objects.for_name(user, category_name)
+    CategoryAlias.objects.update_or_create(user=user, alias=alias, defaults={'category': category})
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
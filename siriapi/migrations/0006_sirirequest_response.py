@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-17 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("siriapi", "0005_apitoken"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sirirequest",
+            name="response",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="sirirequest",
+            name="request_id",
+            field=models.CharField(max_length=255),
+        ),
+    ]
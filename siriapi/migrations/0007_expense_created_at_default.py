@@ -0,0 +1,19 @@
+# Generated by Django 6.0.1 on 2026-10-17 11:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("siriapi", "0006_sirirequest_response"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="expense",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 6.0.1 on 2026-10-17 13:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("siriapi", "0008_categoryalias"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Category",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=80)),
+                ("normalized_name", models.CharField(max_length=80)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="categories",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "categories",
+                "unique_together": {("user", "normalized_name")},
+            },
+        ),
+        migrations.AddField(
+            model_name="budget",
+            name="category_ref",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="siriapi.category",
+            ),
+        ),
+        migrations.AddField(
+            model_name="categoryalias",
+            name="category_ref",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="siriapi.category",
+            ),
+        ),
+        migrations.AddField(
+            model_name="expense",
+            name="category_ref",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="siriapi.category",
+            ),
+        ),
+        # Replaced by the same constraint on the foreign key in 0011
+        migrations.AlterUniqueTogether(
+            name="budget",
+            unique_together=set(),
+        ),
+    ]
@@ -0,0 +1,87 @@
+from collections import Counter
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def normalize(name):
+    return " ".join(name.split()).casefold()
+
+
+def backfill_categories(apps, schema_editor):
+    Category = apps.get_model("siriapi", "Category")
+    Expense = apps.get_model("siriapi", "Expense")
+    Budget = apps.get_model("siriapi", "Budget")
+    CategoryAlias = apps.get_model("siriapi", "CategoryAlias")
+
+    # (user_id, name as stored) -> number of expenses using it
+    usage = Counter()
+    for row in Expense.objects.values("user_id", "category").annotate(n=Count("id")):
+        usage[(row["user_id"], row["category"])] += row["n"]
+    for model in (Budget, CategoryAlias):
+        for key in model.objects.exclude(category="").values_list(
+            "user_id", "category"
+        ):
+            usage[key] += 0
+
+    # "Food", "food " and "FOOD" become one category named after the most used spelling
+    canonical = {}  # (user_id, normalized) -> (uses, display name)
+    for (user_id, raw), uses in usage.items():
+        display = " ".join(raw.split()) or "Uncategorized"
+        key = (user_id, normalize(display))
+        if key not in canonical or uses > canonical[key][0]:
+            canonical[key] = (uses, display)
+    Category.objects.bulk_create(
+        Category(user_id=user_id, name=display, normalized_name=normalized)
+        for (user_id, normalized), (_, display) in canonical.items()
+    )
+    ids = {
+        (user_id, normalized): pk
+        for pk, user_id, normalized in Category.objects.values_list(
+            "pk", "user_id", "normalized_name"
+        )
+    }
+
+    for user_id, raw in usage:
+        category_id = ids[
+            (user_id, normalize(" ".join(raw.split()) or "Uncategorized"))
+        ]
+        for model in (Expense, Budget, CategoryAlias):
+            model.objects.filter(user_id=user_id, category=raw).update(
+                category_ref_id=category_id
+            )
+    Budget.objects.filter(category="").update(category_ref=None)
+
+    # Budgets that only differed in spelling now collide; keep the newest
+    duplicates = (
+        Budget.objects.filter(category_ref__isnull=False)
+        .values("user_id", "period", "category_ref_id")
+        .annotate(n=Count("id"), keep=Max("id"))
+        .filter(n__gt=1)
+    )
+    for row in duplicates:
+        Budget.objects.filter(
+            user_id=row["user_id"],
+            period=row["period"],
+            category_ref_id=row["category_ref_id"],
+        ).exclude(id=row["keep"]).delete()
+
+
+def restore_category_names(apps, schema_editor):
+    Category = apps.get_model("siriapi", "Category")
+    for category in Category.objects.all():
+        for model_name in ("Expense", "Budget", "CategoryAlias"):
+            apps.get_model("siriapi", model_name).objects.filter(
+                category_ref=category
+            ).update(category=category.name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("siriapi", "0009_category"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_categories, restore_category_names),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 6.0.1 on 2026-10-17 13:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("siriapi", "0010_backfill_categories"),
+    ]
+
+    operations = [
+        # Defaults only matter when unapplying: the text columns come back empty
+        # and 0010 fills them in again
+        migrations.AlterField(
+            model_name="expense",
+            name="category",
+            field=models.CharField(default="", max_length=80),
+        ),
+        migrations.AlterField(
+            model_name="categoryalias",
+            name="category",
+            field=models.CharField(default="", max_length=80),
+        ),
+        migrations.RemoveField(
+            model_name="expense",
+            name="category",
+        ),
+        migrations.RemoveField(
+            model_name="budget",
+            name="category",
+        ),
+        migrations.RemoveField(
+            model_name="categoryalias",
+            name="category",
+        ),
+        migrations.RenameField(
+            model_name="expense",
+            old_name="category_ref",
+            new_name="category",
+        ),
+        migrations.RenameField(
+            model_name="budget",
+            old_name="category_ref",
+            new_name="category",
+        ),
+        migrations.RenameField(
+            model_name="categoryalias",
+            old_name="category_ref",
+            new_name="category",
+        ),
+        migrations.AlterField(
+            model_name="expense",
+            name="category",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="expenses",
+                to="siriapi.category",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="budget",
+            name="category",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="budgets",
+                to="siriapi.category",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="categoryalias",
+            name="category",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="aliases",
+                to="siriapi.category",
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="budget",
+            unique_together={("user", "period", "category")},
+        ),
+        migrations.AddConstraint(
+            model_name="budget",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("category__isnull", True)),
+                fields=("user", "period"),
+                name="unique_overall_budget",
+            ),
+        ),
+    ]
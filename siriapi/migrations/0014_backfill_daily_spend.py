@@ -0,0 +1,48 @@
+# Generated by Django 6.0.1 on 2026-10-17 15:32
+
+from django.db import migrations
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def backfill_daily_spend(apps, schema_editor):
+    DailySpend = apps.get_model("siriapi", "DailySpend")
+    Expense = apps.get_model("siriapi", "Expense")
+
+    rows = (
+        Expense.objects.annotate(
+            day=TruncDate("created_at", tzinfo=timezone.get_current_timezone())
+        )
+        .values("user", "day", "category")
+        .annotate(total=Sum("amount"), count=Count("id"))
+        .order_by()
+    )
+    DailySpend.objects.bulk_create(
+        [
+            DailySpend(
+                user_id=row["user"],
+                day=row["day"],
+                category_id=row["category"],
+                total=row["total"],
+                count=row["count"],
+            )
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+
+
+def clear_daily_spend(apps, schema_editor):
+    apps.get_model("siriapi", "DailySpend").objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("siriapi", "0013_dailyspend"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_daily_spend, clear_daily_spend),
+    ]
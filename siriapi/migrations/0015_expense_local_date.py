@@ -0,0 +1,24 @@
+# Generated by Django 6.0.1 on 2026-10-17 16:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("siriapi", "0014_backfill_daily_spend"),
+        ("userprofile", "0002_userprofile_timezone"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="expense",
+            name="local_date",
+            field=models.DateField(null=True),
+        ),
+        migrations.AddField(
+            model_name="expense",
+            name="local_period",
+            field=models.CharField(max_length=7, null=True),
+        ),
+    ]
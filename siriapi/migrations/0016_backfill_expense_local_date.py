@@ -0,0 +1,54 @@
+# Generated by Django 6.0.1 on 2026-10-17 16:46
+
+import zoneinfo
+
+from django.conf import settings
+from django.db import migrations, transaction
+from django.utils import timezone
+
+CHUNK_SIZE = 1000
+
+
+def backfill_local_dates(apps, schema_editor):
+    Expense = apps.get_model("siriapi", "Expense")
+    UserProfile = apps.get_model("userprofile", "UserProfile")
+
+    zones = {}
+    for user_id, name in UserProfile.objects.values_list("user_id", "timezone"):
+        try:
+            zones[user_id] = zoneinfo.ZoneInfo(name)
+        except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+            pass
+    default = zoneinfo.ZoneInfo(settings.TIME_ZONE)
+
+    # One short transaction per chunk, so writers are never blocked for long
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            chunk = list(
+                Expense.objects.filter(id__gt=last_id, local_date__isnull=True)
+                .order_by("id")
+                .only("id", "user_id", "created_at")[:CHUNK_SIZE]
+            )
+            if not chunk:
+                break
+            for expense in chunk:
+                local = timezone.localtime(
+                    expense.created_at, zones.get(expense.user_id, default)
+                )
+                expense.local_date = local.date()
+                expense.local_period = local.strftime("%Y-%m")
+            Expense.objects.bulk_update(chunk, ["local_date", "local_period"])
+        last_id = chunk[-1].id
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("siriapi", "0015_expense_local_date"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_local_dates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 6.0.1 on 2026-10-17 16:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("siriapi", "0016_backfill_expense_local_date"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="expense",
+            name="local_date",
+            field=models.DateField(),
+        ),
+        migrations.AlterField(
+            model_name="expense",
+            name="local_period",
+            field=models.CharField(max_length=7),
+        ),
+        migrations.RemoveIndex(
+            model_name="expense",
+            name="expense_user_cat_created_idx",
+        ),
+        migrations.AddIndex(
+            model_name="expense",
+            index=models.Index(
+                fields=["user", "local_date", "created_at", "id"],
+                name="expense_user_local_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="expense",
+            index=models.Index(
+                fields=["user", "local_period", "created_at", "id"],
+                name="expense_user_period_idx",
+            ),
+        ),
+    ]
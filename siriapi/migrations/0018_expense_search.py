@@ -0,0 +1,85 @@
+# Generated by Django 6.0.1 on 2026-10-17 18:05
+
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS siriapi_expense_fts USING fts5(
+        owner, note, category, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS siriapi_expense_fts_insert AFTER INSERT ON siriapi_expense BEGIN
+        INSERT INTO siriapi_expense_fts (rowid, owner, note, category)
+        VALUES (new.id, 'u' || new.user_id, new.note, (SELECT name FROM siriapi_category WHERE id = new.category_id));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS siriapi_expense_fts_update
+    AFTER UPDATE OF user_id, note, category_id ON siriapi_expense BEGIN
+        DELETE FROM siriapi_expense_fts WHERE rowid = old.id;
+        INSERT INTO siriapi_expense_fts (rowid, owner, note, category)
+        VALUES (new.id, 'u' || new.user_id, new.note, (SELECT name FROM siriapi_category WHERE id = new.category_id));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS siriapi_expense_fts_delete AFTER DELETE ON siriapi_expense BEGIN
+        DELETE FROM siriapi_expense_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS siriapi_category_fts_rename AFTER UPDATE OF name ON siriapi_category BEGIN
+        UPDATE siriapi_expense_fts SET category = new.name
+        WHERE rowid IN (SELECT id FROM siriapi_expense WHERE category_id = new.id);
+    END
+    """,
+    """
+    INSERT INTO siriapi_expense_fts (rowid, owner, note, category)
+    SELECT e.id, 'u' || e.user_id, e.note, c.name
+    FROM siriapi_expense e JOIN siriapi_category c ON c.id = e.category_id
+    """,
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS siriapi_category_fts_rename",
+    "DROP TRIGGER IF EXISTS siriapi_expense_fts_delete",
+    "DROP TRIGGER IF EXISTS siriapi_expense_fts_update",
+    "DROP TRIGGER IF EXISTS siriapi_expense_fts_insert",
+    "DROP TABLE IF EXISTS siriapi_expense_fts",
+]
+
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS siriapi_expense_note_fts "
+    "ON siriapi_expense USING gin (to_tsvector('simple', note))",
+    # Django's icontains compares UPPER(name)
+    "CREATE INDEX IF NOT EXISTS siriapi_category_name_trgm "
+    "ON siriapi_category USING gin (UPPER(name) gin_trgm_ops)",
+]
+
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS siriapi_category_name_trgm",
+    "DROP INDEX IF EXISTS siriapi_expense_note_fts",
+]
+
+
+def run(statements_by_vendor):
+    def operation(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("siriapi", "0017_expense_local_date_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({"sqlite": SQLITE_FORWARD, "postgresql": POSTGRES_FORWARD}),
+            run({"sqlite": SQLITE_BACKWARD, "postgresql": POSTGRES_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 6.0.1 on 2026-10-17 19:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("siriapi", "0019_dataversion"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="expense",
+            name="import_hash",
+            field=models.CharField(
+                blank=True, editable=False, max_length=64, null=True
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="expense",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("import_hash__isnull", False)),
+                fields=("user", "import_hash"),
+                name="expense_user_import_hash_uniq",
+            ),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 6.0.1 on 2026-10-17 20:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def assign_users(apps, schema_editor):
+    """Give each stored key the user of the expense its response names; drop keys that name none"""
+    SiriRequest = apps.get_model("siriapi", "SiriRequest")
+    Expense = apps.get_model("siriapi", "Expense")
+
+    keys = list(SiriRequest.objects.only("id", "response"))
+    expense_ids = {
+        key.response.get("expense_id") for key in keys if isinstance(key.response, dict)
+    }
+    owners = dict(
+        Expense.objects.filter(
+            id__in=[i for i in expense_ids if isinstance(i, int)]
+        ).values_list("id", "user_id")
+    )
+    for key in keys:
+        expense_id = (
+            key.response.get("expense_id") if isinstance(key.response, dict) else None
+        )
+        key.user_id = owners.get(expense_id)
+    SiriRequest.objects.bulk_update(keys, ["user_id"], batch_size=1000)
+    # Legacy keys without a stored response can't be attributed; they expire anyway
+    SiriRequest.objects.filter(user__isnull=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("siriapi", "0020_expense_import_hash"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sirirequest",
+            name="user",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="siri_requests",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.RunPython(assign_users, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="sirirequest",
+            name="user",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="siri_requests",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="sirirequest",
+            unique_together={("user", "request_id", "endpoint")},
+        ),
+    ]
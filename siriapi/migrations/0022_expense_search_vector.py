@@ -0,0 +1,79 @@
+# Generated by Django 6.0.1 on 2026-10-17 21:00
+
+from django.db import migrations
+
+# One tsvector over note and category name, so each query word may match
+# either; replaces 0018's note-only index and category name trigram index.
+POSTGRES_FORWARD = [
+    "ALTER TABLE siriapi_expense ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    """
+    CREATE OR REPLACE FUNCTION siriapi_expense_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := to_tsvector('simple', coalesce(NEW.note, '') || ' ' ||
+            coalesce((SELECT name FROM siriapi_category WHERE id = NEW.category_id), ''));
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER siriapi_expense_search_vector
+    BEFORE INSERT OR UPDATE OF note, category_id ON siriapi_expense
+    FOR EACH ROW EXECUTE FUNCTION siriapi_expense_search_vector()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION siriapi_category_search_rename() RETURNS trigger AS $$
+    BEGIN
+        UPDATE siriapi_expense SET search_vector = to_tsvector('simple', note || ' ' || NEW.name)
+        WHERE category_id = NEW.id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER siriapi_category_search_rename
+    AFTER UPDATE OF name ON siriapi_category
+    FOR EACH ROW EXECUTE FUNCTION siriapi_category_search_rename()
+    """,
+    """
+    UPDATE siriapi_expense e SET search_vector = to_tsvector('simple', e.note || ' ' || c.name)
+    FROM siriapi_category c WHERE c.id = e.category_id
+    """,
+    "CREATE INDEX IF NOT EXISTS siriapi_expense_search ON siriapi_expense USING gin (search_vector)",
+    "DROP INDEX IF EXISTS siriapi_category_name_trgm",
+    "DROP INDEX IF EXISTS siriapi_expense_note_fts",
+]
+
+POSTGRES_BACKWARD = [
+    "CREATE INDEX IF NOT EXISTS siriapi_expense_note_fts "
+    "ON siriapi_expense USING gin (to_tsvector('simple', note))",
+    "CREATE INDEX IF NOT EXISTS siriapi_category_name_trgm "
+    "ON siriapi_category USING gin (UPPER(name) gin_trgm_ops)",
+    "DROP INDEX IF EXISTS siriapi_expense_search",
+    "DROP TRIGGER IF EXISTS siriapi_category_search_rename ON siriapi_category",
+    "DROP FUNCTION IF EXISTS siriapi_category_search_rename()",
+    "DROP TRIGGER IF EXISTS siriapi_expense_search_vector ON siriapi_expense",
+    "DROP FUNCTION IF EXISTS siriapi_expense_search_vector()",
+    "ALTER TABLE siriapi_expense DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def run(statements_by_vendor):
+    def operation(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("siriapi", "0021_sirirequest_user"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({"postgresql": POSTGRES_FORWARD}),
+            run({"postgresql": POSTGRES_BACKWARD}),
+        ),
+    ]
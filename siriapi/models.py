@@ -1,39 +1,219 @@
-from django.db import models
+from decimal import Decimal
+
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from userprofile.models import user_timezone
+
+
+def normalize_category_name(name):
+    """Key categories are matched on: case and extra whitespace are ignored"""
+    return ' '.join(name.split()).casefold()
+
+
+class CategoryManager(models.Manager):
+    def for_name(self, user, name):
+        """The user's category called name, in any case or spacing, created on first use"""
+        normalized = normalize_category_name(name)
+        try:
+            return self.get(user=user, normalized_name=normalized)
+        except self.model.DoesNotExist:
+            pass
+        try:
+            with transaction.atomic():
+                return self.create(user=user, name=' '.join(name.split()))
+        except IntegrityError:  # created concurrently
+            return self.get(user=user, normalized_name=normalized)
+
+    async def afor_name(self, user, name):
+        normalized = normalize_category_name(name)
+        try:
+            return await self.aget(user=user, normalized_name=normalized)
+        except self.model.DoesNotExist:
+            pass
+        try:
+            return await self.acreate(user=user, name=' '.join(name.split()))
+        except IntegrityError:
+            return await self.aget(user=user, normalized_name=normalized)
+
+    def for_names(self, user, names):
+        """{name: Category} for many names, with one lookup and at most one bulk insert"""
+        wanted = {normalize_category_name(name): ' '.join(name.split()) for name in names}
+        found = {c.normalized_name: c for c in self.filter(user=user, normalized_name__in=list(wanted))}
+        missing = [key for key in wanted if key not in found]
+        if missing:
+            self.bulk_create(
+                [self.model(user=user, name=wanted[key], normalized_name=key) for key in missing],
+                ignore_conflicts=True,
+            )
+            found.update((c.normalized_name, c) for c in self.filter(user=user, normalized_name__in=missing))
+            # bulk_create sends no post_save; matcher imports this module
+            from .matcher import invalidate
+            invalidate(user.pk)
+        return {name: found[normalize_category_name(name)] for name in names}
+
+
+class Category(models.Model):
+    """A user's expense category; names are unique per user ignoring case and spacing"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='categories')
+    name = models.CharField(max_length=80)
+    normalized_name = models.CharField(max_length=80)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = CategoryManager()
+
+    class Meta:
+        unique_together = ('user', 'normalized_name')
+        verbose_name_plural = 'categories'
+
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_category_name(self.name)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.name
+
+
+# Largest amount an Expense holds (max_digits=10, decimal_places=2)
+MAX_AMOUNT = Decimal('99999999.99')
 
 
 class Expense(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Indexed through the composite indexes below, which all lead with user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
-    category = models.CharField(max_length=80)
+    category = models.ForeignKey(Category, on_delete=models.PROTECT, related_name='expenses')
     note = models.TextField(blank=True, default="")
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Set explicitly when an expense is recorded later than it happened (journal, imports)
+    created_at = models.DateTimeField(default=timezone.now)
+    # The user's wall-clock date and YYYY-MM period at created_at, fixed when the
+    # expense is written so reports filter on plain indexed columns
+    local_date = models.DateField()
+    local_period = models.CharField(max_length=7)
+    # Content hash of the statement line an expense was imported from (siriapi.statements)
+    import_hash = models.CharField(max_length=64, null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Recent expenses, newest first by (created_at, id)
+            models.Index(fields=['user', 'created_at', 'id'], name='expense_user_created_idx'),
+            # Day, week and range reports; a single day's rows come out already in page order
+            models.Index(fields=['user', 'local_date', 'created_at', 'id'], name='expense_user_local_date_idx'),
+            # Month reports, likewise
+            models.Index(fields=['user', 'local_period', 'created_at', 'id'], name='expense_user_period_idx'),
+        ]
+        constraints = [
+            # Also the index imports look up duplicates in
+            models.UniqueConstraint(
+                fields=['user', 'import_hash'], condition=models.Q(import_hash__isnull=False),
+                name='expense_user_import_hash_uniq',
+            ),
+        ]
+
+    def set_local_date(self, tzinfo):
+        local = timezone.localtime(self.created_at, tzinfo)
+        self.local_date = local.date()
+        self.local_period = local.strftime('%Y-%m')
+
+    def save(self, *args, **kwargs):
+        if self.local_date is None:
+            self.set_local_date(user_timezone(self.user))
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.user.username}: {self.category}: ${self.amount}"
 
 
+class DailySpend(models.Model):
+    """Sum and count of a user's expenses per Expense.local_date and category, maintained by siriapi.rollups"""
+    # Indexed through unique_together, which leads with user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    day = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='daily_spend')
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'day', 'category')
+
+    def __str__(self):
+        return f"{self.user.username}: {self.day}: {self.category}: ${self.total} ({self.count})"
+
+
+class DataVersion(models.Model):
+    """Counter bumped on every change to a user's expenses or budgets, maintained by siriapi.versions"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='data_version')
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user.username}: version {self.version}"
+
+
 class SiriRequest(models.Model):
-    request_id = models.CharField(max_length=255, unique=True)
+    """Idempotency key for a user's Siri API call, with the response it produced"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='siri_requests')
+    request_id = models.CharField(max_length=255)
     endpoint = models.CharField(max_length=255)
+    response = models.JSONField(null=True, blank=True)  # replayed verbatim on retries
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        unique_together = ('request_id', 'endpoint')
+        # Keys are the client's; two users may well pick the same one
+        unique_together = ('user', 'request_id', 'endpoint')
 
     def __str__(self):
-        return f"{self.endpoint}: {self.request_id}"
+        return f"{self.user.username}: {self.endpoint}: {self.request_id}"
 
 
 class Budget(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     period = models.CharField(max_length=7)  # YYYY-MM
-    category = models.CharField(max_length=80, blank=True, default="")  # if blank, overall budget
+    # if null, overall budget
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name='budgets')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ('user', 'period', 'category')
+        constraints = [
+            # NULLs never conflict in unique_together, so one overall budget per period needs its own constraint
+            models.UniqueConstraint(
+                fields=['user', 'period'], condition=models.Q(category__isnull=True), name='unique_overall_budget',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user.username}: {self.category or 'Overall'} Budget for {self.period}: ${self.amount}"
+
+
+class ApiToken(models.Model):
+    """Revocable per-user token for the Siri API (only a SHA-256 digest is stored)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='api_tokens')
+    name = models.CharField(max_length=80, blank=True, default="")
+    prefix = models.CharField(max_length=12)  # leading characters, to identify a token in lists
+    digest = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(null=True, blank=True)
+    revoked_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def is_active(self):
+        return self.revoked_at is None
+
+    def __str__(self):
+        return f"{self.user.username}: {self.name or self.prefix}"
+
+
+class CategoryAlias(models.Model):
+    """A word or phrase (e.g. a merchant) that the utterance parser maps to a category"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='category_aliases')
+    alias = models.CharField(max_length=80)  # stored casefolded
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='aliases')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'alias')
+
+    def __str__(self):
+        return f"{self.user.username}: {self.alias} -> {self.category}"
@@ -0,0 +1,178 @@
+"""
+Daily spending rollups: DailySpend holds the sum and count of each user's
+expenses per local date (Expense.local_date) and category, so reports add
+up one row per day and category instead of every expense.
+
+Every path that writes expenses calls update_rollups() (or, for set-based
+writes, update_rollups_grouped()) in the same transaction as the write.
+Anything that bypasses it (raw SQL, the shell, old scripts) can be found
+with verify() and repaired with rebuild(); see the "rollups" management
+command. update_rollups() also feeds the month-to-date counters in
+siriapi.counters, invalidates the cached spend series in siriapi.series and
+bumps the users' data versions (siriapi.versions), edits that leave the
+totals alone included.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncMonth
+
+from .models import DailySpend, Expense
+from .series import forget_history, history_boundary
+from .versions import bump
+
+
+def update_rollups(added=(), removed=()):
+    """Add expenses to, and take expenses out of, the rollups; an edit is in both.
+
+    removed expenses must carry their values from before the change.
+    """
+    user_ids = {expense.user_id for expense in (*added, *removed)}
+    deltas = defaultdict(lambda: [Decimal(0), 0])
+    for expenses, sign in ((added, 1), (removed, -1)):
+        for expense in expenses:
+            delta = deltas[(expense.user_id, expense.local_date, expense.category_id)]
+            delta[0] += sign * Decimal(str(expense.amount))  # views may assign floats
+            delta[1] += sign
+    _apply_deltas(user_ids, deltas)
+
+
+def update_rollups_grouped(user_id, added=(), removed=()):
+    """update_rollups() for set-based writes that never load the expenses.
+
+    added and removed are (local_date, category_id, total, count) groups, such
+    as a grouped query of the rows an update() or delete() is about to change;
+    the user's data version is bumped even if they cancel out.
+    """
+    deltas = defaultdict(lambda: [Decimal(0), 0])
+    for groups, sign in ((added, 1), (removed, -1)):
+        for day, category_id, total, count in groups:
+            delta = deltas[(user_id, day, category_id)]
+            delta[0] += sign * total
+            delta[1] += sign * count
+    _apply_deltas({user_id}, deltas)
+
+
+def _apply_deltas(user_ids, deltas):
+    if not user_ids:
+        return
+    changes = {key: delta for key, delta in deltas.items() if delta[0] or delta[1]}
+
+    # Callers are already in the transaction of their write; no savepoint needed
+    with transaction.atomic(savepoint=False):
+        bump(user_ids)
+        for (user_id, day, category_id), (amount, count) in changes.items():
+            row = DailySpend.objects.filter(user_id=user_id, day=day, category_id=category_id)
+            if row.update(total=F('total') + amount, count=F('count') + count):
+                continue
+            try:
+                with transaction.atomic():
+                    DailySpend.objects.create(
+                        user_id=user_id, day=day, category_id=category_id, total=amount, count=count
+                    )
+            except IntegrityError:  # created concurrently
+                row.update(total=F('total') + amount, count=F('count') + count)
+        if any(count < 0 for _, count in changes.values()):
+            DailySpend.objects.filter(
+                user_id__in={user_id for user_id, _, _ in changes}, count__lte=0
+            ).delete()
+
+    if not changes:
+        return
+    month_deltas = defaultdict(Decimal)
+    for (user_id, day, category_id), (amount, _) in changes.items():
+        month_deltas[(user_id, day.replace(day=1), category_id)] += amount
+    # counters imports this module
+    from .counters import apply_deltas
+    transaction.on_commit(lambda: apply_deltas(month_deltas))
+    boundary = history_boundary()
+    past = {user_id for user_id, day, _ in changes if day < boundary}
+    if past:
+        transaction.on_commit(lambda: forget_history(past))
+
+
+def category_totals(user, start_date, end_date):
+    """[{category_id, category, total, count}] for the user's days start_date..end_date, largest first"""
+    rows = (
+        DailySpend.objects.filter(user=user, day__range=(start_date, end_date))
+        .values('category', 'category__name')
+        .annotate(total_sum=Sum('total'), count_sum=Sum('count'))
+        .order_by('-total_sum')
+    )
+    return [
+        {
+            'category_id': row['category'], 'category': row['category__name'],
+            'total': row['total_sum'], 'count': row['count_sum'],
+        }
+        for row in rows
+    ]
+
+
+def monthly_spend(user, start_date, end_date):
+    """{(first day of month, category_id): total} for the user's days start_date..end_date, in one query"""
+    rows = (
+        DailySpend.objects.filter(user=user, day__range=(start_date, end_date))
+        .annotate(month=TruncMonth('day'))
+        .values('month', 'category')
+        .annotate(total_sum=Sum('total'))
+        .order_by()
+    )
+    return {(row['month'], row['category']): row['total_sum'] for row in rows}
+
+
+def expected_rollups(users=None):
+    """{(user_id, day, category_id): (total, count)} computed from the expenses themselves"""
+    expenses = Expense.objects.all()
+    if users is not None:
+        expenses = expenses.filter(user__in=users)
+    rows = expenses.values('user', 'local_date', 'category').annotate(total=Sum('amount'), count=Count('id')).order_by()
+    return {(row['user'], row['local_date'], row['category']): (row['total'], row['count']) for row in rows}
+
+
+def stored_rollups(users=None):
+    rows = DailySpend.objects.all()
+    if users is not None:
+        rows = rows.filter(user__in=users)
+    return {
+        (user_id, day, category_id): (total, count)
+        for user_id, day, category_id, total, count in rows.values_list('user', 'day', 'category', 'total', 'count')
+    }
+
+
+def verify(users=None):
+    """[(key, expected, stored)] for every rollup that disagrees with the expenses; None means missing"""
+    expected = expected_rollups(users)
+    stored = stored_rollups(users)
+    return [
+        (key, expected.get(key), stored.get(key))
+        for key in sorted(expected.keys() | stored.keys(), key=str)
+        if expected.get(key) != stored.get(key)
+    ]
+
+
+def rebuild(users=None):
+    """Recompute the rollups from scratch and return how many rows were written"""
+    with transaction.atomic():
+        rows = DailySpend.objects.all()
+        if users is not None:
+            rows = rows.filter(user__in=users)
+        stale = set(
+            rows.annotate(month=TruncMonth('day')).values_list('user', 'month', 'category').distinct()
+        )
+        rows.delete()
+        created = DailySpend.objects.bulk_create(
+            [
+                DailySpend(user_id=user_id, day=day, category_id=category_id, total=total, count=count)
+                for (user_id, day, category_id), (total, count) in expected_rollups(users).items()
+            ],
+            batch_size=1000,
+        )
+        stale.update((row.user_id, row.day.replace(day=1), row.category_id) for row in created)
+        bump({user_id for user_id, _, _ in stale})
+        from .counters import forget
+        transaction.on_commit(lambda: forget(stale))
+        transaction.on_commit(lambda: forget_history({user_id for user_id, _, _ in stale}))
+    return len(created)
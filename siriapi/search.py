@@ -0,0 +1,114 @@
+"""
+Full-text search over expense notes and category names.
+
+On SQLite, siriapi_expense_fts is an FTS5 table holding each expense's note
+and category name plus an "owner" token (u<user id>), so a user's matches
+come straight out of the full-text index without touching anyone else's.
+Triggers on siriapi_expense and siriapi_category keep it in step with every
+write, including bulk_create() and queryset update()s.
+
+On PostgreSQL each expense has a search_vector column, a tsvector over its
+note and category name under a GIN index, kept up to date by triggers in the
+same way.
+
+Every word of the query must match the start of a word in the note or the
+category name, on either database: "star cof" finds "Starbucks coffee".
+Other databases fall back to icontains.
+
+Django rebuilds SQLite tables for some schema changes, which drops their
+triggers; run "manage.py search_index rebuild" after such a migration.
+"""
+
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+WORD_RE = re.compile(r'\w+')
+
+SQLITE_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS siriapi_expense_fts USING fts5(
+        owner, note, category, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS siriapi_expense_fts_insert AFTER INSERT ON siriapi_expense BEGIN
+        INSERT INTO siriapi_expense_fts (rowid, owner, note, category)
+        VALUES (new.id, 'u' || new.user_id, new.note, (SELECT name FROM siriapi_category WHERE id = new.category_id));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS siriapi_expense_fts_update
+    AFTER UPDATE OF user_id, note, category_id ON siriapi_expense BEGIN
+        DELETE FROM siriapi_expense_fts WHERE rowid = old.id;
+        INSERT INTO siriapi_expense_fts (rowid, owner, note, category)
+        VALUES (new.id, 'u' || new.user_id, new.note, (SELECT name FROM siriapi_category WHERE id = new.category_id));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS siriapi_expense_fts_delete AFTER DELETE ON siriapi_expense BEGIN
+        DELETE FROM siriapi_expense_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS siriapi_category_fts_rename AFTER UPDATE OF name ON siriapi_category BEGIN
+        UPDATE siriapi_expense_fts SET category = new.name
+        WHERE rowid IN (SELECT id FROM siriapi_expense WHERE category_id = new.id);
+    END
+    """,
+]
+
+SQLITE_FILL = """
+    INSERT INTO siriapi_expense_fts (rowid, owner, note, category)
+    SELECT e.id, 'u' || e.user_id, e.note, c.name
+    FROM siriapi_expense e JOIN siriapi_category c ON c.id = e.category_id
+"""
+
+
+def rebuild_index():
+    """(Re)create the SQLite full-text table and triggers and refill it from the expenses"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for statement in SQLITE_SCHEMA:
+            cursor.execute(statement)
+        cursor.execute("DELETE FROM siriapi_expense_fts")
+        cursor.execute(SQLITE_FILL)
+
+
+def _words(text):
+    return WORD_RE.findall(text.casefold())
+
+
+def _fts5_query(user_id, words):
+    # Quoting makes every word a plain term, whatever FTS5 syntax it contains
+    terms = ' '.join(f'"{word}"*' for word in words)
+    return f'owner:u{user_id} AND {{note category}}: ({terms})'
+
+
+def _tsquery(words):
+    return ' & '.join(f"{word}:*" for word in words)
+
+
+def search_expenses(expenses, user, text):
+    """Narrow an Expense queryset of user's to those matching every word of text"""
+    words = _words(text)
+    if not words:
+        return expenses
+    if connection.vendor == 'sqlite':
+        return expenses.filter(id__in=RawSQL(
+            "SELECT rowid FROM siriapi_expense_fts WHERE siriapi_expense_fts MATCH %s",
+            [_fts5_query(user.pk, words)],
+        ))
+    if connection.vendor == 'postgresql':
+        return expenses.filter(id__in=RawSQL(
+            "SELECT id FROM siriapi_expense WHERE user_id = %s AND search_vector @@ to_tsquery('simple', %s)",
+            [user.pk, _tsquery(words)],
+        ))
+    matches = Q()
+    for word in words:
+        matches &= Q(category__name__icontains=word) | Q(note__icontains=word)
+    return expenses.filter(matches)
+
@@ -0,0 +1,150 @@
+"""
+Spend over time: totals per day, week or month bucket, optionally per
+category, grouped in SQL over the daily rollups and zero-filled in Python.
+
+Days before the start of the current month rarely change, so that part of a
+range is cached in SERIES_CACHE under a per-user generation. update_rollups()
+moves the generation on when a committed write touches such a day (and a
+category rename does too, as names are cached), which orphans every cached
+entry of that user; the current month is always read live.
+"""
+
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import DailySpend
+
+BUCKETS = ('day', 'week', 'month')
+
+
+def _cache():
+    return caches[settings.SERIES_CACHE]
+
+
+def _generation_key(user_id):
+    return f"series-gen:{user_id}"
+
+
+def bucket_start(day, bucket):
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(day, bucket):
+    """Start of the bucket after the one starting on day, or None past date.max"""
+    if bucket == 'month':
+        if day.month < 12:
+            return day.replace(month=day.month + 1, day=1)
+        return date(day.year + 1, 1, 1) if day.year < date.max.year else None
+    step = timedelta(days=7 if bucket == 'week' else 1)
+    return day + step if date.max - day >= step else None
+
+
+def bucket_starts(start_date, end_date, bucket):
+    """Start of every bucket overlapping start_date..end_date, in order"""
+    day = bucket_start(start_date, bucket)
+    while day is not None and day <= end_date:
+        yield day
+        day = next_bucket(day, bucket)
+
+
+def bucket_count(start_date, end_date, bucket):
+    """len(list(bucket_starts(...))), without walking the buckets"""
+    if bucket == 'month':
+        return (end_date.year - start_date.year) * 12 + end_date.month - start_date.month + 1
+    if bucket == 'week':
+        return (bucket_start(end_date, bucket) - bucket_start(start_date, bucket)).days // 7 + 1
+    return (end_date - start_date).days + 1
+
+
+def _grouped(user, start_date, end_date, bucket, by_category):
+    """{(bucket start, category name or None): total} from one grouped query"""
+    rows = DailySpend.objects.filter(user=user, day__range=(start_date, end_date))
+    if bucket == 'week':
+        rows = rows.annotate(bucket=TruncWeek('day'))
+    elif bucket == 'month':
+        rows = rows.annotate(bucket=TruncMonth('day'))
+    else:
+        rows = rows.annotate(bucket=F('day'))
+    fields = ('bucket', 'category__name') if by_category else ('bucket',)
+    rows = rows.values(*fields).annotate(total_sum=Sum('total')).order_by()
+    return {
+        (row['bucket'], row['category__name'] if by_category else None): row['total_sum']
+        for row in rows
+    }
+
+
+def history_boundary():
+    """First day that writes may touch without invalidating cached history.
+
+    It is the start of the month of tomorrow in UTC, which is never before the
+    start of the current month in any time zone a reader can be in.
+    """
+    return (timezone.now().date() + timedelta(days=1)).replace(day=1)
+
+
+def forget_history(user_ids):
+    """Orphan the cached history of each user"""
+    _cache().set_many({_generation_key(user_id): time.time_ns() for user_id in user_ids}, timeout=None)
+
+
+def _generation(user_id):
+    cache = _cache()
+    cache.add(_generation_key(user_id), time.time_ns(), timeout=None)
+    return cache.get(_generation_key(user_id))
+
+
+def _history(user, start_date, end_date, bucket, by_category):
+    generation = _generation(user.pk)  # read before the data, so a concurrent write orphans what we store
+    key = f"series:{user.pk}:{generation}:{start_date}:{end_date}:{bucket}:{int(by_category)}"
+    cached = _cache().get(key)
+    if cached is None:
+        cached = _grouped(user, start_date, end_date, bucket, by_category)
+        _cache().set(key, cached, timeout=settings.SERIES_CACHE_TTL)
+    return cached
+
+
+def spend_series(user, start_date, end_date, bucket='day', by_category=False):
+    """(bucket starts, {category name or None for all: [total per bucket]}) for start_date..end_date.
+
+    Buckets are zero-filled; the first and last may extend past the range,
+    but only days inside it are counted.
+    """
+    month_start = timezone.localdate().replace(day=1)
+    totals = defaultdict(Decimal)
+    if start_date < month_start:
+        history = _history(user, start_date, min(end_date, month_start - timedelta(days=1)), bucket, by_category)
+        for key, total in history.items():
+            totals[key] += total
+    if end_date >= month_start:
+        for key, total in _grouped(user, max(start_date, month_start), end_date, bucket, by_category).items():
+            totals[key] += total
+
+    starts = list(bucket_starts(start_date, end_date, bucket))
+    by_name = defaultdict(dict)
+    for (day, name), total in totals.items():
+        by_name[name][day] = total
+    if by_category:
+        names = sorted(by_name, key=lambda name: -sum(by_name[name].values()))
+        overall = defaultdict(Decimal)
+        for name in names:
+            for day, total in by_name[name].items():
+                overall[day] += total
+        by_name[None] = overall
+    else:
+        names = []
+    return starts, {
+        name: [by_name[name].get(day, Decimal(0)) for day in starts]
+        for name in [None, *names]
+    }
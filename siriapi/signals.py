@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .matcher import invalidate
+from .models import Budget, Category, CategoryAlias
+from .series import forget_history
+from .versions import bump
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=CategoryAlias)
+def categories_changed(sender, instance, **kwargs):
+    invalidate(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Budget)
+@receiver([post_save, post_delete], sender=Category)
+def report_data_changed(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, User) or getattr(origin, 'model', None) is User:
+        return  # deleted along with the user; there is no version left to bump
+    bump([instance.user_id])
+
+
+@receiver(post_save, sender=Category)
+def category_renamed(sender, instance, created, **kwargs):
+    if not created:
+        # Cached spend series carry category names
+        transaction.on_commit(lambda: forget_history([instance.user_id]))
@@ -0,0 +1,267 @@
+"""
+Bulk import of bank and card statements, in CSV or OFX.
+
+Statements are parsed as a stream of (date, amount, description, category)
+rows, so a file never has to fit in memory. Each spend becomes an expense
+whose import_hash is a digest of its date, amount, normalized description and
+occurrence number: the second identical coffee on a day is occurrence 1, so
+real repeats are kept while importing the same (or an overlapping) statement
+again finds every line already there. Occurrences are counted a day at a
+time, so a statement must list each day's rows together (in either date
+order, as banks export them); a day that comes back later is reported as an
+invalid row rather than risk numbering its repeats twice.
+
+Rows are written in batches, each in its own transaction: one lookup of the
+batch's hashes against the (user, import_hash) index, one bulk_create and one
+rollup update. A concurrent import of the same statement may insert a
+batch's rows between the lookup and the insert; the batch is then written a
+row at a time and the rows that conflict are counted as duplicates.
+"""
+
+import csv
+import hashlib
+import re
+from collections import Counter
+from datetime import datetime, time
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .matcher import get_matcher, match_key
+from .models import Category, Expense
+from .rollups import update_rollups
+from userprofile.models import user_timezone
+
+STATEMENT_FORMATS = ('csv', 'ofx')
+DEFAULT_CATEGORY = 'Uncategorized'
+BATCH_SIZE = 1000
+
+# Header names recognised when CSV columns aren't given explicitly
+CSV_COLUMNS = {
+    'date': ('date', 'transaction date', 'posted date', 'posting date', 'trans. date'),
+    'amount': ('amount', 'transaction amount'),
+    'debit': ('debit', 'withdrawal', 'withdrawals', 'debit amount'),
+    'description': ('description', 'payee', 'name', 'merchant', 'details', 'memo'),
+    'category': ('category',),
+}
+
+OFX_TAG_RE = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+
+
+class StatementError(ValueError):
+    """A statement that can't be read at all, as opposed to a bad row in it"""
+
+
+def parse_amount(text):
+    """Decimal from a statement amount such as "-1,234.50", "$12.00" or "(4.50)"; None if blank"""
+    text = (text or '').strip()
+    if not text:
+        return None
+    negative = text.startswith('(') and text.endswith(')')
+    cleaned = re.sub(r'[^\d.+-]', '', text)
+    try:
+        amount = Decimal(cleaned)
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {text!r}") from None
+    return -amount if negative else amount
+
+
+def csv_rows(stream, columns=None, date_format='%Y-%m-%d', spend_sign=-1):
+    """Yield (date, spend amount or None, description, category or None) for each CSV row.
+
+    columns maps date, amount or debit, description and optionally category to
+    header names; missing ones are found among CSV_COLUMNS. With an amount
+    column, spends carry spend_sign (-1 for bank exports, +1 for most card
+    exports); other rows (refunds, income) come out with amount None. Rows that
+    can't be parsed come out as a ValueError instead of a tuple.
+    """
+    reader = csv.DictReader(stream)
+    if not reader.fieldnames:
+        raise StatementError("The statement is empty")
+    headers = {name.strip().casefold(): name for name in reader.fieldnames}
+    found = {}
+    for field, candidates in CSV_COLUMNS.items():
+        wanted = (columns or {}).get(field)
+        if wanted:
+            if wanted.strip().casefold() not in headers:
+                raise StatementError(f"No {wanted!r} column in the statement")
+            found[field] = headers[wanted.strip().casefold()]
+            continue
+        found[field] = next((headers[name] for name in candidates if name in headers), None)
+    if not found['date'] or not (found['amount'] or found['debit']) or not found['description']:
+        raise StatementError(
+            f"Couldn't find date, amount and description columns in: {', '.join(reader.fieldnames)}"
+        )
+
+    for row in reader:
+        try:
+            day = datetime.strptime((row[found['date']] or '').strip(), date_format).date()
+            if found['debit']:
+                amount = parse_amount(row[found['debit']])
+            else:
+                amount = parse_amount(row[found['amount']])
+                amount = amount * spend_sign if amount is not None else None
+            yield (
+                day,
+                amount if amount is not None and amount > 0 else None,
+                (row[found['description']] or '').strip(),
+                ((row[found['category']] or '').strip()[:80] or None) if found['category'] else None,
+            )
+        except (TypeError, ValueError) as e:
+            yield ValueError(f"Line {reader.line_num}: {e}")
+
+
+def _ofx_tags(stream, chunk_size=65536):
+    """Yield (closing, tag, text) from OFX 1.x (SGML) or 2.x (XML), read a chunk at a time"""
+    buffer = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        buffer += chunk
+        # Keep a tag that may continue in the next chunk
+        end = buffer.rfind('<') if chunk else len(buffer)
+        for match in OFX_TAG_RE.finditer(buffer, 0, max(end, 0)):
+            yield match.group(1) == '/', match.group(2).upper(), match.group(3).strip()
+        buffer = buffer[max(end, 0):]
+        if not chunk:
+            return
+
+
+def ofx_rows(stream, chunk_size=65536):
+    """Yield (date, spend amount or None, description, None) for each OFX transaction.
+
+    OFX amounts are negative for money out, for bank and card accounts alike.
+    """
+    transaction_tags = None
+    for closing, tag, text in _ofx_tags(stream, chunk_size):
+        if tag == 'STMTTRN':
+            if not closing:
+                transaction_tags = {}
+                continue
+            if transaction_tags is None:
+                continue
+            tags, transaction_tags = transaction_tags, None
+            try:
+                day = datetime.strptime(tags.get('DTPOSTED', '')[:8], '%Y%m%d').date()
+                amount = -parse_amount(tags.get('TRNAMT'))
+                description = ' '.join(filter(None, (tags.get('NAME'), tags.get('MEMO'))))
+                yield day, amount if amount > 0 else None, description, None
+            except (TypeError, ValueError) as e:
+                yield ValueError(f"Transaction {tags.get('FITID', '?')}: {e}")
+        elif transaction_tags is not None and not closing and text:
+            transaction_tags[tag] = text
+
+
+def import_hash(day, amount, description, occurrence):
+    key = f"{day.isoformat()}|{amount:.2f}|{' '.join(description.split()).casefold()}|{occurrence}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class StatementImport:
+    """Write statement rows as expenses for a user, in batches; see import_rows()"""
+
+    def __init__(self, user, default_category=DEFAULT_CATEGORY, batch_size=BATCH_SIZE, progress=None):
+        self.user = user
+        self.default_category = default_category
+        self.batch_size = batch_size
+        self.progress = progress  # called with the counts after each batch
+        self.counts = Counter(read=0, created=0, duplicate=0, skipped=0, invalid=0)
+        self.errors = []
+        self.tzinfo = user_timezone(user)
+        self.matcher = get_matcher(user.pk)
+        # Occurrences of each (amount, description) on the current day only
+        self.day = None
+        self.finished_days = set()
+        self.occurrences = Counter()
+
+    def category_for(self, description, category):
+        """The statement's own category, else one the description mentions, else the default"""
+        if category:
+            return category
+        match = self.matcher.best_match(match_key(description))
+        return match[2] if match else self.default_category
+
+    def import_rows(self, rows):
+        """Import csv_rows()/ofx_rows() output and return the counts"""
+        batch = []
+        for row in rows:
+            self.counts['read'] += 1
+            if isinstance(row, ValueError):
+                self.counts['invalid'] += 1
+                self.errors.append(str(row))
+                continue
+            day, amount, description, category = row
+            if amount is None:
+                self.counts['skipped'] += 1
+                continue
+            if day != self.day:
+                if day in self.finished_days:
+                    self.counts['invalid'] += 1
+                    self.errors.append(
+                        f"Row {self.counts['read']}: {day} rows are not together; sort the statement by date"
+                    )
+                    continue
+                if self.day is not None:
+                    self.finished_days.add(self.day)
+                self.day = day
+                self.occurrences.clear()
+            key = (amount, ' '.join(description.split()).casefold())
+            occurrence = self.occurrences[key]
+            self.occurrences[key] += 1
+            batch.append((import_hash(day, amount, description, occurrence), day, amount, description, category))
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch)
+                batch = []
+        if batch:
+            self.write_batch(batch)
+        return self.counts
+
+    def existing_hashes(self, batch):
+        return set(
+            Expense.objects.filter(user=self.user, import_hash__in=[row[0] for row in batch])
+            .values_list('import_hash', flat=True)
+        )
+
+    def write_batch(self, batch):
+        try:
+            created = self.write_rows(batch)
+        except IntegrityError:
+            # Another import of the same statement got some of these rows in first
+            created = 0
+            for row in batch:
+                try:
+                    created += self.write_rows([row])
+                except IntegrityError:
+                    pass
+
+        self.counts['created'] += created
+        self.counts['duplicate'] += len(batch) - created
+        if self.progress:
+            self.progress(self.counts)
+
+    def write_rows(self, batch):
+        """Insert the rows not imported yet in one transaction; returns how many"""
+        with transaction.atomic():
+            existing = self.existing_hashes(batch)
+            new = [row for row in batch if row[0] not in existing]
+            names = {row[0]: self.category_for(row[3], row[4]) for row in new}
+            categories = Category.objects.for_names(self.user, set(names.values())) if new else {}
+
+            expenses = []
+            for digest, day, amount, description, _ in new:
+                expense = Expense(
+                    user=self.user, amount=amount, category=categories[names[digest]], note=description,
+                    created_at=timezone.make_aware(datetime.combine(day, time(12)), self.tzinfo),
+                    import_hash=digest,
+                )
+                expense.set_local_date(self.tzinfo)  # bulk_create doesn't call save()
+                expenses.append(expense)
+            update_rollups(added=Expense.objects.bulk_create(expenses))
+        return len(new)
+
+
+def statement_rows(stream, statement_format, **options):
+    """Rows of a statement in one of STATEMENT_FORMATS; options go to csv_rows()"""
+    if statement_format == 'ofx':
+        return ofx_rows(stream)
+    return csv_rows(stream, **options)
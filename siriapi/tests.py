@@ -1,3 +1,896 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import unittest
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+from . import async_views, counters, matcher, rollups, search, series, statements
+from .ingest import insert_expense, write_expense_batch
+from .journal import Journal
+from .models import ApiToken, Budget, Category, CategoryAlias, DailySpend, Expense, SiriRequest
+from .throttle import SlotPool
+from .tokens import issue_token, revoke_token, clear_cache
+from .utterance import parse_utterance
+
+# Keep rate limit buckets and shed counters off disk; emptied per test by reset_caches()
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'siriapi-tests'},
+    'template_fragments': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'fragment-tests'},
+}
+
+
+def reset_caches():
+    clear_cache()
+    matcher.clear_cache()
+    caches['shared'].clear()
+    caches['template_fragments'].clear()
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ApiTokenTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create_user(username='siriuser', password='testpass123')
+        self.token, self.raw_token = issue_token(self.user, name='iPhone')
+
+    def post_expense(self, payload, token):
+        return self.client.post(
+            '/api/siri/add-expense/',
+            data=json.dumps(payload),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {token}',
+        )
+
+    def test_only_digest_is_stored(self):
+        self.assertNotIn(self.raw_token, self.token.digest)
+        self.assertTrue(self.raw_token.startswith(self.token.prefix))
+
+    def test_add_expense_with_api_token(self):
+        response = self.post_expense({'amount': '4.50', 'category': 'Coffee'}, self.raw_token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Expense.objects.get().user, self.user)
+
+    def test_cached_token_skips_database(self):
+        self.post_expense({'amount': '1', 'category': 'Coffee'}, self.raw_token)
+        # second call: no token lookup, only the category lookup, expense insert, version bump and rollup update
+        with self.assertNumQueries(4):
+            response = self.post_expense({'amount': '2', 'category': 'Coffee'}, self.raw_token)
+        self.assertEqual(response.status_code, 200)
+
+    def test_revoked_token_rejected(self):
+        revoke_token(self.token)
+        response = self.post_expense({'amount': '1', 'category': 'Coffee'}, self.raw_token)
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(Expense.objects.exists())
+
+    def test_unknown_token_rejected(self):
+        response = self.post_expense({'amount': '1', 'category': 'Coffee'}, 't2l_not-a-real-token')
+        self.assertEqual(response.status_code, 401)
+
+    @mock.patch('siriapi.views.SIRI_TOKEN', 'shared-secret')
+    def test_legacy_password_auth_still_works(self):
+        payload = {'username': 'siriuser', 'password': 'testpass123', 'amount': '3', 'category': 'Lunch'}
+        response = self.post_expense(payload, 'shared-secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ApiToken.objects.count(), 1)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AddExpensesBatchTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create_user(username='batchuser', password='testpass123')
+        self.token, self.raw_token = issue_token(self.user)
+
+    def post_batch(self, expenses):
+        return self.client.post(
+            '/api/siri/add-expenses/',
+            data=json.dumps({'expenses': expenses}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.raw_token}',
+        )
+
+    def test_batch_reports_each_outcome(self):
+        self.post_batch([{'amount': '1', 'category': 'Coffee', 'request_id': 'a'}])
+        response = self.post_batch([
+            {'amount': '1', 'category': 'Coffee', 'request_id': 'a'},
+            {'amount': '2', 'category': 'Lunch', 'request_id': 'b'},
+            {'amount': '-3', 'category': 'Lunch', 'request_id': 'c'},
+            {'amount': '4', 'category': 'Taxi', 'request_id': 'b'},
+        ])
+        body = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['status'] for r in body['results']], ['duplicate', 'created', 'invalid', 'duplicate'])
+        self.assertEqual((body['created'], body['duplicate'], body['invalid']), (1, 2, 1))
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 2)
+
+    def test_batch_marks_unstorable_items_invalid(self):
+        response = self.post_batch([
+            {'amount': 'Infinity', 'category': 'Coffee'},
+            {'amount': 'NaN', 'category': 'Coffee'},
+            {'amount': '123456789', 'category': 'Coffee'},
+            {'amount': '0.001', 'category': 'Coffee'},
+            {'amount': '1', 'category': 'Coffee', 'request_id': {'nested': 1}},
+            {'amount': '1', 'category': 'Coffee', 'request_id': 'x' * 256},
+            {'amount': '2.345', 'category': 'Coffee', 'request_id': 'x' * 255},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['status'] for r in response.json()['results']], ['invalid'] * 6 + ['created'])
+        self.assertEqual(Expense.objects.get(user=self.user).amount, Decimal('2.34'))
+        self.assertEqual(DailySpend.objects.get(user=self.user).total, Decimal('2.34'))
+
+    def test_batch_keys_are_per_user(self):
+        mine = self.post_batch([{'amount': '1', 'category': 'Coffee', 'request_id': 'a'}]).json()['results'][0]
+        other = User.objects.create_user(username='otherbatch', password='testpass123')
+        _, other_token = issue_token(other)
+        response = self.client.post(
+            '/api/siri/add-expenses/',
+            data=json.dumps({'expenses': [
+                {'amount': '5', 'category': 'Taxi', 'request_id': 'a'},
+                {'amount': '6', 'category': 'Taxi', 'request_id': 'a'},
+            ]}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {other_token}',
+        )
+        results = response.json()['results']
+        self.assertEqual([r['status'] for r in results], ['created', 'duplicate'])
+        self.assertNotEqual(results[0]['expense_id'], mine['expense_id'])
+        self.assertEqual(results[1]['expense_id'], results[0]['expense_id'])
+        self.assertEqual(Expense.objects.filter(user=other).count(), 1)
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 1)
+
+    def test_batch_query_count_is_constant(self):
+        self.post_batch([{'amount': '1', 'category': 'Food'}])
+        expenses = [{'amount': str(i + 1), 'category': 'Food', 'request_id': f'r{i}'} for i in range(150)]
+        # savepoint + key lookup + category lookup + 3 bulk inserts (expenses take two) + version bump
+        # + rollup update + release
+        with self.assertNumQueries(9):
+            response = self.post_batch(expenses)
+        self.assertEqual(response.json()['created'], 150)
+
+    def test_empty_batch_rejected(self):
+        response = self.post_batch([])
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class IdempotencyTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create_user(username='retryuser', password='testpass123')
+        self.token, self.raw_token = issue_token(self.user)
+
+    def post_expense(self, payload):
+        return self.client.post(
+            '/api/siri/add-expense/',
+            data=json.dumps(payload),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.raw_token}',
+        )
+
+    def test_retry_replays_original_response(self):
+        payload = {'amount': '7.25', 'category': 'Lunch', 'request_id': 'retry-1'}
+        first = self.post_expense(payload)
+        second = self.post_expense(payload)
+        self.assertEqual(first.json(), second.json())
+        self.assertIsNotNone(second.json()['expense_id'])
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Expense.objects.count(), 1)
+        self.assertEqual(SiriRequest.objects.get().response, first.json())
+
+    def test_first_call_has_no_lookup_query(self):
+        self.post_expense({'amount': '1', 'category': 'Lunch'})
+        # savepoint, category lookup, expense insert, version bump, rollup update, key insert, release
+        with self.assertNumQueries(7):
+            self.post_expense({'amount': '2', 'category': 'Lunch', 'request_id': 'fresh'})
+
+    def test_request_ids_are_per_user(self):
+        payload = {'amount': '7.25', 'category': 'Lunch', 'request_id': 'same-id'}
+        mine = self.post_expense(payload).json()
+        other = User.objects.create_user(username='otheruser', password='testpass123')
+        _, other_token = issue_token(other)
+        response = self.client.post(
+            '/api/siri/add-expense/',
+            data=json.dumps({**payload, 'amount': '3.00'}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {other_token}',
+        )
+        self.assertNotIn('Idempotent-Replayed', response)
+        theirs = response.json()
+        self.assertNotEqual(theirs['expense_id'], mine['expense_id'])
+        self.assertEqual(Expense.objects.get(id=theirs['expense_id']).user, other)
+        self.assertEqual(Expense.objects.filter(user=other).count(), 1)
+        # Each user's retry still replays their own response
+        self.assertEqual(self.post_expense(payload).json(), mine)
+
+    def test_batch_replays_single_call(self):
+        single = self.post_expense({'amount': '3', 'category': 'Taxi', 'request_id': 'shared'}).json()
+        response = self.client.post(
+            '/api/siri/add-expenses/',
+            data=json.dumps({'expenses': [{'amount': '3', 'category': 'Taxi', 'request_id': 'shared'}]}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.raw_token}',
+        )
+        result = response.json()['results'][0]
+        self.assertEqual(result['status'], 'duplicate')
+        self.assertEqual(result['expense_id'], single['expense_id'])
+
+
+class HousekeepingTestCase(TestCase):
+    def test_prunes_old_keys_and_expired_sessions(self):
+        user = User.objects.create_user(username='keeper', password='testpass123')
+        old = SiriRequest.objects.create(user=user, request_id='old', endpoint='add-expense')
+        SiriRequest.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=90))
+        SiriRequest.objects.create(user=user, request_id='recent', endpoint='add-expense')
+        Session.objects.create(session_key='expired', session_data='', expire_date=timezone.now() - timedelta(days=1))
+        Session.objects.create(session_key='live', session_data='', expire_date=timezone.now() + timedelta(days=1))
+
+        out = StringIO()
+        call_command('housekeeping', '--ttl-days=30', '--chunk-size=1', '--pause=0', '--skip-db-maintenance', stdout=out)
+
+        self.assertEqual(list(SiriRequest.objects.values_list('request_id', flat=True)), ['recent'])
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['live'])
+        self.assertIn('Idempotency keys: removed 1 rows', out.getvalue())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AsyncViewsTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create_user(username='asyncuser', password='testpass123')
+        self.token, self.raw_token = issue_token(self.user)
+        self.factory = AsyncRequestFactory()
+
+    def async_post(self, payload, token):
+        return self.factory.post(
+            '/api/siri/add-expense/',
+            data=json.dumps(payload),
+            content_type='application/json',
+            headers={'Authorization': f'Bearer {token}'},
+        )
+
+    async def test_add_expense_with_api_token(self):
+        request = self.async_post({'amount': '5', 'category': 'Coffee', 'request_id': 'async-1'}, self.raw_token)
+        first = await async_views.add_expense(request)
+        replay = await async_views.add_expense(
+            self.async_post({'amount': '5', 'category': 'Coffee', 'request_id': 'async-1'}, self.raw_token))
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(json.loads(first.content), json.loads(replay.content))
+        self.assertEqual(await Expense.objects.filter(user=self.user).acount(), 1)
+
+    @mock.patch('siriapi.views.SIRI_TOKEN', 'shared-secret')
+    async def test_legacy_password_auth(self):
+        good = {'username': 'asyncuser', 'password': 'testpass123', 'amount': '2', 'category': 'Taxi'}
+        bad = dict(good, password='wrong')
+        self.assertEqual((await async_views.add_expense(self.async_post(good, 'shared-secret'))).status_code, 200)
+        self.assertEqual((await async_views.add_expense(self.async_post(bad, 'shared-secret'))).status_code, 401)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class JournalIngestionTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create_user(username='journaluser', password='testpass123')
+        self.token, self.raw_token = issue_token(self.user)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.journal_path = os.path.join(self.tmpdir.name, 'journal.jsonl')
+        settings_override = override_settings(SIRI_INGEST_MODE='journal', SIRI_JOURNAL_PATH=self.journal_path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def post_expense(self, payload):
+        return self.client.post(
+            '/api/siri/add-expense/',
+            data=json.dumps(payload),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.raw_token}',
+        )
+
+    def drain(self):
+        call_command('drain_journal', '--once', stdout=StringIO())
+
+    def test_request_is_queued_then_drained(self):
+        response = self.post_expense({'amount': '9.99', 'category': 'Books', 'request_id': 'j-1'})
+        self.assertEqual(response.status_code, 202)
+        self.assertIn('receipt_id', response.json())
+        self.assertFalse(Expense.objects.exists())
+
+        self.drain()
+        expense = Expense.objects.get()
+        self.assertEqual((expense.amount, expense.category.name), (Decimal('9.99'), 'Books'))
+        # once committed, a retry replays the stored response
+        replay = self.post_expense({'amount': '9.99', 'category': 'Books', 'request_id': 'j-1'})
+        self.assertEqual(replay.json()['expense_id'], expense.id)
+        # the drained journal is compacted
+        self.assertEqual(os.path.getsize(self.journal_path), 0)
+
+    def test_redrain_after_crash_does_not_duplicate(self):
+        self.post_expense({'amount': '1', 'category': 'Coffee'})
+        self.post_expense({'amount': '2', 'category': 'Coffee'})
+        journal = Journal(self.journal_path)
+        entries, _, offset = journal.read_batch(0, 10)
+        # simulate a crash after committing but before the checkpoint was written
+        call_command('drain_journal', '--once', '--batch-size=10', stdout=StringIO())
+        with open(self.journal_path, 'w') as f:
+            f.writelines(json.dumps(entry) + '\n' for entry in entries)
+        journal.write_checkpoint(0)
+        self.drain()
+        self.assertEqual(Expense.objects.count(), 2)
+
+    def test_entry_that_keeps_conflicting_is_set_aside(self):
+        self.post_expense({'amount': '3', 'category': 'Taxi'})
+        self.post_expense({'amount': '4', 'category': 'Poison'})
+        self.post_expense({'amount': '5', 'category': 'Lunch'})
+
+        def conflicting(user, items):
+            if any(cleaned['category'] == 'Poison' for cleaned, _ in items):
+                raise IntegrityError('conflict')
+            return write_expense_batch(user, items)
+
+        with mock.patch('siriapi.management.commands.drain_journal.write_expense_batch', side_effect=conflicting) as batch:
+            call_command('drain_journal', '--once', '--interval=0', stdout=StringIO())
+        # Three attempts at the batch, then each entry on its own
+        self.assertEqual(batch.call_count, 3 + 3)
+        self.assertEqual(sorted(Expense.objects.values_list('category__name', flat=True)), ['Lunch', 'Taxi'])
+        with open(Journal(self.journal_path).dead_letter_path) as f:
+            self.assertEqual([json.loads(line)['category'] for line in f], ['Poison'])
+        self.assertEqual(os.path.getsize(self.journal_path), 0)
+
+    def test_torn_line_is_skipped(self):
+        with open(self.journal_path, 'w') as f:
+            f.write('{"receipt_id": "torn", "user_')
+        self.post_expense({'amount': '3', 'category': 'Taxi'})
+        self.drain()
+        self.assertEqual(Expense.objects.get().category.name, 'Taxi')
+
+
+@override_settings(
+    CACHES=TEST_CACHES, SIRI_RATE_LIMIT_PER_MINUTE=60, SIRI_RATE_LIMIT_BURST=2, SIRI_MAX_CONCURRENT_WRITES=1,
+)
+class ThrottleTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create_user(username='busyuser', password='testpass123', is_staff=True)
+        self.token, self.raw_token = issue_token(self.user)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        settings_override = override_settings(SIRI_ADMISSION_DIR=self.tmpdir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def post_expense(self):
+        return self.client.post(
+            '/api/siri/add-expense/',
+            data=json.dumps({'amount': '1', 'category': 'Snacks'}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.raw_token}',
+        )
+
+    def test_rate_limit_returns_429_with_retry_after(self):
+        self.assertEqual(self.post_expense().status_code, 200)
+        self.assertEqual(self.post_expense().status_code, 200)
+        response = self.post_expense()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 2)
+
+    def test_sheds_when_no_write_slot_is_free(self):
+        # Another worker process holds the only slot
+        other_worker = SlotPool(self.tmpdir.name, 1)
+        slot = other_worker.acquire()
+        self.addCleanup(other_worker.release, slot)
+
+        response = self.post_expense()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(Expense.objects.exists())
+
+        stats = self.client.get('/api/siri/throttle-stats/', HTTP_AUTHORIZATION=f'Bearer {self.raw_token}')
+        self.assertEqual(stats.json()['shed'], {'rate_limited': 0, 'overloaded': 1})
+
+    @override_settings(SIRI_MAX_CONCURRENT_WRITES=0)
+    def test_zero_write_slots_means_no_cap(self):
+        self.assertEqual(self.post_expense().status_code, 200)
+        self.assertFalse(os.listdir(self.tmpdir.name))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class UtteranceTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create_user(username='talker', password='testpass123')
+        self.token, self.raw_token = issue_token(self.user)
+        Category.objects.for_name(self.user, 'Coffee')
+        Category.objects.for_name(self.user, 'Groceries')
+
+    def post_utterance(self, payload):
+        return self.client.post(
+            '/api/siri/utterance/',
+            data=json.dumps(payload),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.raw_token}',
+        )
+
+    def test_parses_spelled_out_amounts_and_dates(self):
+        categories = matcher.CategoryMatcher(['Coffee', 'Groceries', 'Eating Out'], {})
+        now = timezone.now()
+        cases = {
+            'spent twelve fifty on coffee': ('12.50', 'Coffee'),
+            'forty two dollars and fifty cents on groceries': ('42.50', 'Groceries'),
+            'a hundred and five bucks eating out': ('105.00', 'Eating Out'),
+            '$1,250 for rent': ('1250.00', 'Rent'),
+        }
+        for text, (amount, category) in cases.items():
+            parsed, error = parse_utterance(text, categories, now=now)
+            self.assertIsNone(error, text)
+            self.assertEqual((str(parsed['amount']), parsed['category']), (amount, category), text)
+
+        parsed, _ = parse_utterance('3 on groceries two days ago', categories, now=now)
+        self.assertEqual(parsed['amount'], Decimal('3.00'))
+        self.assertEqual(parsed['created_at'], now - timedelta(days=2))
+
+    def test_adds_expense_and_learns_merchant(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post_utterance({'text': 'spent twelve fifty on coffee at Starbucks', 'request_id': 'u-1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['parsed']['merchant'], 'Starbucks')
+        expense = Expense.objects.get(pk=response.json()['expense_id'])
+        self.assertEqual((expense.amount, expense.category.name, expense.note), (Decimal('12.50'), 'Coffee', 'Starbucks'))
+        self.assertTrue(CategoryAlias.objects.filter(user=self.user, alias='starbucks', category__name='Coffee').exists())
+
+        # The alias now resolves on its own, and a retry replays the first response
+        parsed = self.post_utterance({'text': 'five bucks at starbucks', 'dry_run': True}).json()['parsed']
+        self.assertEqual((parsed['category'], parsed['category_source']), ('Coffee', 'alias'))
+        replay = self.post_utterance({'text': 'spent twelve fifty on coffee at Starbucks', 'request_id': 'u-1'})
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 1)
+
+    def test_matcher_is_cached_until_categories_change(self):
+        Category.objects.for_names(self.user, [f'Project {i}' for i in range(300)])
+        first = matcher.get_matcher(self.user.id)
+        with self.assertNumQueries(0):
+            self.assertIs(matcher.get_matcher(self.user.id), first)
+            parsed, error = parse_utterance('nine dollars for project 299', first)
+        self.assertEqual(parsed['category'], 'Project 299')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.for_name(self.user, 'Parking')
+        self.assertIsNot(matcher.get_matcher(self.user.id), first)
+        self.assertTrue(matcher.get_matcher(self.user.id).knows('parking'))
+
+    def test_rejects_dates_too_far_back(self):
+        categories = matcher.CategoryMatcher(['Food'], {})
+        parsed, error = parse_utterance('spent 5 on food 9999999999 days ago', categories)
+        self.assertIn('too far back', error)
+        self.assertIsNone(parsed['created_at'])
+        parsed, error = parse_utterance('spent 5 on food 3000 weeks ago', categories)
+        self.assertIn('too far back', error)
+
+        response = self.post_utterance({'text': 'spent 5 on coffee 9999999999 days ago'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['parsed']['amount'], '5.00')
+        response = self.post_utterance({'text': 'lunch 99999 days ago', 'amount': '5', 'category': 'Food'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Expense.objects.exists())
+
+    def test_rejects_amounts_too_large_to_store(self):
+        categories = matcher.CategoryMatcher(['Food'], {})
+        for amount in ('1' * 29, '12345678901', '100000000'):
+            parsed, error = parse_utterance(f'spent {amount} on food', categories)
+            self.assertIn('too large', error, amount)
+            self.assertIsNone(parsed['amount'])
+        parsed, error = parse_utterance('spent 99999999.99 on food', categories)
+        self.assertEqual((parsed['amount'], error), (Decimal('99999999.99'), None))
+
+        response = self.post_utterance({'text': f"spent {'9' * 29} on coffee"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('too large', response.json()['error'])
+        self.assertFalse(Expense.objects.exists())
+
+    def test_reports_what_was_understood_when_incomplete(self):
+        response = self.post_utterance({'text': 'twenty dollars'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['parsed']['amount'], '20.00')
+        self.assertIn('category', response.json()['error'])
+        self.assertFalse(Expense.objects.filter(amount=20).exists())
+
+
+class CategoryTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='cats', password='testpass123')
+
+    def test_names_differing_in_case_and_spacing_share_a_category(self):
+        food = Category.objects.for_name(self.user, ' Food ')
+        self.assertEqual(food.name, 'Food')
+        self.assertEqual(Category.objects.for_name(self.user, 'FOOD').pk, food.pk)
+        by_name = Category.objects.for_names(self.user, ['food', 'Food  ', 'Rent'])
+        self.assertEqual({by_name['food'].pk, by_name['Food  '].pk}, {food.pk})
+        self.assertEqual(Category.objects.filter(user=self.user).count(), 2)
+
+        other = User.objects.create_user(username='dogs', password='testpass123')
+        self.assertNotEqual(Category.objects.for_name(other, 'Food').pk, food.pk)
+
+    def test_one_overall_budget_per_period(self):
+        Budget.objects.create(user=self.user, period='2026-10', category=None, amount=Decimal('100'))
+        with self.assertRaises(IntegrityError):
+            Budget.objects.create(user=self.user, period='2026-10', category=None, amount=Decimal('200'))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RollupTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create_user(username='rollups', password='testpass123')
+        self.token, self.raw_token = issue_token(self.user)
+        self.client.force_login(self.user)
+
+    def post_json(self, url, payload):
+        return self.client.post(
+            url, data=json.dumps(payload), content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.raw_token}',
+        )
+
+    def rollup_rows(self):
+        return {
+            (row.category.name, row.day): (row.total, row.count)
+            for row in DailySpend.objects.filter(user=self.user).select_related('category')
+        }
+
+    def test_every_write_path_keeps_rollups_in_step(self):
+        today = timezone.localdate()
+        self.post_json('/api/siri/add-expense/', {'amount': '10', 'category': 'Food'})
+        self.post_json('/api/siri/add-expenses/', {'expenses': [
+            {'amount': '2.50', 'category': 'food'}, {'amount': '7', 'category': 'Taxi'},
+        ]})
+        self.assertEqual(self.rollup_rows(), {
+            ('Food', today): (Decimal('12.50'), 2), ('Taxi', today): (Decimal('7'), 1),
+        })
+
+        taxi = Expense.objects.get(category__name='Taxi')
+        self.client.post('/month/', {'action': 'update_expense', 'expense_id': taxi.id, 'category': 'Food', 'amount': '0.1'})
+        self.assertEqual(self.rollup_rows(), {('Food', today): (Decimal('12.60'), 3)})
+
+        for expense in Expense.objects.filter(category__name='Food', amount__lt=10):
+            self.client.post('/month/', {'action': 'delete_expense', 'expense_id': expense.id})
+        self.assertEqual(self.rollup_rows(), {('Food', today): (Decimal('10'), 1)})
+        self.assertEqual(rollups.verify(), [])
+
+    def test_days_are_local(self):
+        # 01:00 UTC is still the previous evening in New York
+        created_at = timezone.now().replace(hour=1, minute=0, second=0, microsecond=0)
+        rollups.update_rollups(added=[Expense.objects.create(
+            user=self.user, amount=Decimal('4'), category=Category.objects.for_name(self.user, 'Late'), created_at=created_at,
+        )])
+        self.assertEqual(list(self.rollup_rows()), [('Late', timezone.localtime(created_at).date())])
+        self.assertNotEqual(timezone.localtime(created_at).date(), created_at.date())
+        self.assertEqual(rollups.verify(), [])
+
+    def test_command_verifies_and_rebuilds(self):
+        self.post_json('/api/siri/add-expense/', {'amount': '10', 'category': 'Food'})
+        Expense.objects.create(user=self.user, amount=Decimal('5'), category=Category.objects.for_name(self.user, 'Food'))
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('rollups', 'verify', stdout=out)
+        self.assertIn('expected $15', out.getvalue())
+
+        call_command('rollups', 'rebuild', '--user', 'rollups', stdout=StringIO())
+        self.assertEqual(self.rollup_rows(), {('Food', timezone.localdate()): (Decimal('15'), 2)})
+        call_command('rollups', 'verify', stdout=StringIO())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SpendCounterTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create_user(username='counted', password='testpass123')
+        self.client.force_login(self.user)
+        self.month = timezone.localdate().replace(day=1)
+        self.food = Category.objects.for_name(self.user, 'Food')
+
+    def add_expense(self, amount, category='Food'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return insert_expense(self.user, {'amount': Decimal(amount), 'category': category, 'note': ''})
+
+    def spend(self):
+        return counters.month_spend(self.user, [(self.month, None), (self.month, self.food.id)])
+
+    def test_counters_follow_writes_without_queries(self):
+        self.add_expense('10')
+        self.assertEqual(self.spend(), {(self.month, None): Decimal('10'), (self.month, self.food.id): Decimal('10')})
+
+        self.add_expense('2.25')
+        self.add_expense('5', 'Rent')
+        with self.assertNumQueries(0):
+            spend = self.spend()
+        self.assertEqual(spend, {(self.month, None): Decimal('17.25'), (self.month, self.food.id): Decimal('12.25')})
+
+        expense = Expense.objects.get(amount=Decimal('2.25'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/month/', {'action': 'update_expense', 'expense_id': expense.id, 'category': 'Rent'})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/month/', {'action': 'delete_expense', 'expense_id': Expense.objects.get(amount=10).id})
+        with self.assertNumQueries(0):
+            spend = self.spend()
+        self.assertEqual(spend, {(self.month, None): Decimal('7.25'), (self.month, self.food.id): Decimal('0')})
+
+    def test_missing_or_expired_counters_are_rebuilt_from_the_database(self):
+        self.add_expense('10')
+        self.spend()
+        # A write the counters never saw, e.g. from the shell
+        Expense.objects.create(user=self.user, amount=Decimal('4'), category=self.food)
+        with self.captureOnCommitCallbacks(execute=True):
+            rollups.rebuild([self.user])
+        self.assertEqual(self.spend()[(self.month, None)], Decimal('14'))
+
+        caches['shared'].delete(counters.counter_key(self.user.id, self.month))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.spend()[(self.month, None)], Decimal('14'))
+
+        # Counters are only trusted for SPEND_COUNTER_TTL seconds
+        reset_caches()
+        with override_settings(SPEND_COUNTER_TTL=0):
+            for _ in range(2):
+                with self.assertNumQueries(1):
+                    self.spend()
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SpendSeriesTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create_user(username='charted', password='testpass123')
+        self.month_start = timezone.localdate().replace(day=1)
+
+    def add_expense(self, amount, category, day):
+        created_at = timezone.make_aware(timezone.datetime(day.year, day.month, day.day, 12))
+        with self.captureOnCommitCallbacks(execute=True):
+            return insert_expense(
+                self.user, {'amount': Decimal(amount), 'category': category, 'note': '', 'created_at': created_at}
+            )
+
+    def test_buckets_are_zero_filled(self):
+        monday = date(2025, 3, 3)
+        self.add_expense('5', 'Food', monday)
+        self.add_expense('7', 'Rent', monday + timedelta(days=2))
+        self.add_expense('1', 'Food', monday + timedelta(days=9))
+
+        starts, totals = series.spend_series(self.user, monday, monday + timedelta(days=13), 'week')
+        self.assertEqual(starts, [monday, monday + timedelta(days=7)])
+        self.assertEqual(totals, {None: [Decimal('12'), Decimal('1')]})
+
+        # Days outside the range don't count, even in a bucket that overlaps it
+        starts, totals = series.spend_series(self.user, monday + timedelta(days=1), monday + timedelta(days=3), 'day', True)
+        self.assertEqual(starts, [monday + timedelta(days=n) for n in (1, 2, 3)])
+        self.assertEqual(totals, {None: [0, Decimal('7'), 0], 'Rent': [0, Decimal('7'), 0]})
+
+        starts, totals = series.spend_series(self.user, date(2025, 1, 15), date(2025, 4, 2), 'month', True)
+        self.assertEqual(starts, [date(2025, 1, 1), date(2025, 2, 1), date(2025, 3, 1), date(2025, 4, 1)])
+        self.assertEqual(list(totals), [None, 'Rent', 'Food'])  # largest first
+        self.assertEqual(totals['Food'], [0, 0, Decimal('6'), 0])
+
+    def test_buckets_stop_at_the_last_date(self):
+        for start, end in [(date(9999, 12, 1), date.max), (date(9999, 12, 30), date.max),
+                           (date(9998, 11, 15), date.max), (date(2024, 2, 28), date(2025, 3, 2))]:
+            for bucket in series.BUCKETS:
+                starts = list(series.bucket_starts(start, end, bucket))
+                self.assertEqual(series.bucket_count(start, end, bucket), len(starts), (start, end, bucket))
+                self.assertEqual(starts[-1], series.bucket_start(end, bucket))
+        self.assertIsNone(series.next_bucket(date(9999, 12, 1), 'month'))
+        self.assertIsNone(series.next_bucket(date(9999, 12, 27), 'week'))
+        self.assertIsNone(series.next_bucket(date.max, 'day'))
+
+    def test_history_is_cached_until_a_write_touches_it(self):
+        last_month = self.month_start - timedelta(days=1)
+        self.add_expense('3', 'Food', last_month)
+        self.add_expense('4', 'Food', self.month_start)
+        start, end = last_month - timedelta(days=40), self.month_start + timedelta(days=1)
+
+        def month_totals():
+            return series.spend_series(self.user, start, end, 'month')[1][None][-2:]
+
+        self.assertEqual(month_totals(), [Decimal('3'), Decimal('4')])
+        # The cached history saves one of the two grouped queries
+        with self.assertNumQueries(1):
+            month_totals()
+
+        # Today's writes leave the history cached
+        self.add_expense('1', 'Food', self.month_start)
+        with self.assertNumQueries(1):
+            self.assertEqual(month_totals(), [Decimal('3'), Decimal('5')])
+
+        # A backdated write, or a rebuild, doesn't
+        self.add_expense('2', 'Food', last_month)
+        self.assertEqual(month_totals(), [Decimal('5'), Decimal('5')])
+        DailySpend.objects.filter(user=self.user).delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            rollups.rebuild([self.user])
+        self.assertEqual(month_totals(), [Decimal('5'), Decimal('5')])
+        with self.assertNumQueries(1):
+            month_totals()
+
+    def test_category_rename_refreshes_cached_names(self):
+        day = self.month_start - timedelta(days=3)
+        self.add_expense('3', 'Fod', day)
+        self.assertIn('Fod', series.spend_series(self.user, day, day, 'day', True)[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            category = Category.objects.get(user=self.user)
+            category.name = 'Food'
+            category.save()
+        self.assertEqual(list(series.spend_series(self.user, day, day, 'day', True)[1]), [None, 'Food'])
+
+
+OFX_STATEMENT = """OFXHEADER:100
+DATA:OFXSGML
+
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20260302120000[-5:EST]<TRNAMT>-4.50<FITID>1<NAME>STARBUCKS #123<MEMO>Card purchase
+</STMTTRN>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20260303<TRNAMT>1500.00<FITID>2<NAME>PAYROLL
+</STMTTRN>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20260304<TRNAMT>-60.25<FITID>3<NAME>SHELL OIL</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+
+@override_settings(CACHES=TEST_CACHES)
+class StatementImportTestCase(TestCase):
+    def setUp(self):
+        reset_caches()
+        self.user = User.objects.create_user(username='importer', password='testpass123')
+        Category.objects.for_name(self.user, 'Coffee')
+
+    def import_csv(self, text, **options):
+        importer = statements.StatementImport(self.user, batch_size=2)
+        counts = importer.import_rows(statements.csv_rows(StringIO(text), **options))
+        return importer, counts
+
+    def test_csv_statement(self):
+        text = (
+            "Date,Description,Amount\n"
+            "2026-03-01,Blue Bottle Coffee,-4.50\n"
+            "2026-03-01,Blue Bottle Coffee,-4.50\n"  # a second, identical purchase
+            "2026-03-02,Salary,2000.00\n"
+            "2026-03-02,Hardware store,\"-1,204.10\"\n"
+            "yesterday,Bakery,-3\n"
+        )
+        importer, counts = self.import_csv(text)
+        self.assertEqual(
+            dict(counts), {'read': 5, 'created': 3, 'duplicate': 0, 'skipped': 1, 'invalid': 1}
+        )
+        self.assertIn('Line 6', importer.errors[0])
+        expenses = Expense.objects.filter(user=self.user).order_by('id')
+        self.assertEqual(
+            [(e.local_date, e.amount, e.category.name) for e in expenses],
+            [(date(2026, 3, 1), Decimal('4.50'), 'Coffee'), (date(2026, 3, 1), Decimal('4.50'), 'Coffee'),
+             (date(2026, 3, 2), Decimal('1204.10'), 'Uncategorized')],
+        )
+        self.assertEqual(rollups.verify([self.user]), [])
+
+        # The same statement again, and one overlapping it, only add what's new
+        _, counts = self.import_csv(text)
+        self.assertEqual((counts['created'], counts['duplicate']), (0, 3))
+        _, counts = self.import_csv(text.replace('Salary', 'Blue Bottle Coffee').replace('2000.00', '-4.50'))
+        self.assertEqual((counts['created'], counts['duplicate']), (1, 3))
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 4)
+
+    def test_occurrences_are_counted_a_day_at_a_time(self):
+        importer, counts = self.import_csv(
+            "Date,Description,Amount\n"
+            "2026-03-02,Coffee,-3\n2026-03-02,Coffee,-3\n2026-03-01,Coffee,-3\n2026-03-02,Coffee,-3\n"
+        )
+        self.assertEqual((counts['created'], counts['invalid']), (3, 1))
+        self.assertIn('sort the statement by date', importer.errors[0])
+        self.assertEqual(len(importer.occurrences), 1)
+        self.assertEqual(Expense.objects.filter(user=self.user, local_date=date(2026, 3, 2)).count(), 2)
+
+    def test_concurrent_import_counts_conflicts_as_duplicates(self):
+        text = "Date,Description,Amount\n2026-03-01,Coffee,-3\n2026-03-01,Tea,-2\n2026-03-01,Cake,-4\n"
+        self.import_csv(text.replace('2026-03-01,Cake,-4\n', ''))
+        # As if another import committed them after this one looked the batch up
+        with mock.patch.object(statements.StatementImport, 'existing_hashes', return_value=set()):
+            _, counts = self.import_csv(text)
+        self.assertEqual((counts['created'], counts['duplicate']), (1, 2))
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(rollups.verify([self.user]), [])
+
+    def test_csv_columns_and_signs(self):
+        text = "Posted Date,Payee,Debit,Credit,Category\n03/05/2026,Corner Deli,12.00,,Lunch\n03/06/2026,Refund,,5.00,\n"
+        _, counts = self.import_csv(text, date_format='%m/%d/%Y')
+        self.assertEqual((counts['created'], counts['skipped']), (1, 1))
+        self.assertEqual(Expense.objects.get(user=self.user).category.name, 'Lunch')
+
+        _, counts = self.import_csv("When,What,Amount\n2026-03-07,Card charge,9.99\n", spend_sign=1,
+                                    columns={'date': 'When', 'description': 'what'})
+        self.assertEqual(counts['created'], 1)
+        with self.assertRaises(statements.StatementError):
+            self.import_csv("When,What\n2026-03-07,Card charge\n")
+
+    def test_ofx_statement_read_in_small_chunks(self):
+        rows = list(statements.ofx_rows(StringIO(OFX_STATEMENT), chunk_size=7))
+        self.assertEqual(rows, list(statements.ofx_rows(StringIO(OFX_STATEMENT))))
+        self.assertEqual(rows, [
+            (date(2026, 3, 2), Decimal('4.50'), 'STARBUCKS #123 Card purchase', None),
+            (date(2026, 3, 3), None, 'PAYROLL', None),
+            (date(2026, 3, 4), Decimal('60.25'), 'SHELL OIL', None),
+        ])
+
+    def test_command_reports_progress(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.ofx', delete=False) as statement:
+            statement.write(OFX_STATEMENT)
+        self.addCleanup(os.remove, statement.name)
+        out, err = StringIO(), StringIO()
+        call_command('import_statement', 'importer', statement.name, '--batch-size', '1', stdout=out, stderr=err)
+        self.assertIn('3 lines read: 2 imported, 0 already imported, 1 not spends', out.getvalue())
+        self.assertEqual(len(err.getvalue().splitlines()), 2)  # one progress line per batch
+        with self.assertRaises(CommandError):
+            call_command('import_statement', 'importer', '/nonexistent.csv')
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'exercises the SQLite FTS5 index')
+class SearchTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='searcher', password='testpass123')
+        self.other = User.objects.create_user(username='snoop', password='testpass123')
+
+    def add(self, category, note, user=None):
+        user = user or self.user
+        return Expense.objects.create(
+            user=user, amount=Decimal('1'), category=Category.objects.for_name(user, category), note=note,
+        )
+
+    def matches(self, text):
+        return set(search.search_expenses(Expense.objects.filter(user=self.user), self.user, text))
+
+    def test_prefix_matching_on_notes_and_categories(self):
+        latte = self.add('Coffee', 'Starbucks latte')
+        beans = self.add('Groceries', 'coffee beans from Trader Joe\'s')
+        self.add('Coffee', 'Starbucks latte', user=self.other)
+
+        self.assertEqual(self.matches('star'), {latte})
+        self.assertEqual(self.matches('coff'), {latte, beans})
+        self.assertEqual(self.matches('COFFEE bea'), {beans})
+        self.assertEqual(self.matches('trader joe'), {beans})
+        self.assertEqual(self.matches('coffee star'), {latte})  # words may match the category or the note
+        self.assertEqual(self.matches('"star*) NOT'), set())  # FTS5 syntax in the input is just words
+        self.assertEqual(self.matches('(star*'), {latte})
+        self.assertEqual(self.matches('tea'), set())
+
+    def test_index_follows_edits_deletes_and_renames(self):
+        expense = self.add('Food', 'lunch')
+        Expense.objects.filter(pk=expense.pk).update(note='dinner')
+        self.assertEqual(self.matches('lunch'), set())
+        self.assertEqual(self.matches('dinner'), {expense})
+
+        Category.objects.filter(pk=expense.category_id).update(name='Restaurants')
+        self.assertEqual(self.matches('restau'), {expense})
+
+        Expense.objects.bulk_create([Expense(
+            user=self.user, amount=Decimal('2'), category=expense.category, note='brunch',
+            local_date=expense.local_date, local_period=expense.local_period,
+        )])
+        self.assertEqual(len(self.matches('brunch')), 1)
+
+        expense.delete()
+        self.assertEqual(self.matches('dinner'), set())
+
+    def test_rebuild(self):
+        once = self.add('Misc', 'taxi home')
+        twice = self.add('Taxi', 'taxi to the airport')
+
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM siriapi_expense_fts")
+        self.assertEqual(self.matches('taxi'), set())
+        call_command('search_index', 'rebuild', stdout=StringIO())
+        self.assertEqual(self.matches('taxi'), {once, twice})
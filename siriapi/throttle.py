@@ -0,0 +1,186 @@
+"""
+Rate limiting and admission control for the Siri write endpoints.
+
+* Token buckets per API token and per user, kept in the "shared" cache so
+  every worker process sees the same state. Buckets are read-modify-write
+  without a lock, so concurrent requests can occasionally be over-admitted
+  by a request or two; that is fine for keeping one runaway Shortcut loop
+  from monopolising the database.
+* A cap on concurrent write requests across all worker processes on this
+  host, implemented as a pool of lock files. Locks are released by the OS
+  when a process dies, so a crashed worker never leaks a slot. Requests
+  that find no free slot are shed with 503 before they queue on the
+  database. A cap of 0 (or less) turns admission control off.
+
+Shed requests are counted in the shared cache; see stats().
+"""
+
+import fcntl
+import functools
+import hashlib
+import math
+import os
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+
+STAT_KEYS = ('rate_limited', 'overloaded')
+
+
+def _cache():
+    return caches[settings.SIRI_THROTTLE_CACHE]
+
+
+def take_token(key, rate_per_second, capacity):
+    """Take one token from the bucket at key. Returns seconds to wait, or 0 if allowed."""
+    cache = _cache()
+    now = time.time()
+    tokens, updated_at = cache.get(key) or (capacity, now)
+    tokens = min(capacity, tokens + (now - updated_at) * rate_per_second)
+    wait = 0.0
+    if tokens >= 1:
+        tokens -= 1
+    else:
+        wait = (1 - tokens) / rate_per_second
+    # Expire once the bucket would have refilled anyway
+    cache.set(key, (tokens, now), timeout=math.ceil(capacity / rate_per_second) + 1)
+    return wait
+
+
+def check_rate(user, api_token=None):
+    """Return a 429 response if user, or the per-user api_token used, is over its rate, else None"""
+    rate = settings.SIRI_RATE_LIMIT_PER_MINUTE / 60
+    burst = settings.SIRI_RATE_LIMIT_BURST
+    if rate <= 0:
+        return None
+
+    keys = [f'throttle:user:{user.pk}']
+    if api_token:
+        keys.append('throttle:token:' + hashlib.sha256(api_token.encode()).hexdigest()[:32])
+
+    wait = max(take_token(key, rate, burst) for key in keys)
+    if not wait:
+        return None
+    record_shed('rate_limited')
+    response = JsonResponse({'ok': False, 'error': 'Rate limit exceeded, slow down'}, status=429)
+    response['Retry-After'] = str(math.ceil(wait))
+    return response
+
+
+class SlotPool:
+    """Cross-process counting semaphore made of flock()ed files, non-blocking only"""
+
+    def __init__(self, directory, size):
+        self.directory = str(directory)
+        self.size = size
+        self._fds = {}
+        self._held = set()
+        self._lock = threading.Lock()
+
+    def _fd(self, slot):
+        if slot not in self._fds:
+            os.makedirs(self.directory, exist_ok=True)
+            self._fds[slot] = os.open(os.path.join(self.directory, f'slot-{slot}'), os.O_RDWR | os.O_CREAT, 0o600)
+        return self._fds[slot]
+
+    def acquire(self):
+        """Return a slot number, or None if all slots are busy"""
+        with self._lock:
+            for slot in range(self.size):
+                # flock() is per open file, so slots held by our own threads must be skipped
+                if slot in self._held:
+                    continue
+                try:
+                    fcntl.flock(self._fd(slot), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                self._held.add(slot)
+                return slot
+        return None
+
+    def release(self, slot):
+        with self._lock:
+            fcntl.flock(self._fds[slot], fcntl.LOCK_UN)
+            self._held.discard(slot)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_slot_pool():
+    """This process's SlotPool for the current settings, or None when writes aren't capped"""
+    global _pool
+    if settings.SIRI_MAX_CONCURRENT_WRITES <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None or (_pool.directory, _pool.size) != (
+            str(settings.SIRI_ADMISSION_DIR), settings.SIRI_MAX_CONCURRENT_WRITES
+        ):
+            _pool = SlotPool(settings.SIRI_ADMISSION_DIR, settings.SIRI_MAX_CONCURRENT_WRITES)
+        return _pool
+
+
+def overloaded_response():
+    record_shed('overloaded')
+    response = JsonResponse({'ok': False, 'error': 'Server busy, please retry shortly'}, status=503)
+    response['Retry-After'] = '1'
+    return response
+
+
+def admission_control(view):
+    """Shed the request with 503 when SIRI_MAX_CONCURRENT_WRITES requests are already running"""
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            pool = get_slot_pool()
+            if pool is None:
+                return await view(request, *args, **kwargs)
+            slot = pool.acquire()
+            if slot is None:
+                return overloaded_response()
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                pool.release(slot)
+    else:
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            pool = get_slot_pool()
+            if pool is None:
+                return view(request, *args, **kwargs)
+            slot = pool.acquire()
+            if slot is None:
+                return overloaded_response()
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                pool.release(slot)
+    return wrapper
+
+
+def record_shed(reason):
+    cache = _cache()
+    key = f'throttle:stats:{reason}'
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:  # evicted between add() and incr()
+        cache.set(key, 1, timeout=None)
+
+
+def stats():
+    """Shed counters since the cache was last cleared, plus the active limits"""
+    values = _cache().get_many([f'throttle:stats:{key}' for key in STAT_KEYS])
+    return {
+        'shed': {key: values.get(f'throttle:stats:{key}', 0) for key in STAT_KEYS},
+        'limits': {
+            'rate_per_minute': settings.SIRI_RATE_LIMIT_PER_MINUTE,
+            'burst': settings.SIRI_RATE_LIMIT_BURST,
+            'max_concurrent_writes': settings.SIRI_MAX_CONCURRENT_WRITES,
+        },
+    }
@@ -0,0 +1,125 @@
+"""
+Per-user API tokens for the Siri endpoints.
+
+Tokens are random strings handed to the user once; the database only keeps a
+SHA-256 digest, which is unique-indexed so authentication is a single lookup.
+Resolved tokens are kept in a small in-process cache so repeated calls from the
+same Shortcut don't touch the database at all.
+"""
+
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import ApiToken
+
+TOKEN_PREFIX = 't2l_'
+CACHE_MAX_ENTRIES = 1024
+
+_cache = OrderedDict()  # digest -> (user, token_id, expires_at)
+_cache_lock = threading.Lock()
+
+
+def hash_token(raw_token):
+    """Return the hex digest stored for a raw token"""
+    return hashlib.sha256(raw_token.encode()).hexdigest()
+
+
+def issue_token(user, name=''):
+    """Create a new token for user and return (ApiToken, raw_token).
+
+    The raw token is never stored, so it must be shown to the user right away.
+    """
+    raw_token = TOKEN_PREFIX + secrets.token_urlsafe(32)
+    token = ApiToken.objects.create(
+        user=user,
+        name=name,
+        prefix=raw_token[:len(TOKEN_PREFIX) + 6],
+        digest=hash_token(raw_token),
+    )
+    return token, raw_token
+
+
+def revoke_token(token):
+    """Revoke a token and drop it from this process's cache"""
+    if token.revoked_at is None:
+        token.revoked_at = timezone.now()
+        token.save(update_fields=['revoked_at'])
+    with _cache_lock:
+        _cache.pop(token.digest, None)
+
+
+def user_for_token(raw_token):
+    """Return the active user owning raw_token, or None.
+
+    Hits are cached for API_TOKEN_CACHE_SECONDS, so a revoked token stays valid
+    in other worker processes for at most that long.
+    """
+    digest = _digest_if_plausible(raw_token)
+    if digest is None:
+        return None
+    user = _cached_user(digest)
+    if user is not None:
+        return user
+
+    token = _active_tokens(digest).first()
+    if token is None or not token.user.is_active:
+        return None
+    # last_used_at is only refreshed on cache misses to keep auth write-free
+    ApiToken.objects.filter(pk=token.pk).update(last_used_at=timezone.now())
+    _remember(digest, token)
+    return token.user
+
+
+async def auser_for_token(raw_token):
+    """Async variant of user_for_token using the async ORM"""
+    digest = _digest_if_plausible(raw_token)
+    if digest is None:
+        return None
+    user = _cached_user(digest)
+    if user is not None:
+        return user
+
+    token = await _active_tokens(digest).afirst()
+    if token is None or not token.user.is_active:
+        return None
+    await ApiToken.objects.filter(pk=token.pk).aupdate(last_used_at=timezone.now())
+    _remember(digest, token)
+    return token.user
+
+
+def _digest_if_plausible(raw_token):
+    if not raw_token or not raw_token.startswith(TOKEN_PREFIX):
+        return None
+    return hash_token(raw_token)
+
+
+def _active_tokens(digest):
+    return ApiToken.objects.select_related('user').filter(digest=digest, revoked_at__isnull=True)
+
+
+def _cached_user(digest):
+    with _cache_lock:
+        entry = _cache.get(digest)
+        if entry and entry[2] > time.monotonic():
+            _cache.move_to_end(digest)
+            return entry[0]
+    return None
+
+
+def _remember(digest, token):
+    with _cache_lock:
+        _cache[digest] = (token.user, token.pk, time.monotonic() + settings.API_TOKEN_CACHE_SECONDS)
+        _cache.move_to_end(digest)
+        while len(_cache) > CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
@@ -1,9 +1,20 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 app_name = 'siriapi'
 
+if settings.SIRI_ASYNC_VIEWS:
+    # Served through ASGI: use the native async implementations
+    from . import async_views
+    ping, add_expense = async_views.ping, async_views.add_expense
+else:
+    ping, add_expense = views.ping, views.add_expense
+
 urlpatterns = [
-    path('ping/', views.ping, name='ping'),
-    path('add-expense/', views.add_expense, name='add_expense'),
-]
\ No newline at end of file
+    path('ping/', ping, name='ping'),
+    path('add-expense/', add_expense, name='add_expense'),
+    path('add-expenses/', views.add_expenses, name='add_expenses'),
+    path('utterance/', views.add_utterance, name='add_utterance'),
+    path('throttle-stats/', views.throttle_stats_view, name='throttle_stats'),
+]
@@ -0,0 +1,282 @@
+"""
+Parsing of free-form expense utterances such as
+"spent twelve fifty on coffee at Starbucks yesterday".
+
+parse_utterance() pulls out the amount (digits or spelled-out numbers), date
+words, the merchant after "at", and the category via the user's
+CategoryMatcher, falling back to the phrase after "on"/"for".
+"""
+
+import re
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.utils import timezone
+
+from .matcher import singular, words
+from .models import MAX_AMOUNT
+
+NUMBER_RE = re.compile(r"\$?\d[\d,]*(?:\.\d+)?$")
+
+UNITS = {
+    'zero': 0, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7,
+    'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12, 'thirteen': 13,
+    'fourteen': 14, 'fifteen': 15, 'sixteen': 16, 'seventeen': 17, 'eighteen': 18, 'nineteen': 19,
+}
+TENS = {
+    'twenty': 20, 'thirty': 30, 'forty': 40, 'fifty': 50,
+    'sixty': 60, 'seventy': 70, 'eighty': 80, 'ninety': 90,
+}
+CURRENCY = {'dollar', 'dollars', 'buck', 'bucks', 'usd'}
+CENTS = {'cent', 'cents'}
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+# Words that end a merchant or fallback category phrase
+PHRASE_STOP = {'at', 'on', 'for', 'in', 'from', 'with', 'today', 'tonight', 'yesterday', 'last', 'ago'}
+LEADING_FILLER = {'a', 'an', 'the', 'some', 'my', 'our'}
+# "N days ago" further back than this is a mistake, not an expense
+MAX_DAYS_BACK = 3660
+DATE_TOO_FAR_BACK = f"The date is too far back (at most {MAX_DAYS_BACK} days ago)"
+AMOUNT_TOO_LARGE = f"The amount is too large (at most {MAX_AMOUNT})"
+
+
+def _number(word):
+    """Decimal value of a digit token like "$1,250.50", or None"""
+    if not NUMBER_RE.match(word):
+        return None
+    try:
+        return Decimal(word.lstrip('$').replace(',', ''))
+    except InvalidOperation:
+        return None
+
+
+def _read_number_words(keys, i):
+    """Read spelled-out numbers starting at i.
+
+    Returns (chunks, end): a run like "twelve fifty" is two chunks [12, 50],
+    "one hundred and five" is one chunk [105].
+    """
+    chunks = []
+    total = current = 0
+    last = None  # kind of the previous word in the current chunk
+    while i < len(keys):
+        word = keys[i]
+        if word == 'a' and last is None and not chunks and i + 1 < len(keys) and keys[i + 1] in ('hundred', 'thousand'):
+            current, last = 1, 'unit'
+            i += 1
+            continue
+        if word == 'and' and last in ('hundred', 'thousand') and i + 1 < len(keys) and (
+            keys[i + 1] in UNITS or keys[i + 1] in TENS
+        ):
+            i += 1
+            continue
+        if word == 'hundred':
+            if last not in ('unit', 'teen', 'tens') or current >= 100:
+                break
+            current *= 100
+            last = 'hundred'
+            i += 1
+            continue
+        if word == 'thousand':
+            if last not in ('unit', 'teen', 'tens', 'hundred'):
+                break
+            total += current * 1000
+            current = 0
+            last = 'thousand'
+            i += 1
+            continue
+
+        if word in UNITS:
+            value = UNITS[word]
+            kind = 'unit' if value < 10 else 'teen'
+            fits = last in (None, 'hundred', 'thousand') or (last == 'tens' and 0 < value < 10)
+        elif word in TENS:
+            value = TENS[word]
+            kind = 'tens'
+            fits = last in (None, 'hundred', 'thousand')
+        else:
+            break
+        if not fits:  # "twelve fifty": start the next chunk
+            chunks.append(total + current)
+            total = current = 0
+        current += value
+        last = kind
+        i += 1
+    if last is not None:
+        chunks.append(total + current)
+    return chunks, i
+
+
+def _read_cents(keys, i):
+    """Read "[and] <number> cents" at i; returns (cents, end) or (None, i)"""
+    j = i + 1 if i < len(keys) and keys[i] == 'and' else i
+    if j < len(keys) and _number(keys[j]) is not None:
+        value, end = _number(keys[j]), j + 1
+    else:
+        chunks, end = _read_number_words(keys, j)
+        value = chunks[0] if len(chunks) == 1 else None
+    if value is not None and end < len(keys) and keys[end] in CENTS:
+        return Decimal(value), end + 1
+    return None, i
+
+
+def _amount_at(keys, i):
+    """Parse an amount starting at keys[i]; returns (amount, end) or (None, i)"""
+    number = _number(keys[i])
+    if number is not None:
+        amount, end = number, i + 1
+    else:
+        chunks, end = _read_number_words(keys, i)
+        if not chunks:
+            if keys[i] == 'a' and i + 1 < len(keys) and keys[i + 1] in CURRENCY:
+                chunks, end = [1], i + 1
+            else:
+                return None, i
+        amount = Decimal(chunks[0])
+        if len(chunks) > 1 and chunks[1] < 100:
+            # "twelve fifty", "one twenty five": dollars then cents
+            return amount + Decimal(chunks[1]) / 100, end
+        if len(chunks) > 1:
+            end = i + 1  # not an amount shape we understand; use the first number only
+        elif end < len(keys) - 1 and keys[end] == 'point':
+            digits = []
+            j = end + 1
+            while j < len(keys) and keys[j] in UNITS and UNITS[keys[j]] < 10:
+                digits.append(str(UNITS[keys[j]]))
+                j += 1
+            if digits:
+                amount += Decimal('0.' + ''.join(digits))
+                end = j
+
+    if end < len(keys) and keys[end] in CENTS:
+        return amount / 100, end + 1
+    if end < len(keys) and keys[end] in CURRENCY:
+        end += 1
+        cents, cents_end = _read_cents(keys, end)
+        if cents is not None and cents < 100:
+            return amount + cents / 100, cents_end
+    return amount, end
+
+
+def _days_back(keys, i, today):
+    """Parse a date phrase at keys[i]; returns (days before today, end) or (None, i)"""
+    word = keys[i]
+    if word in ('today', 'tonight'):
+        return 0, i + 1
+    if word == 'yesterday':
+        return 1, i + 1
+    if keys[i:i + 3] == ['day', 'before', 'yesterday']:
+        return 2, i + 3
+    if keys[i:i + 2] == ['last', 'week']:
+        return 7, i + 2
+    if word == 'last' and i + 1 < len(keys) and keys[i + 1] in WEEKDAYS:
+        return (today.weekday() - WEEKDAYS.index(keys[i + 1]) - 1) % 7 + 1, i + 2
+    if word == 'on' and i + 1 < len(keys) and keys[i + 1] in WEEKDAYS:
+        return (today.weekday() - WEEKDAYS.index(keys[i + 1])) % 7, i + 2
+    if word in WEEKDAYS:
+        return (today.weekday() - WEEKDAYS.index(word)) % 7, i + 1
+
+    # "3 days ago", "two weeks ago", "a week ago"
+    if word == 'a':
+        count, end = 1, i + 1
+    elif _number(word) is not None:
+        count, end = int(_number(word)), i + 1
+    else:
+        chunks, end = _read_number_words(keys, i)
+        if len(chunks) != 1:
+            return None, i
+        count = chunks[0]
+    unit = keys[end] if end < len(keys) else None
+    if end + 1 < len(keys) and keys[end + 1] == 'ago' and unit in ('day', 'days', 'week', 'weeks'):
+        return count * (7 if unit.startswith('week') else 1), end + 2
+    return None, i
+
+
+def _phrase(raw, keys, start, used):
+    """Original-case words from start up to a stop word or an already used word"""
+    end = start
+    while end < len(keys) and keys[end] not in PHRASE_STOP and end not in used:
+        end += 1
+    while start < end and keys[start] in LEADING_FILLER:
+        start += 1
+    return ' '.join(raw[start:end]), start, end
+
+
+def parse_utterance(text, matcher, now=None):
+    """Parse an utterance for one expense.
+
+    Returns (parsed, None) where parsed has amount, category, note, merchant,
+    created_at and category_source ('name', 'alias' or 'phrase'), or
+    (parsed_so_far, error message).
+    """
+    now = now or timezone.now()
+    today = timezone.localtime(now).date()
+    raw = words(text)
+    keys = [word.casefold() for word in raw]
+    used = set()
+    parsed = {
+        'amount': None, 'category': None, 'category_source': None,
+        'note': '', 'merchant': None, 'created_at': None,
+    }
+
+    date_error = None
+    for i in range(len(keys)):
+        days, end = _days_back(keys, i, today)
+        if days is not None:
+            used.update(range(i, end))
+            if days > MAX_DAYS_BACK:
+                date_error = DATE_TOO_FAR_BACK
+            elif days:
+                parsed['created_at'] = now - timedelta(days=days)
+            break
+
+    match = matcher.best_match(
+        [singular(key) for key in keys],
+        exclude=[(i, i + 1) for i in used],
+    )
+    category_span = set()
+    if match:
+        start, end, parsed['category'], parsed['category_source'] = match
+        category_span = set(range(start, end))
+        used |= category_span
+
+    amount_error = None
+    for i in range(len(keys)):
+        if i in used:
+            continue
+        amount, end = _amount_at(keys, i)
+        if amount is not None and not used.intersection(range(i, end)):
+            # Checked first: quantize() fails on more digits than the context holds
+            if not amount.is_finite() or amount > MAX_AMOUNT:
+                amount_error = AMOUNT_TOO_LARGE
+            else:
+                parsed['amount'] = amount.quantize(Decimal('0.01'))
+            used.update(range(i, end))
+            break
+
+    for i, key in enumerate(keys):
+        if key == 'at' and i not in used:
+            # The merchant may be what matched the category ("at Starbucks" as an alias)
+            merchant, start, end = _phrase(raw, keys, i + 1, used - category_span)
+            if merchant:
+                parsed['merchant'] = parsed['note'] = merchant
+                used.update(range(i, end))
+            break
+
+    if parsed['category'] is None:
+        for i, key in enumerate(keys):
+            if key in ('on', 'for') and i not in used:
+                phrase, start, end = _phrase(raw, keys, i + 1, used)
+                if phrase:
+                    parsed['category'] = phrase[0].upper() + phrase[1:]
+                    parsed['category_source'] = 'phrase'
+                    break
+
+    if date_error:
+        return parsed, date_error
+    if amount_error:
+        return parsed, amount_error
+    if parsed['amount'] is None:
+        return parsed, 'Could not find an amount in the utterance'
+    if parsed['category'] is None:
+        return parsed, 'Could not tell which category the expense belongs to'
+    return parsed, None
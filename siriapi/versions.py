@@ -0,0 +1,35 @@
+"""
+Per-user data versions: DataVersion.version goes up by one in the transaction
+of every change to a user's expenses, budgets or categories. Report ETags are
+derived from it, so an unchanged report can be answered with 304 Not Modified
+after a single primary-key lookup instead of its aggregation queries.
+
+Expense writes are covered by update_rollups(), which every expense write path
+already calls; budgets and categories by the signal handlers in
+siriapi.signals.
+"""
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import DataVersion
+
+
+def bump(user_ids):
+    """Advance the data version of each user"""
+    with transaction.atomic(savepoint=False):
+        # A fixed order, so concurrent bumps for several users can't deadlock
+        for user_id in sorted(set(user_ids)):
+            rows = DataVersion.objects.filter(user_id=user_id)
+            if rows.update(version=F('version') + 1):
+                continue
+            try:
+                with transaction.atomic():
+                    DataVersion.objects.create(user_id=user_id, version=1)
+            except IntegrityError:  # created concurrently
+                rows.update(version=F('version') + 1)
+
+
+def current(user):
+    """The user's data version; 0 until their data first changes"""
+    return DataVersion.objects.filter(user=user).values_list('version', flat=True).first() or 0
@@ -1,42 +1,60 @@
 import json
 import logging
 import os
-from decimal import Decimal, InvalidOperation
+from django.conf import settings
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth import authenticate
-from .models import Expense, SiriRequest
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from .idempotency import run_once, stored_responses
+from .ingest import (
+    ADD_EXPENSE_ENDPOINT,
+    clean_expense_data,
+    expense_response,
+    insert_expense,
+    request_id_error,
+    write_expense_batch_with_retry,
+)
+from .journal import Journal
+from .matcher import get_matcher, learn_alias
+from .throttle import admission_control, check_rate, stats as throttle_stats
+from .tokens import user_for_token
+from .utterance import DATE_TOO_FAR_BACK, parse_utterance
+from userprofile.models import user_timezone
 
 logger = logging.getLogger(__name__)
 
 SIRI_TOKEN = os.environ.get('SIRI_TOKEN')
 
-def authenticate_token(request):
-    """Authenticate using Bearer token only"""
-    if not SIRI_TOKEN:
-        logger.error("SIRI_TOKEN environment variable is not set")
-        return False
-    auth_header = (
+def get_auth_header(request):
+    """Return the Authorization header, allowing proxies that rename it"""
+    return (
         request.META.get('HTTP_AUTHORIZATION', '') or
         request.META.get('HTTP_X_AUTHORIZATION', '') or
         request.META.get('HTTP_X_ORIGINAL_AUTHORIZATION', '') or
         request.META.get('HTTP_X_HTTP_AUTHORIZATION', '')
     )
+
+
+def get_bearer_token(request):
+    auth_header = get_auth_header(request)
     if not auth_header.startswith('Bearer '):
+        return None
+    return auth_header[7:]  # Remove 'Bearer '
+
+
+def authenticate_token(request):
+    """Authenticate using the shared SIRI_TOKEN only"""
+    if not SIRI_TOKEN:
         return False
-    token = auth_header[7:]  # Remove 'Bearer '
-    return token == SIRI_TOKEN
+    token = get_bearer_token(request)
+    return token is not None and constant_time_compare(token, SIRI_TOKEN)
 
 
-def authenticate_user(request):
-    """Authenticate user with token + username/password"""
-    # First check token
-    if not authenticate_token(request):
-        logger.warning("Token authentication failed")  # Moved before return for reachability
-        return None
-    
-    # Then check user credentials
+def authenticate_password(request):
+    """Legacy auth: shared SIRI_TOKEN + username/password from the request data"""
     try:
         if request.method == 'POST':
             data = json.loads(request.body)
@@ -55,24 +73,70 @@ def authenticate_user(request):
             logger.warning(f"User authentication failed for username: {username}")
         
         return user
-    except (json.JSONDecodeError, KeyError) as e:
+    except (json.JSONDecodeError, KeyError, AttributeError) as e:
         logger.error(f"Error parsing request data: {e}")
         return None
 
+
+def authenticate_user(request):
+    """Authenticate with a per-user API token, or SIRI_TOKEN + username/password.
+
+    Per-user tokens are a single indexed lookup (usually served from cache); the
+    legacy path runs a full password hash and is kept for existing Shortcuts.
+    """
+    token = get_bearer_token(request)
+    if not token:
+        logger.warning("Token authentication failed")
+        return None
+
+    if authenticate_token(request):
+        return authenticate_password(request)
+
+    user = user_for_token(token)
+    if not user:
+        logger.warning("Token authentication failed")
+    return user
+
+
+def rate_limit_token(request):
+    """The per-user API token to rate limit on, or None for the shared SIRI_TOKEN"""
+    return None if authenticate_token(request) else get_bearer_token(request)
+
+
+def replayable_response(response, replayed):
+    json_response = JsonResponse(response)
+    if replayed:
+        json_response['Idempotent-Replayed'] = 'true'
+    return json_response
+
+
+def queued_response(receipt_id, cleaned):
+    return JsonResponse({
+        'ok': True,
+        'queued': True,
+        'message': f"Queued expense ${cleaned['amount']} to {cleaned['category']}",
+        'receipt_id': receipt_id,
+    }, status=202)
+
+
+def queue_expense(user, cleaned, request_id):
+    """Journal ingestion mode: append to the write-ahead journal and answer 202.
+
+    A request_id that was already committed still replays its stored response.
+    """
+    if request_id:
+        replay = stored_responses(user, [request_id], ADD_EXPENSE_ENDPOINT)
+        if request_id in replay:
+            return replayable_response(replay[request_id], True)
+    receipt_id = Journal().append(user.id, cleaned, request_id)
+    return queued_response(receipt_id, cleaned)
+
+
 @csrf_exempt
 @require_http_methods(["GET"])
 def ping(request):
-    if not SIRI_TOKEN:
-        logger.error("SIRI_TOKEN environment variable is not set")
-        return JsonResponse({'ok': False, 'error': 'Server misconfiguration: SIRI_TOKEN not set'}, status=500)
-
     # allow proxies that rename the Authorization header
-    ping_auth = (
-        request.META.get('HTTP_AUTHORIZATION', '') or
-        request.META.get('HTTP_X_AUTHORIZATION', '') or
-        request.META.get('HTTP_X_ORIGINAL_AUTHORIZATION', '') or
-        request.META.get('HTTP_X_HTTP_AUTHORIZATION', '')
-    )
+    ping_auth = get_auth_header(request)
 
     if not ping_auth:
         logger.warning("Ping failed: missing Authorization header")
@@ -84,13 +148,9 @@ def ping(request):
 
 @csrf_exempt
 @require_http_methods(["GET", "POST"])
+@admission_control
 def add_expense(request):
-    # Fail early with clear server-side config errors
-    if not SIRI_TOKEN:
-        logger.error("SIRI_TOKEN environment variable is not set")
-        return JsonResponse({'ok': False, 'error': 'Server misconfiguration: SIRI_TOKEN not set'}, status=500)
-
-    auth_header = request.META.get('HTTP_AUTHORIZATION', '')
+    auth_header = get_auth_header(request)
     if not auth_header:
         logger.warning("Add expense failed: missing Authorization header")
         return JsonResponse({'ok': False, 'error': 'Unauthorized - missing Authorization header'}, status=401)
@@ -101,6 +161,9 @@ def add_expense(request):
     user = authenticate_user(request)
     if not user:
         return JsonResponse({'ok': False, 'error': 'Unauthorized - invalid credentials or token'}, status=401)
+    limited = check_rate(user, rate_limit_token(request))
+    if limited:
+        return limited
     
     # Get data from POST body or GET parameters
     if request.method == 'POST':
@@ -112,47 +175,188 @@ def add_expense(request):
         data = request.GET.dict()
         # Note: GET requests are not recommended for production use with sensitive data
     
-    amount = data.get('amount')
-    category = data.get('category', '').strip()
-    note = data.get('note', '')
+    cleaned, error = clean_expense_data(data)
+    if error:
+        return JsonResponse({'ok': False, 'error': error}, status=400)
     request_id = data.get('request_id')
 
-    # Validate amount
+    if settings.SIRI_INGEST_MODE == 'journal':
+        return queue_expense(user, cleaned, str(request_id) if request_id else None)
+
+    def create_expense():
+        expense = insert_expense(user, cleaned)
+        logger.info(f"Added expense: {expense}")
+        return expense_response(expense)
+
+    # The idempotency key is written in the same transaction as the expense;
+    # a retry conflicts on it and gets the original response back.
+    response, replayed = run_once(
+        user, str(request_id) if request_id else None, ADD_EXPENSE_ENDPOINT, create_expense
+    )
+    return replayable_response(response, replayed)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@admission_control
+def add_expenses(request):
+    """Add many expenses in one request (e.g. a Shortcut replaying an offline backlog).
+
+    Body: {"expenses": [{"amount", "category", "note", "request_id"}, ...]}
+
+    Every item is validated, items whose request_id was already processed are
+    skipped with one set-based lookup, and the rest are written with bulk
+    inserts in a single transaction. The response reports each item's outcome
+    in input order.
+    """
+    auth_header = get_auth_header(request)
+    if not auth_header:
+        logger.warning("Add expenses failed: missing Authorization header")
+        return JsonResponse({'ok': False, 'error': 'Unauthorized - missing Authorization header'}, status=401)
+    if not auth_header.startswith('Bearer '):
+        logger.warning("Add expenses failed: Authorization header not using Bearer scheme")
+        return JsonResponse({'ok': False, 'error': 'Unauthorized - Authorization header must use Bearer token'}, status=401)
+
+    user = authenticate_user(request)
+    if not user:
+        return JsonResponse({'ok': False, 'error': 'Unauthorized - invalid credentials or token'}, status=401)
+    limited = check_rate(user, rate_limit_token(request))
+    if limited:
+        return limited
+
     try:
-        amount = Decimal(amount)
-        if amount <= 0:
-            raise ValueError
-    except (TypeError, ValueError, InvalidOperation):
-        return JsonResponse({'ok': False, 'error': 'Invalid amount: must be a positive number'}, status=400)
-
-    # Validate category
-    if not category:
-        return JsonResponse({'ok': False, 'error': 'Category is required'}, status=400)
-    if len(category) > 80:
-        return JsonResponse({'ok': False, 'error': 'Category too long (max 80 characters)'}, status=400)
-
-    # Idempotency check
-    if request_id:
-        if SiriRequest.objects.filter(request_id=request_id, endpoint='add-expense').exists():
-            return JsonResponse({
-                'ok': True,
-                'message': 'Already processed',
-                'expense_id': None,
-                'created_at': None
-            })
-
-    # Create expense
-    expense = Expense.objects.create(user=user, amount=amount, category=category, note=note)
-
-    # Record request_id if provided
-    if request_id:
-        SiriRequest.objects.create(request_id=request_id, endpoint='add-expense')
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'ok': False, 'error': 'Invalid JSON'}, status=400)
 
-    logger.info(f"Added expense: {expense}")
+    items = data.get('expenses') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return JsonResponse({'ok': False, 'error': 'expenses must be a non-empty list'}, status=400)
+    if len(items) > settings.SIRI_MAX_BATCH_SIZE:
+        return JsonResponse(
+            {'ok': False, 'error': f'Too many expenses (max {settings.SIRI_MAX_BATCH_SIZE} per request)'},
+            status=400,
+        )
 
-    return JsonResponse({
-        'ok': True,
-        'message': f"Added expense ${expense.amount} to {expense.category}",
-        'expense_id': expense.id,
-        'created_at': expense.created_at.isoformat()
-    })
\ No newline at end of file
+    results = []
+    pending = []  # (result, cleaned, request_id) for valid items
+    for index, item in enumerate(items):
+        cleaned, error = clean_expense_data(item)
+        request_id = item.get('request_id') if isinstance(item, dict) else None
+        result = {'index': index, 'request_id': request_id}
+        results.append(result)
+        if error:
+            result.update(status='invalid', error=error)
+        else:
+            pending.append((result, cleaned, str(request_id) if request_id else None))
+
+    outcomes = write_expense_batch_with_retry(
+        user, [(cleaned, request_id) for _, cleaned, request_id in pending]
+    )
+
+    for (result, _, _), (status, response) in zip(pending, outcomes):
+        result.update(status=status, expense_id=response['expense_id'], created_at=response['created_at'])
+
+    counts = {'created': 0, 'duplicate': 0, 'invalid': 0}
+    for result in results:
+        counts[result['status']] += 1
+    logger.info(f"Added {counts['created']} expenses in batch for {user.username}")
+
+    return JsonResponse({'ok': True, **counts, 'results': results})
+
+
+def parsed_json(parsed):
+    return {
+        **parsed,
+        'amount': str(parsed['amount']) if parsed['amount'] is not None else None,
+        'created_at': parsed['created_at'].isoformat() if parsed['created_at'] else None,
+    }
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@admission_control
+def add_utterance(request):
+    """Add an expense from what the user said, e.g. "spent twelve fifty on coffee at Starbucks".
+
+    amount, category or note in the body override the parsed values. When the
+    category is given or recognised by name, the merchant ("at Starbucks") is
+    learned as an alias for it. With "dry_run": true nothing is saved.
+    """
+    auth_header = get_auth_header(request)
+    if not auth_header:
+        logger.warning("Utterance failed: missing Authorization header")
+        return JsonResponse({'ok': False, 'error': 'Unauthorized - missing Authorization header'}, status=401)
+    if not auth_header.startswith('Bearer '):
+        logger.warning("Utterance failed: Authorization header not using Bearer scheme")
+        return JsonResponse({'ok': False, 'error': 'Unauthorized - Authorization header must use Bearer token'}, status=401)
+
+    user = authenticate_user(request)
+    if not user:
+        return JsonResponse({'ok': False, 'error': 'Unauthorized - invalid credentials or token'}, status=401)
+    limited = check_rate(user, rate_limit_token(request))
+    if limited:
+        return limited
+
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'ok': False, 'error': 'Invalid JSON'}, status=400)
+    text = data.get('text') if isinstance(data, dict) else None
+    if not isinstance(text, str) or not text.strip():
+        return JsonResponse({'ok': False, 'error': 'Text is required'}, status=400)
+    invalid = request_id_error(data.get('request_id'))
+    if invalid:
+        return JsonResponse({'ok': False, 'error': invalid}, status=400)
+
+    # "yesterday", "last friday" etc. are on the user's wall clock
+    with timezone.override(user_timezone(user)):
+        parsed, error = parse_utterance(text, get_matcher(user.id))
+    if error == DATE_TOO_FAR_BACK:
+        # Unlike a missing amount or category, the body can't override the date
+        return JsonResponse({'ok': False, 'error': error, 'parsed': parsed_json(parsed)}, status=400)
+    if data.get('category'):
+        parsed['category_source'] = 'request'
+    for field in ('amount', 'category', 'note'):
+        if data.get(field):
+            parsed[field] = data[field]
+    cleaned, invalid = clean_expense_data(parsed)
+    if invalid:
+        if parsed['amount'] is not None and parsed['category']:
+            error = invalid  # the parse error, if any, was overridden
+        # Tell the Shortcut what was understood so it can ask for the rest
+        return JsonResponse({'ok': False, 'error': error, 'parsed': parsed_json(parsed)}, status=400)
+    if parsed['created_at']:
+        cleaned['created_at'] = parsed['created_at']
+    parsed.update(cleaned)
+    if data.get('dry_run'):
+        return JsonResponse({'ok': True, 'dry_run': True, 'parsed': parsed_json(parsed)})
+
+    learn = parsed['merchant'] and parsed['category_source'] in ('name', 'request')
+    request_id = str(data['request_id']) if data.get('request_id') else None
+
+    if settings.SIRI_INGEST_MODE == 'journal':
+        if learn:
+            learn_alias(user, parsed['merchant'], cleaned['category'])
+        return queue_expense(user, cleaned, request_id)
+
+    def create_expense():
+        if learn:
+            learn_alias(user, parsed['merchant'], cleaned['category'])
+        expense = insert_expense(user, cleaned)
+        logger.info(f"Added expense from utterance: {expense}")
+        return {**expense_response(expense), 'parsed': parsed_json(parsed)}
+
+    # Same idempotency keys as add-expense: either endpoint replays the other's retry
+    response, replayed = run_once(user, request_id, ADD_EXPENSE_ENDPOINT, create_expense)
+    return replayable_response(response, replayed)
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def throttle_stats_view(request):
+    """Rate limiting / load shedding counters, for staff API tokens"""
+    user = authenticate_user(request)
+    if not user or not user.is_staff:
+        return JsonResponse({'ok': False, 'error': 'Unauthorized - staff token required'}, status=401)
+    return JsonResponse({'ok': True, **throttle_stats()})
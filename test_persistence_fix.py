@@ -10,7 +10,7 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "apiAccess.settings")
 django.setup()
 
 from django.contrib.auth.models import User
-from siriapi.models import Expense, Budget
+from siriapi.models import Budget, Category, Expense
 from userprofile.models import UserProfile
 from django.test import Client
 from django.utils import timezone
@@ -55,7 +55,7 @@ def test_user_data_persistence():
         Expense.objects.create(
             user=user,
             amount=expense_data['amount'],
-            category=expense_data['category'],
+            category=Category.objects.for_name(user, expense_data['category']),
             note=expense_data['note'],
             created_at=now
         )
@@ -67,7 +67,7 @@ def test_user_data_persistence():
     budget = Budget.objects.create(
         user=user,
         period=month_str,
-        category='',
+        category=None,
         amount=500.00
     )
     print(f"✓ Created budget: ${budget.amount} for {month_str}")
@@ -7,7 +7,7 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "apiAccess.settings")
 django.setup()
 
 from django.contrib.auth.models import User
-from siriapi.models import Expense, Budget
+from siriapi.models import Budget, Category, Expense
 from userprofile.models import UserProfile, UserSubscription
 from django.utils import timezone
 from django.test import Client
@@ -47,13 +47,13 @@ def test_user_data_isolation():
     exp1_1 = Expense.objects.create(
         user=user1,
         amount=50.00,
-        category='Food',
+        category=Category.objects.for_name(user1, 'Food'),
         note='Lunch'
     )
     exp1_2 = Expense.objects.create(
         user=user1,
         amount=25.00,
-        category='Transport',
+        category=Category.objects.for_name(user1, 'Transport'),
         note='Gas'
     )
     
@@ -63,7 +63,7 @@ def test_user_data_isolation():
     exp2_1 = Expense.objects.create(
         user=user2,
         amount=100.00,
-        category='Shopping',
+        category=Category.objects.for_name(user2, 'Shopping'),
         note='Clothes'
     )
     
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-17 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("userprofile", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userprofile",
+            name="timezone",
+            field=models.CharField(default="America/New_York", max_length=64),
+        ),
+    ]
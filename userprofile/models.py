@@ -1,3 +1,7 @@
+import functools
+import zoneinfo
+
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
 
@@ -27,7 +31,33 @@ class UserProfile(models.Model):
     """Extended user profile with additional information"""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     phone_number = models.CharField(max_length=20, null=True, blank=True)
+    # IANA name; expense dates and reports follow the user's wall clock
+    timezone = models.CharField(max_length=64, default=settings.TIME_ZONE)
     created_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
         return f"{self.user.username} Profile"
+
+
+@functools.cache
+def timezone_names():
+    """Every IANA time zone name, sorted; available_timezones() walks the tz database on disk, so once per process"""
+    return tuple(sorted(zoneinfo.available_timezones()))
+
+
+def is_valid_timezone(name):
+    return name in timezone_names()
+
+
+def user_timezone(user):
+    """The user's time zone (TIME_ZONE without a profile), remembered on the user object"""
+    if not hasattr(user, '_timezone'):
+        try:
+            name = user.profile.timezone
+        except UserProfile.DoesNotExist:
+            name = settings.TIME_ZONE
+        try:
+            user._timezone = zoneinfo.ZoneInfo(name)
+        except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+            user._timezone = zoneinfo.ZoneInfo(settings.TIME_ZONE)
+    return user._timezone
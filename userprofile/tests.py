@@ -1,6 +1,9 @@
+import zoneinfo
+from unittest import mock
+
 from django.test import TestCase
 from django.contrib.auth.models import User
-from .models import UserSubscription, UserProfile
+from .models import UserSubscription, UserProfile, timezone_names
 
 
 class UserProfileTestCase(TestCase):
@@ -16,6 +19,30 @@ class UserProfileTestCase(TestCase):
         self.assertEqual(profile.user, self.user)
         self.assertIsNone(profile.phone_number)
 
+    def test_update_profile_sets_a_valid_timezone(self):
+        profile = UserProfile.objects.create(user=self.user)
+        self.assertEqual(profile.timezone, 'America/New_York')
+        self.client.force_login(self.user)
+
+        self.client.post('/profile/profile/update/', {'timezone': 'Europe/Berlin'})
+        profile.refresh_from_db()
+        self.assertEqual(profile.timezone, 'Europe/Berlin')
+
+        self.client.post('/profile/profile/update/', {'timezone': 'Mars/Olympus_Mons'})
+        profile.refresh_from_db()
+        self.assertEqual(profile.timezone, 'Europe/Berlin')
+
+    def test_timezone_list_is_read_once(self):
+        self.client.force_login(self.user)
+        timezone_names.cache_clear()
+        with mock.patch('zoneinfo.available_timezones', wraps=zoneinfo.available_timezones) as available:
+            for _ in range(2):
+                response = self.client.get('/profile/profile/')
+                self.assertIn('Europe/Berlin', response.context['timezones'])
+            self.client.post('/profile/profile/update/', {'timezone': 'Europe/Berlin'})
+        self.assertEqual(available.call_count, 1)
+        self.assertEqual(self.user.profile.timezone, 'Europe/Berlin')
+
     def test_user_subscription_creation(self):
         subscription = UserSubscription.objects.create(
             user=self.user,
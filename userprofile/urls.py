@@ -10,5 +10,6 @@ urlpatterns = [
     path('payment/cancel/', views.payment_cancel, name='payment_cancel'),
     path('profile/', views.user_profile, name='user_profile'),
     path('profile/update/', views.update_profile, name='update_profile'),
+    path('profile/tokens/', views.manage_api_tokens, name='manage_api_tokens'),
     path('webhook/stripe/', views.stripe_webhook, name='stripe_webhook'),
 ]
@@ -14,8 +14,10 @@ from django.urls import reverse
 from django.utils import timezone
 from datetime import timedelta
 from .forms import RegisterUserForm
-from .models import UserSubscription, UserProfile
-from siriapi.models import Expense, Budget
+from .models import UserSubscription, UserProfile, is_valid_timezone, timezone_names
+from siriapi.models import Expense, Budget, ApiToken
+from siriapi.tokens import issue_token, revoke_token
+from siriapi.counters import month_spend
 
 # Set Stripe API key
 stripe.api_key = settings.STRIPE_SECRET_KEY
@@ -210,27 +212,16 @@ def user_profile(request):
         subscription = None
     
     # Get user's recent expenses
-    recent_expenses = Expense.objects.filter(user=request.user).order_by('-created_at')[:5]
+    recent_expenses = Expense.objects.filter(user=request.user).select_related('category').order_by('-created_at')[:5]
     total_expenses = Expense.objects.filter(user=request.user).count()
     
     # Get current month budget info
-    from datetime import datetime, timedelta
-    current_month = datetime.now().strftime('%Y-%m')
-    overall_budget = Budget.objects.filter(user=request.user, period=current_month, category='').first()
+    current_month = timezone.localdate().strftime('%Y-%m')
+    overall_budget = Budget.objects.filter(user=request.user, period=current_month, category__isnull=True).first()
     
-    # Calculate current month spending using date range (more reliable with timezones)
-    from django.db.models import Sum
-    start_date = datetime.now().replace(day=1).date()
-    if datetime.now().month == 12:
-        end_date = datetime(datetime.now().year + 1, 1, 1).date() - timedelta(days=1)
-    else:
-        end_date = datetime(datetime.now().year, datetime.now().month + 1, 1).date() - timedelta(days=1)
-    
-    current_month_expenses = Expense.objects.filter(
-        user=request.user,
-        created_at__date__range=(start_date, end_date)
-    )
-    total_spent_this_month = current_month_expenses.aggregate(total=Sum('amount'))['total'] or 0
+    # Current month spending, from the cached month-to-date counter
+    start_date = timezone.localdate().replace(day=1)
+    total_spent_this_month = month_spend(request.user, [(start_date, None)])[(start_date, None)]
     
     budget_info = None
     if overall_budget:
@@ -244,12 +235,18 @@ def user_profile(request):
             'is_over': remaining < 0,
         }
     
+    api_tokens = request.user.api_tokens.filter(revoked_at__isnull=True).order_by('-created_at')
+
     context = {
         'user_profile': user_profile,
         'subscription': subscription,
         'recent_expenses': recent_expenses,
         'total_expenses': total_expenses,
         'budget_info': budget_info,
+        'api_tokens': api_tokens,
+        'timezones': timezone_names(),
+        # A freshly issued token is shown exactly once
+        'new_api_token': request.session.pop('new_api_token', None),
     }
     return render(request, 'userprofile/profile.html', context)
 
@@ -265,6 +262,10 @@ def update_profile(request):
     
     phone_number = request.POST.get('phone_number', '')
     user_profile.phone_number = phone_number
+    # Only applies to expenses recorded from now on; existing ones keep their dates
+    timezone_name = request.POST.get('timezone')
+    if timezone_name and is_valid_timezone(timezone_name):
+        user_profile.timezone = timezone_name
     user_profile.save()
     
     request.user.first_name = request.POST.get('first_name', '')
@@ -275,6 +276,25 @@ def update_profile(request):
     return redirect('userprofile:user_profile')
 
 
+@login_required(login_url='/accounts/login/')
+@require_http_methods(["POST"])
+def manage_api_tokens(request):
+    """Issue or revoke the user's Siri API tokens"""
+    action = request.POST.get('action')
+    if action == 'issue':
+        name = request.POST.get('name', '').strip()[:80]
+        token, raw_token = issue_token(request.user, name=name)
+        request.session['new_api_token'] = raw_token
+    elif action == 'revoke':
+        token_id = request.POST.get('token_id')
+        if token_id:
+            try:
+                revoke_token(ApiToken.objects.get(user=request.user, id=token_id))
+            except (ApiToken.DoesNotExist, ValueError):
+                pass
+    return redirect('userprofile:user_profile')
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def stripe_webhook(request):
@@ -7,7 +7,7 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "apiAccess.settings")
 django.setup()
 
 from django.contrib.auth.models import User
-from siriapi.models import Expense
+from siriapi.models import Category, Expense
 from django.utils import timezone
 
 def main():
@@ -24,10 +24,10 @@ def main():
     
     # Add expenses for each user
     for i in range(5):
-        Expense.objects.create(user=u1, amount=10+i, category=f'Cat{i}', note=f'Note {i}')
+        Expense.objects.create(user=u1, amount=10+i, category=Category.objects.for_name(u1, f'Cat{i}'), note=f'Note {i}')
     
     for i in range(3):
-        Expense.objects.create(user=u2, amount=20+i, category=f'Exp{i}', note=f'Note {i}')
+        Expense.objects.create(user=u2, amount=20+i, category=Category.objects.for_name(u2, f'Exp{i}'), note=f'Note {i}')
     
     print("\n✓ Setup: Created 2 users with 5 and 3 expenses respectively")
     